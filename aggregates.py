@@ -0,0 +1,199 @@
+import math
+import time
+from collections import deque
+
+# --- Configuration ---
+# Sliding windows kept over the live samples, by the suffix of their derived field names
+AGGREGATE_WINDOWS = {"1m": 60, "10m": 600, "60m": 3600}
+# liveData field -> statistics kept over every window ("mean", "min", "max")
+AGGREGATE_FIELDS = {
+    "outsideTempC": ("mean", "min", "max"),
+    "windSpeedMs": ("mean", "max"),
+    "rainRateMmHr": ("mean", "max"),
+    "barometerHpa": ("mean",),
+}
+# Rain fallen within each window is summed from the increments of this counter
+RAIN_TOTAL_FIELD = "dailyRainMm"
+# Derived values are rounded to this many decimals
+AGGREGATE_DIGITS = 2
+
+class RollingWindow:
+    """
+    Sum, mean, minimum and maximum of the values added during the last
+    `seconds`. Adding a value and expiring old ones are O(1) amortized: the
+    sum is kept running, and the minimum and maximum are the heads of two
+    monotonic deques, so nothing is rescanned when a value leaves.
+    """
+
+    __slots__ = ("seconds", "values", "total", "minima", "maxima")
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.values = deque()
+        self.total = 0.0
+        # (time, value) with increasing values: the head is the minimum
+        self.minima = deque()
+        # (time, value) with decreasing values: the head is the maximum
+        self.maxima = deque()
+
+    def add(self, now, value):
+        self.values.append((now, value))
+        self.total += value
+        minima, maxima = self.minima, self.maxima
+        while minima and minima[-1][1] >= value:
+            minima.pop()
+        minima.append((now, value))
+        while maxima and maxima[-1][1] <= value:
+            maxima.pop()
+        maxima.append((now, value))
+
+    def expire(self, now):
+        start = now - self.seconds
+        values = self.values
+        while values and values[0][0] <= start:
+            self.total -= values.popleft()[1]
+        if not values:
+            # Also drops the rounding error the running sum picked up
+            self.total = 0.0
+        while self.minima and self.minima[0][0] <= start:
+            self.minima.popleft()
+        while self.maxima and self.maxima[0][0] <= start:
+            self.maxima.popleft()
+
+    def __len__(self):
+        return len(self.values)
+
+    def mean(self):
+        return self.total / len(self.values) if self.values else None
+
+    def min(self):
+        return self.minima[0][1] if self.minima else None
+
+    def max(self):
+        return self.maxima[0][1] if self.maxima else None
+
+class VectorWindow:
+    """
+    Vector average of the wind over the last `seconds`: the running sums of
+    the east and north components of every (speed, direction) sample give
+    the mean direction and the resultant speed without revisiting samples.
+    """
+
+    __slots__ = ("seconds", "values", "east", "north")
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.values = deque()
+        self.east = 0.0
+        self.north = 0.0
+
+    def add(self, now, speed, direction):
+        angle = math.radians(direction)
+        east, north = speed * math.sin(angle), speed * math.cos(angle)
+        self.values.append((now, east, north))
+        self.east += east
+        self.north += north
+
+    def expire(self, now):
+        start = now - self.seconds
+        values = self.values
+        while values and values[0][0] <= start:
+            _, east, north = values.popleft()
+            self.east -= east
+            self.north -= north
+        if not values:
+            self.east = self.north = 0.0
+
+    def speed(self):
+        return math.hypot(self.east, self.north) / len(self.values) if self.values else None
+
+    def direction(self):
+        """Mean direction in degrees, or None when the wind was calm throughout."""
+        if not self.values or math.hypot(self.east, self.north) < 1e-9:
+            return None
+        return math.degrees(math.atan2(self.east, self.north)) % 360
+
+def derived_field_names(windows=AGGREGATE_WINDOWS, fields=AGGREGATE_FIELDS):
+    """Every derived field name, e.g. outsideTempCMean10m, in output order."""
+    names = []
+    for suffix in windows:
+        for field, statistics in fields.items():
+            names += [f"{field}{statistic.capitalize()}{suffix}" for statistic in statistics]
+        names += [f"windVectorSpeedMs{suffix}", f"windVectorDirectionDeg{suffix}", f"rainMm{suffix}"]
+    return names
+
+DERIVED_FIELDS = derived_field_names()
+
+class RollingAggregates:
+    """
+    Rolling statistics over the live samples, updated incrementally as each
+    LOOP sample arrives so that neither the API nor push clients have to
+    reprocess history. add() returns the derived fields as a flat dict
+    named <field><Statistic><window>, plus the vector-averaged wind
+    (windVectorSpeedMs, windVectorDirectionDeg) and the rain fallen
+    (rainMm) per window. Windows cover the last N seconds of the monotonic
+    clock, so a console clock change does not disturb them.
+    """
+
+    def __init__(self, windows=AGGREGATE_WINDOWS, fields=AGGREGATE_FIELDS):
+        self.windows = windows
+        self.fields = fields
+        self.series = {
+            (field, suffix): RollingWindow(seconds)
+            for suffix, seconds in windows.items() for field in fields
+        }
+        self.wind = {suffix: VectorWindow(seconds) for suffix, seconds in windows.items()}
+        self.rain = {suffix: RollingWindow(seconds) for suffix, seconds in windows.items()}
+        self.last_rain_total = None
+        # (window suffix, [(series, [(statistic, derived name)])]), named once up front
+        self.outputs = [
+            (suffix, [(self.series[field, suffix],
+                       [(statistic, f"{field}{statistic.capitalize()}{suffix}") for statistic in statistics])
+                      for field, statistics in fields.items()])
+            for suffix in windows
+        ]
+
+    def add(self, sample, now=None):
+        """Adds one liveData sample and returns the updated derived fields."""
+        now = time.monotonic() if now is None else now
+        for (field, _), window in self.series.items():
+            value = sample.get(field)
+            if value is not None:
+                window.add(now, value)
+
+        speed, direction = sample.get("windSpeedMs"), sample.get("windDirectionDeg")
+        if speed is not None and direction is not None:
+            for window in self.wind.values():
+                window.add(now, speed, direction)
+
+        total = sample.get(RAIN_TOTAL_FIELD)
+        if total is not None:
+            if self.last_rain_total is not None:
+                # The daily total restarts from zero at midnight
+                fallen = total - self.last_rain_total if total >= self.last_rain_total else total
+                for window in self.rain.values():
+                    window.add(now, fallen)
+            self.last_rain_total = total
+        return self.values(now)
+
+    def values(self, now=None):
+        now = time.monotonic() if now is None else now
+        derived = {}
+        for suffix, series in self.outputs:
+            for window, statistics in series:
+                window.expire(now)
+                for statistic, name in statistics:
+                    derived[name] = _rounded(getattr(window, statistic)())
+            wind = self.wind[suffix]
+            wind.expire(now)
+            derived[f"windVectorSpeedMs{suffix}"] = _rounded(wind.speed())
+            direction = _rounded(wind.direction())
+            # A mean just below north rounds up to 360, which is reported as 0
+            derived[f"windVectorDirectionDeg{suffix}"] = None if direction is None else direction % 360
+            rain = self.rain[suffix]
+            rain.expire(now)
+            derived[f"rainMm{suffix}"] = _rounded(rain.total) if len(rain) else None
+        return derived
+
+def _rounded(value):
+    return None if value is None else round(value, AGGREGATE_DIGITS)
@@ -0,0 +1,187 @@
+import asyncio
+import logging
+import struct
+from datetime import datetime
+from crc import crc16, check_packet, validate_many
+from packets import ARCHIVE_LAYOUT
+from metrics import CRC_ERRORS
+
+# --- Protocol Constants ---
+ACK = b'\x06'
+NAK = b'\x21'
+ESC = b'\x1b'
+CAN = b'\x18'
+
+# A DMP/DMPAFT page: sequence number, 5 records of 52 bytes, 4 unused bytes, CRC
+ARCHIVE_PAGE_SIZE = 267
+ARCHIVE_RECORD_SIZE = 52
+RECORDS_PER_PAGE = 5
+# NAKs sent for one page before the download is abandoned
+MAX_PAGE_RETRIES = 3
+
+log = logging.getLogger(__name__)
+
+# --- Timestamps ---
+
+def encode_datestamp(since):
+    """Packs a datetime as the 4-byte DMPAFT date/time stamp (zero for None)."""
+    if since is None:
+        return b'\x00\x00\x00\x00'
+    date_stamp = since.day + since.month * 32 + (since.year - 2000) * 512
+    time_stamp = since.hour * 100 + since.minute
+    return struct.pack('<HH', date_stamp, time_stamp)
+
+def decode_timestamp(date_stamp, time_stamp):
+    if date_stamp in (0, 0xFFFF) or time_stamp == 0xFFFF:
+        return None
+    try:
+        return datetime(
+            2000 + (date_stamp >> 9), (date_stamp >> 5) & 0x0F, date_stamp & 0x1F,
+            time_stamp // 100, time_stamp % 100
+        )
+    except ValueError:
+        return None
+
+# --- Decoding ---
+
+def decode_archive_page(pages, first_index=0, after=None, verify=True):
+    """
+    Decodes the records of one page, or of several back-to-back pages in
+    one buffer, skipping the first_index records of the first page and any
+    record not newer than after (unused or wrapped-around slots). Pages
+    failing their CRC are skipped unless verify is False; all pages are
+    checked in one validate_many call.
+    """
+    view = memoryview(pages)
+    count = len(view) // ARCHIVE_PAGE_SIZE
+    intact = validate_many(view, ARCHIVE_PAGE_SIZE) if verify else [True] * count
+    records = []
+    for page_number, ok in enumerate(intact):
+        if not ok:
+            continue
+        start = page_number * ARCHIVE_PAGE_SIZE + 1
+        payload = view[start:start + RECORDS_PER_PAGE * ARCHIVE_RECORD_SIZE]
+        skip = first_index if page_number == 0 else 0
+        for index, record in enumerate(ARCHIVE_LAYOUT.decode_many(payload)):
+            timestamp = decode_timestamp(record.pop("dateStamp"), record.pop("timeStamp"))
+            if index < skip or timestamp is None:
+                continue
+            if after is not None and timestamp <= after:
+                continue
+            record["timestamp"] = timestamp.isoformat()
+            records.append(record)
+            after = timestamp
+    return records
+
+# --- Serial Command Functions ---
+
+async def read_archive_page(ser):
+    """
+    Reads one page, NAKing it until it arrives intact. Returns None after
+    MAX_PAGE_RETRIES bad copies without NAKing the last one, so the caller
+    can cancel the download with ESC instead.
+    """
+    for attempt in range(MAX_PAGE_RETRIES):
+        page = await ser.read(ARCHIVE_PAGE_SIZE)
+        if len(page) == ARCHIVE_PAGE_SIZE and check_packet(page):
+            return page
+        CRC_ERRORS.labels("archive").inc()
+        ser.reset_input_buffer()
+        if attempt + 1 == MAX_PAGE_RETRIES:
+            log.warning("Archive page CRC error.", extra={"length": len(page)})
+            break
+        log.warning("Archive page CRC error, requesting resend.", extra={"length": len(page)})
+        ser.write(NAK)
+    return None
+
+async def dump_archive(ser, since, on_page):
+    """
+    Runs DMPAFT on an awake console. Every page is CRC-checked and NAKed
+    until it arrives intact, then ACKed so the console starts sending the
+    next page, and handed to on_page(page, first_index). Returns the number
+    of pages, or None on failure.
+    """
+    try:
+        ser.write(b'DMPAFT\n')
+        ack = await ser.read(1)
+        if ack != ACK:
+            log.warning("DMPAFT not acknowledged.", extra={"ack": ack})
+            return None
+
+        stamp = encode_datestamp(since)
+        ser.write(stamp + crc16(stamp, 0).to_bytes(2, 'big'))
+        ack = await ser.read(1)
+        if ack != ACK:
+            log.warning("DMPAFT date stamp rejected.", extra={"ack": ack})
+            return None
+
+        header = await ser.read(6)
+        if len(header) != 6 or not check_packet(header):
+            CRC_ERRORS.labels("archive").inc()
+            log.warning("DMPAFT header CRC error.")
+            ser.write(ESC)
+            return None
+        page_count, first_index = struct.unpack_from('<HH', header)
+        ser.write(ACK)
+
+        for page_number in range(page_count):
+            page = await read_archive_page(ser)
+            if page is None:
+                log.error("Giving up on archive page.", extra={"page": page_number + 1, "pages": page_count})
+                ser.write(ESC)
+                return None
+            ser.write(ACK)
+            on_page(page, first_index if page_number == 0 else 0)
+        return page_count
+    except Exception as e:
+        log.error("Serial error during archive download.", extra={"error": str(e)})
+        return None
+
+# --- Main Download Function ---
+
+async def download_archive(session, on_records, since=None):
+    """
+    Downloads the archive records newer than since (a datetime, None for the
+    whole archive) over the session and passes them, oldest first, to
+    on_records one page at a time. Each page is acknowledged before it is
+    decoded, and the console's next page is buffered by the transport in
+    the meantime, so decoding never holds up the bus. Returns the number of
+    records, or None if the download failed; records handed over before a
+    failure are kept, so the next call resumes after the newest one.
+    """
+    decoded = 0
+    after = since
+
+    def decode_page(page, first_index):
+        nonlocal decoded, after
+        # read_archive_page() has already checked the page's CRC
+        records = decode_archive_page(page, first_index, after=after, verify=False)
+        if records:
+            after = datetime.fromisoformat(records[-1]["timestamp"])
+            decoded += len(records)
+            on_records(records)
+
+    log.info("Downloading archive records.", extra={"since": since.isoformat() if since else None})
+    page_count = await session.run(dump_archive, since, decode_page)
+    if page_count is None:
+        return None
+    log.info("Downloaded archive records.", extra={"records": decoded, "pages": page_count})
+    return decoded
+
+if __name__ == "__main__":
+    # Dumps the archive (optionally after an ISO timestamp) as JSON lines
+    import sys
+    import json
+    from weather_station import StationSession
+    from logs import setup_logging
+
+    setup_logging()
+
+    async def main(since):
+        session = StationSession()
+        try:
+            await download_archive(session, lambda records: print("\n".join(json.dumps(r) for r in records)), since)
+        finally:
+            session.close()
+
+    asyncio.run(main(datetime.fromisoformat(sys.argv[1]) if len(sys.argv) > 1 else None))
@@ -0,0 +1,407 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import platform
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+from datetime import datetime
+from crc import crc16
+from simulator import Simulator, LOOP_INTERVAL
+from packets import LOOP_LAYOUT, LOOP2_LAYOUT, HILOWS_LAYOUT
+from archive import RECORDS_PER_PAGE, ARCHIVE_RECORD_SIZE, decode_archive_page, dump_archive
+import weather_station
+from weather_station import (
+    StationSession, calc_crc, validate_packet, parse_loop_packet, parse_loop2_packet,
+    parse_hilows_packet, get_data_packets, get_hilows_packet, fetch_all_data
+)
+
+# --- Configuration ---
+# Packets recorded from a console by "python bench.py record"
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_corpus.jsonl')
+CORPUS_PAIRS = 20
+CORPUS_HILOWS = 4
+# Each micro-benchmark is repeated and the fastest run kept, as the one
+# least disturbed by anything else running on the machine
+MICRO_REPEATS = 5
+# End-to-end poll cycles against the simulator
+CYCLE_COUNT = 50
+# /data load test
+HTTP_PORT = 8899
+HTTP_CLIENTS = 32
+HTTP_REQUESTS = 5000
+SERVER_START_TIMEOUT = 30.0
+
+# --- Corpus ---
+# One JSON object per line: {"kind": "loop", "case": "valid", "hex": "4c4f4f..."}.
+# kind is loop, loop2, hilows or archive; case is valid (as recorded),
+# sentinel (every field reporting "no sensor") or corrupt (damaged in transit).
+
+def with_crc(payload):
+    payload = bytes(payload)
+    return payload + crc16(payload, 0).to_bytes(2, 'big')
+
+def dash_value(field):
+    """
+    The raw value the console reports for a field without a sensor: the
+    field's sentinel, 0xFFFF for times (which parse_time maps to None),
+    otherwise the console's dashes for the field's size.
+    """
+    if field.sentinel is not None:
+        return field.sentinel
+    if field.unit == "time":
+        return 0xFFFF
+    return 0xFF if field.format == "B" else 0x7FFF
+
+def sentinel_packet(kind):
+    """A packet of the given kind with every field set to its "no sensor" value."""
+    if kind == "archive":
+        # Unused archive slots are erased flash
+        return with_crc(b'\x00' + b'\xff' * (RECORDS_PER_PAGE * ARCHIVE_RECORD_SIZE) + bytes(4))
+    if kind == "hilows":
+        packet = bytearray(436)
+        for field in HILOWS_LAYOUT.fields:
+            struct.pack_into("<" + field.format, packet, field.offset, dash_value(field))
+        return with_crc(packet)
+    packet = (LOOP2_LAYOUT if kind == "loop2" else LOOP_LAYOUT).encode({})
+    packet[0:5] = b'LOO' + bytes([0, kind == "loop2"])
+    packet[95:97] = b'\n\r'
+    return with_crc(packet[:97])
+
+def corrupt_packets(packet):
+    """Copies of a packet with a flipped bit, a lost byte and a damaged CRC."""
+    middle = len(packet) // 2
+    return [
+        packet[:middle] + bytes([packet[middle] ^ 0x10]) + packet[middle + 1:],
+        packet[:middle] + packet[middle + 1:],
+        packet[:-1] + bytes([packet[-1] ^ 0xFF]),
+    ]
+
+def corpus_entries(kind, packets):
+    """Corpus lines for the recorded packets of one kind plus its sentinel and corrupt cases."""
+    entries = [(kind, "valid", packet) for packet in packets]
+    entries.append((kind, "sentinel", sentinel_packet(kind)))
+    if packets:
+        entries.extend((kind, "corrupt", packet) for packet in corrupt_packets(packets[0]))
+    return [{"kind": kind, "case": case, "hex": bytes(packet).hex()} for kind, case, packet in entries]
+
+async def record_corpus(session, path=CORPUS_PATH, pairs=CORPUS_PAIRS, hilows=CORPUS_HILOWS):
+    """Records LOOP, LOOP2, HILOWS and archive packets from the console into a corpus file."""
+    recorded = {"loop": [], "loop2": [], "hilows": [], "archive": []}
+    for _ in range(pairs):
+        packets = await session.run(get_data_packets)
+        if packets:
+            recorded["loop"].append(packets[0])
+            recorded["loop2"].append(packets[1])
+    for _ in range(hilows):
+        packet = await session.run(get_hilows_packet)
+        if packet:
+            recorded["hilows"].append(packet)
+    await session.run(dump_archive, None, lambda page, first_index: recorded["archive"].append(page))
+
+    with open(path, 'w') as f:
+        for kind, packets in recorded.items():
+            for entry in corpus_entries(kind, packets):
+                f.write(json.dumps(entry) + "\n")
+    return {kind: len(packets) for kind, packets in recorded.items()}
+
+def load_corpus(path=CORPUS_PATH):
+    """The corpus as {(kind, case): [packet, ...]}."""
+    corpus = {}
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                corpus.setdefault((entry["kind"], entry["case"]), []).append(bytes.fromhex(entry["hex"]))
+    return corpus
+
+# --- Micro-benchmarks ---
+
+def measure(func, packets, repeats=MICRO_REPEATS):
+    """Runs func over every packet and reports the fastest of several runs."""
+    def run_all():
+        for packet in packets:
+            func(packet)
+
+    timer = timeit.Timer(run_all)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeats, number)) / number
+    return {
+        "packets": len(packets),
+        "packets_per_sec": round(len(packets) / best),
+        "ns_per_packet": round(best / len(packets) * 1e9, 1),
+    }
+
+def bench_decode(corpus):
+    """Packets per second for CRC checking, validation and decoding, per corpus case."""
+    def cases(kind):
+        return {case: packets for (k, case), packets in corpus.items() if k == kind}
+
+    results = {}
+    every_packet = [packet for packets in corpus.values() for packet in packets]
+    results["calc_crc"] = measure(calc_crc, every_packet)
+    benchmarks = [
+        ("validate_packet[loop]", "loop", lambda packet: validate_packet(packet, 0)),
+        ("validate_packet[loop2]", "loop2", lambda packet: validate_packet(packet, 1)),
+        ("parse_loop_packet", "loop", parse_loop_packet),
+        ("parse_loop2_packet", "loop2", parse_loop2_packet),
+        ("parse_hilows_packet", "hilows", parse_hilows_packet),
+        ("decode_archive_page", "archive", decode_archive_page),
+    ]
+    for name, kind, func in benchmarks:
+        for case, packets in cases(kind).items():
+            results[f"{name}/{case}"] = measure(func, packets)
+    return results
+
+# --- End-to-end Benchmarks ---
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def latency_summary(seconds):
+    return {
+        "count": len(seconds),
+        "mean_ms": round(sum(seconds) / len(seconds) * 1000, 3),
+        "p50_ms": round(percentile(seconds, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(seconds, 0.99) * 1000, 3),
+    }
+
+def start_simulator(loop_interval=0.0):
+    """Starts a simulated console and returns its port (LOOP packets back to back by default)."""
+    return Simulator(loop_interval=loop_interval).start()
+
+async def bench_cycle(count=CYCLE_COUNT):
+    """Time for fetch_all_data (LOOP pair, HILOWS, console info) over one open session."""
+    session = StationSession(port=start_simulator())
+    try:
+        # The first cycle opens the port and wakes the console
+        await fetch_all_data(session)
+        durations = []
+        for _ in range(count):
+            start = time.perf_counter()
+            data = await fetch_all_data(session)
+            durations.append(time.perf_counter() - start)
+            if data["error"] or data["liveData"] is None:
+                raise RuntimeError(f"Poll cycle failed: {data['error']}")
+    finally:
+        session.close()
+    summary = latency_summary(durations)
+    summary["cycles_per_sec"] = round(count / sum(durations), 1)
+    return summary
+
+async def http_get(reader, writer, path, headers=""):
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n{headers}\r\n".encode('ascii'))
+    head = await reader.readuntil(b"\r\n\r\n")
+    status = int(head.split(b" ", 2)[1])
+    fields = {}
+    for line in head.decode('latin-1').split("\r\n")[1:]:
+        name, _, value = line.partition(":")
+        fields[name.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(fields.get("content-length", 0)))
+    return status, fields, body
+
+async def load_data_endpoint(port, clients, requests, revalidate=False):
+    """
+    Requests /data from concurrent keep-alive clients; returns latencies
+    and throughput. Revalidating clients send the ETag of the last body
+    they received, as a polling dashboard would.
+    """
+    latencies = []
+    remaining = [requests]
+    not_modified = [0]
+
+    async def client():
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        etag = None
+        try:
+            while remaining[0] > 0:
+                remaining[0] -= 1
+                headers = f"If-None-Match: {etag}\r\n" if etag else ""
+                start = time.perf_counter()
+                status, fields, _ = await http_get(reader, writer, "/data", headers)
+                latencies.append(time.perf_counter() - start)
+                if status == 304:
+                    not_modified[0] += 1
+                elif status == 200:
+                    etag = fields.get("etag") if revalidate else None
+                else:
+                    raise RuntimeError(f"/data returned {status}")
+        finally:
+            writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    elapsed = time.perf_counter() - start
+    summary = latency_summary(latencies)
+    summary["clients"] = clients
+    summary["not_modified"] = not_modified[0]
+    summary["requests_per_sec"] = round(len(latencies) / elapsed, 1)
+    return summary
+
+async def wait_for_data(port, timeout=SERVER_START_TIMEOUT):
+    """Waits until the server answers /data with live data."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            try:
+                status, _, body = await http_get(reader, writer, "/data", "Connection: close\r\n")
+            finally:
+                writer.close()
+            if status == 200 and json.loads(body)["liveData"] is not None:
+                return
+        except (OSError, asyncio.IncompleteReadError):
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("Server did not serve live data in time.")
+
+async def bench_http(port=HTTP_PORT, clients=HTTP_CLIENTS, requests=HTTP_REQUESTS):
+    """
+    /data throughput and latency from a server polling the simulator. The
+    server runs in its own process (and working directory, for its
+    database); the clients share this one, so their overhead is included.
+    """
+    server = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "serve", "--port", str(port)],
+        cwd=tempfile.mkdtemp(prefix="vantage-bench-"),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    try:
+        await wait_for_data(port)
+        return {
+            "data": await load_data_endpoint(port, clients, requests),
+            "data_revalidate": await load_data_endpoint(port, clients, requests, revalidate=True),
+        }
+    finally:
+        server.terminate()
+        server.wait()
+
+def serve(port):
+    """Runs the API against a simulated console (used by bench_http)."""
+    import uvicorn
+    weather_station.SERIAL_PORT = start_simulator(LOOP_INTERVAL)
+    import run
+    uvicorn.run(run.app, host="127.0.0.1", port=port, log_level="warning")
+
+# --- Results ---
+
+def git_revision():
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=here, capture_output=True, text=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                                    cwd=here, capture_output=True, text=True).stdout.strip())
+    except OSError:
+        return None, None
+    return commit or None, dirty
+
+def run_benchmarks(corpus_path=CORPUS_PATH, only=("decode", "cycle", "http")):
+    logging.disable(logging.CRITICAL)
+    commit, dirty = git_revision()
+    with open(corpus_path, 'rb') as f:
+        corpus_hash = hashlib.sha256(f.read()).hexdigest()[:16]
+    results = {}
+    if "decode" in only:
+        results["decode"] = bench_decode(load_corpus(corpus_path))
+    if "cycle" in only:
+        results["cycle"] = {"fetch_all_data": asyncio.run(bench_cycle())}
+    if "http" in only:
+        results["http"] = asyncio.run(bench_http())
+    return {
+        "meta": {
+            "commit": commit,
+            "dirty": dirty,
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "machine": platform.machine(),
+            "corpus": corpus_hash,
+        },
+        "results": results,
+    }
+
+# Metrics where a larger value is better; for the rest (latencies) smaller is better
+HIGHER_IS_BETTER = ("packets_per_sec", "cycles_per_sec", "requests_per_sec")
+COMPARED_METRICS = HIGHER_IS_BETTER + ("p99_ms", "mean_ms")
+
+def compare(base, new, threshold):
+    """
+    Prints the change of every metric between two result files and returns
+    the number of regressions larger than threshold percent.
+    """
+    regressions = 0
+    if base["meta"].get("corpus") != new["meta"].get("corpus"):
+        print("warning: the results were measured on different corpora")
+    print(f"{'benchmark':48} {'metric':16} {'base':>12} {'new':>12} {'change':>8}")
+    for group, benchmarks in new["results"].items():
+        for name, metrics in benchmarks.items():
+            before = base["results"].get(group, {}).get(name)
+            if before is None:
+                continue
+            for metric in COMPARED_METRICS:
+                if metric not in metrics or not before.get(metric):
+                    continue
+                change = (metrics[metric] - before[metric]) / before[metric] * 100
+                worse = -change if metric in HIGHER_IS_BETTER else change
+                flag = " !" if worse > threshold else ""
+                regressions += bool(flag)
+                print(f"{group + '.' + name:48} {metric:16} {before[metric]:>12} {metrics[metric]:>12} "
+                      f"{change:>+7.1f}%{flag}")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks for packet decoding, polling and serving.")
+    commands = parser.add_subparsers(dest="command")
+
+    run_parser = commands.add_parser("run", help="run the benchmarks and print JSON results (default)")
+    run_parser.add_argument("--only", default="decode,cycle,http", help="comma-separated: decode, cycle, http")
+    run_parser.add_argument("--corpus", default=CORPUS_PATH)
+    run_parser.add_argument("--output", help="write the results to a file instead of stdout")
+
+    record_parser = commands.add_parser("record", help="record a packet corpus from the console")
+    record_parser.add_argument("--port", help="serial port (default: SERIAL_PORT)")
+    record_parser.add_argument("--simulator", action="store_true", help="record from the simulator instead")
+    record_parser.add_argument("--corpus", default=CORPUS_PATH)
+
+    compare_parser = commands.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=10.0,
+                                help="percent change counted as a regression (exit status 1)")
+
+    serve_parser = commands.add_parser("serve", help=argparse.SUPPRESS)
+    serve_parser.add_argument("--port", type=int, default=HTTP_PORT)
+
+    args = parser.parse_args()
+    if args.command == "record":
+        async def main():
+            session = StationSession(port=start_simulator() if args.simulator else args.port)
+            try:
+                return await record_corpus(session, args.corpus)
+            finally:
+                session.close()
+        print(json.dumps(asyncio.run(main())))
+    elif args.command == "compare":
+        with open(args.base) as f, open(args.new) as g:
+            sys.exit(1 if compare(json.load(f), json.load(g), args.threshold) else 0)
+    elif args.command == "serve":
+        serve(args.port)
+    else:
+        results = run_benchmarks(
+            getattr(args, "corpus", CORPUS_PATH),
+            tuple(getattr(args, "only", "decode,cycle,http").split(","))
+        )
+        text = json.dumps(results, indent=2)
+        if getattr(args, "output", None):
+            with open(args.output, 'w') as f:
+                f.write(text + "\n")
+        else:
+            print(text)
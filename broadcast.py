@@ -0,0 +1,97 @@
+import asyncio
+import time
+from encoding import dumps
+
+# --- Configuration ---
+# Messages buffered per subscriber; when full the oldest one is dropped
+SUBSCRIBER_QUEUE_SIZE = 16
+# A subscriber that has to be coalesced this many times in a row is disconnected
+MAX_CONSECUTIVE_DROPS = 64
+# Idle Server-Sent Event streams get a comment line this often
+KEEPALIVE_SECONDS = 15
+
+class Subscription:
+    """One push client: its field subset, minimum interval and bounded queue."""
+
+    def __init__(self, fields=None, min_interval=0.0, queue_size=SUBSCRIBER_QUEUE_SIZE):
+        self.fields = tuple(fields) if fields else None
+        self.min_interval = min_interval
+        self.queue = asyncio.Queue(queue_size)
+        self.last_sent = 0.0
+        self.drops = 0
+        self.closed = False
+
+    def offer(self, message):
+        """Queues a message without waiting; a full queue drops its oldest message."""
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.drops += 1
+            if self.drops >= MAX_CONSECUTIVE_DROPS:
+                # Too slow to keep up: end the stream instead of coalescing forever
+                self.closed = True
+                self.queue.put_nowait(None)
+                return
+        else:
+            self.drops = 0
+        self.queue.put_nowait(message)
+
+    async def get(self, timeout=None):
+        """Next message, None once the subscription was closed; raises TimeoutError."""
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+class Broadcaster:
+    """
+    Fans every new sample out to all push subscribers.
+
+    publish() may be called from any thread; delivery runs on the event loop
+    the broadcaster was bound to. Each sample is encoded once per distinct
+    field subset and the same string is queued for every subscriber that
+    asked for it. Subscribers with a minimum interval skip the samples that
+    arrive before it has passed. The rolling aggregates passed along with a
+    sample are sent under "derived", and their fields can be requested by name
+    like the sample's own.
+    """
+
+    def __init__(self):
+        self.loop = None
+        self.subscribers = set()
+
+    def bind(self, loop):
+        self.loop = loop
+
+    def subscribe(self, fields=None, min_interval=0.0):
+        subscription = Subscription(fields, min_interval)
+        self.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self.subscribers.discard(subscription)
+
+    def publish(self, sample, derived=None):
+        if self.loop is not None and self.subscribers:
+            self.loop.call_soon_threadsafe(self._deliver, sample, derived)
+
+    def _deliver(self, sample, derived=None):
+        now = time.monotonic()
+        encoded = {}
+        for subscription in list(self.subscribers):
+            if subscription.closed:
+                self.subscribers.discard(subscription)
+                continue
+            if now - subscription.last_sent < subscription.min_interval:
+                continue
+            message = encoded.get(subscription.fields)
+            if message is None:
+                message = encoded[subscription.fields] = encode_sample(sample, subscription.fields, derived)
+            subscription.last_sent = now
+            subscription.offer(message)
+
+def encode_sample(sample, fields=None, derived=None):
+    derived = derived or {}
+    if fields:
+        sample = {"liveDataTimestamp": sample.get("liveDataTimestamp"),
+                  **{name: sample[name] if name in sample else derived.get(name) for name in fields}}
+    elif derived:
+        sample = {**sample, "derived": derived}
+    # Text, since WebSocket messages and Server-Sent Events are both sent as text
+    return dumps(sample).decode()
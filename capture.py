@@ -0,0 +1,277 @@
+import mmap
+import os
+import struct
+import time
+from datetime import date, datetime
+from crc import CRC_TABLE, validate_many
+from packets import LOOP_LAYOUT, LOOP2_LAYOUT, UNIT_EXPRESSIONS
+
+try:
+    import numpy
+except ImportError:  # Replay decodes record by record without it
+    numpy = None
+
+# --- Configuration ---
+CAPTURE_DIR = 'captures'
+CAPTURE_SUFFIX = '.cap'
+
+# Every file starts with a header record followed by fixed-size records:
+# capture time (microseconds since the epoch), packet type (0 LOOP,
+# 1 LOOP2), padding, then the raw 99-byte packet padded to 128 bytes. The
+# fixed size keeps every record at a known offset and 8-byte aligned, so a
+# mapped file can be read as an array of records.
+MAGIC = b'VPCAP\x00\x01\x00'
+RECORD_SIZE = 128
+PACKET_OFFSET = 16
+PACKET_SIZE = 99
+HEADER = struct.Struct('<8sII')
+RECORD = struct.Struct(f'<qB{PACKET_OFFSET - 9}x{PACKET_SIZE}s{RECORD_SIZE - PACKET_OFFSET - PACKET_SIZE}x')
+
+LAYOUTS = {0: LOOP_LAYOUT, 1: LOOP2_LAYOUT}
+
+def capture_path(directory, day):
+    return os.path.join(directory, f"loop-{day.isoformat()}{CAPTURE_SUFFIX}")
+
+# --- Writing ---
+
+class CaptureLog:
+    """
+    Append-only log of every raw LOOP and LOOP2 packet read from the
+    console, one file per day, so past data can be decoded again after a
+    parser fix or to recover fields that were not stored. A record torn by
+    a crash is cut off when the file is reopened.
+    """
+
+    def __init__(self, directory=CAPTURE_DIR):
+        self.directory = directory
+        self.day = None
+        self.fd = None
+
+    def append(self, packet, when=None):
+        """Adds a packet, captured at when (unix seconds, default now)."""
+        if len(packet) != PACKET_SIZE:
+            return
+        when = time.time() if when is None else when
+        day = date.fromtimestamp(when)
+        if day != self.day:
+            self._open(day)
+        os.write(self.fd, RECORD.pack(round(when * 1_000_000), packet[4], bytes(packet)))
+
+    def _open(self, day):
+        self.close()
+        os.makedirs(self.directory, exist_ok=True)
+        self.fd = os.open(capture_path(self.directory, day), os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        size = os.fstat(self.fd).st_size
+        if size == 0:
+            os.write(self.fd, HEADER.pack(MAGIC, RECORD_SIZE, PACKET_OFFSET).ljust(RECORD_SIZE, b'\x00'))
+        elif size % RECORD_SIZE:
+            os.ftruncate(self.fd, size - size % RECORD_SIZE)
+        self.day = day
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+            self.day = None
+
+# --- Replay ---
+
+def _timestamp(value):
+    return None if value is None else round(value.timestamp() * 1_000_000)
+
+class CaptureReader:
+    """
+    Replays the capture log through memory maps, without reading the files
+    into memory. records() decodes packets one by one into the same dicts
+    as the live parsers; columns() decodes whole fields at once as NumPy
+    arrays, which re-derives a year of packets in seconds.
+    """
+
+    def __init__(self, directory=CAPTURE_DIR):
+        self.directory = directory
+
+    def files(self, start=None, end=None):
+        """Capture files covering start to end (datetimes, both optional), oldest first."""
+        if not os.path.isdir(self.directory):
+            return []
+        first = start.date() if start else date.min
+        last = end.date() if end else date.max
+        paths = []
+        for name in sorted(os.listdir(self.directory)):
+            if name.startswith("loop-") and name.endswith(CAPTURE_SUFFIX):
+                day = date.fromisoformat(name[5:-len(CAPTURE_SUFFIX)])
+                if first <= day <= last:
+                    paths.append(os.path.join(self.directory, name))
+        return paths
+
+    def _mapped(self, path):
+        """The file's memory map and its number of complete records, or (None, 0)."""
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            count = size // RECORD_SIZE - 1
+            if count <= 0:
+                return None, 0
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, record_size, packet_offset = HEADER.unpack_from(mapped)
+        if magic != MAGIC or record_size != RECORD_SIZE or packet_offset != PACKET_OFFSET:
+            mapped.close()
+            raise ValueError(f"{path} is not a capture file of this version.")
+        return mapped, count
+
+    def records(self, start=None, end=None, packet_type=None, verify=True):
+        """
+        Yields (datetime, packet_type, data) for every captured packet
+        between start and end, decoded like parse_loop_packet and
+        parse_loop2_packet. Packets failing their CRC are skipped unless
+        verify is False.
+        """
+        low, high = _timestamp(start), _timestamp(end)
+        for path in self.files(start, end):
+            mapped, count = self._mapped(path)
+            if mapped is None:
+                continue
+            view = memoryview(mapped)[RECORD_SIZE:RECORD_SIZE * (count + 1)]
+            # Every packet of the file is CRC-checked in one call, in place in the map
+            intact = validate_many(view, PACKET_SIZE, RECORD_SIZE, PACKET_OFFSET) if verify else None
+            unpacked = RECORD.iter_unpack(view)
+            try:
+                for index, (stamp, kind, packet) in enumerate(unpacked):
+                    if (low is not None and stamp < low) or (high is not None and stamp > high):
+                        continue
+                    if (packet_type is not None and kind != packet_type) or kind not in LAYOUTS:
+                        continue
+                    if verify and not intact[index]:
+                        continue
+                    yield datetime.fromtimestamp(stamp / 1_000_000), kind, LAYOUTS[kind].decode(packet)
+            finally:
+                # The map can only be closed once nothing refers to its memory
+                del unpacked
+                view.release()
+                mapped.close()
+
+    def columns(self, packet_type=0, fields=None, start=None, end=None, verify=True):
+        """
+        Decodes the named fields (default: every field) of all packets of one
+        type between start and end into {"time": [...], field: [...]}.
+
+        With NumPy every column is converted in one vectorized step with the
+        same unit expressions as the live decoders, and the CRCs are checked
+        a word position at a time across all records; missing values are
+        NaN and times are datetime64 in UTC. Without NumPy the columns are
+        lists, decoded per packet.
+        """
+        layout = LAYOUTS[packet_type]
+        names = list(fields) if fields else [field.name for field in layout.fields]
+        if numpy is None:
+            result = {"time": []}
+            result.update((name, []) for name in names)
+            for when, _, data in self.records(start, end, packet_type, verify):
+                result["time"].append(when)
+                for name in names:
+                    result[name].append(data[name])
+            return result
+
+        chunks = [self._decode_file(path, layout, packet_type, names, start, end, verify)
+                  for path in self.files(start, end)]
+        chunks = [chunk for chunk in chunks if chunk is not None]
+        if not chunks:
+            return {"time": numpy.array([], dtype="datetime64[us]"), **{name: numpy.array([]) for name in names}}
+        return {name: numpy.concatenate([chunk[name] for chunk in chunks]) for name in ["time"] + names}
+
+    def _decode_file(self, path, layout, packet_type, names, start, end, verify):
+        mapped, count = self._mapped(path)
+        if mapped is None:
+            return None
+        records = numpy.frombuffer(mapped, dtype=_record_dtype(layout), count=count, offset=RECORD_SIZE)
+        keep = records["type"] == packet_type
+        if start is not None:
+            keep &= records["time"] >= _timestamp(start)
+        if end is not None:
+            keep &= records["time"] <= _timestamp(end)
+        # Boolean indexing copies the selected records out of the map
+        selected = records[keep]
+        del records
+        mapped.close()
+        if verify:
+            selected = selected[_crc_ok(selected["packet"])]
+        columns = {"time": selected["time"].astype("datetime64[us]")}
+        for name in names:
+            columns[name] = _convert(layout.field(name), selected[name])
+        return columns
+
+# --- Vectorized Decoding ---
+
+def _crc_tables():
+    """The byte-wise CRC table and one advancing the CRC by a 16-bit word at a time."""
+    table = numpy.array(CRC_TABLE, dtype=numpy.uint16)
+    crc = numpy.arange(1 << 16, dtype=numpy.uint16)
+    for _ in range(2):
+        crc = table[crc >> 8] ^ (crc << 8)
+    return table, crc
+
+if numpy is not None:
+    _CRC_BYTE_TABLE, _CRC_WORD_TABLE = _crc_tables()
+
+def _record_dtype(layout):
+    """A structured dtype viewing a capture record, with one entry per layout field."""
+    names = ["time", "type", "packet"]
+    formats = ["<i8", "u1", ("u1", PACKET_SIZE)]
+    offsets = [0, 8, PACKET_OFFSET]
+    for field in layout.fields:
+        names.append(field.name)
+        formats.append("<" + field.format)
+        offsets.append(PACKET_OFFSET + field.offset)
+    return numpy.dtype({"names": names, "formats": formats, "offsets": offsets, "itemsize": RECORD_SIZE})
+
+def _crc_ok(packets):
+    """
+    Checks the CRC of every row of an (n, 99) byte array at once. The
+    first byte is fed in through the byte table and the remaining 98 as 49
+    big-endian words, each step handling one word position of every packet.
+    """
+    crc = _CRC_BYTE_TABLE[packets[:, 0]]
+    words = numpy.ascontiguousarray(packets[:, 1:]).view('>u2').T.copy()
+    for column in words:
+        crc = _CRC_WORD_TABLE[crc ^ column]
+    return crc == 0
+
+def _convert(field, raw):
+    """Applies a field's sentinel, scale and unit to a whole column."""
+    # Clock and time fields stay text, as in the live data
+    if field.unit == "time":
+        return _parse_time_column(raw)
+    if field.unit == "clock":
+        return _format_clock_column(raw)
+    values = raw.astype(numpy.float64)
+    if field.scale != 1:
+        values /= field.scale
+    if field.unit is not None:
+        values = eval(UNIT_EXPRESSIONS[field.unit].format(x="x"), {}, {"x": values})
+    if field.scale != 1 or field.unit is not None:
+        values = numpy.round(values, 3)
+    if field.sentinel is not None:
+        values[raw == field.sentinel] = numpy.nan
+    elif field.scale == 1 and field.unit is None:
+        return raw.astype(numpy.int64)
+    return values
+
+def _format_clock_column(raw):
+    # A column holds few distinct times, so each is formatted only once
+    values, inverse = numpy.unique(raw, return_inverse=True)
+    text = numpy.array([f"{value // 100:02d}:{value % 100:02d}" for value in values.tolist()], dtype=object)
+    return text[inverse]
+
+def _parse_time_column(raw):
+    values, inverse = numpy.unique(raw, return_inverse=True)
+    text = numpy.array([None if value == 65535 else f"{value // 100:02d}:{value % 100:02d}"
+                        for value in values.tolist()], dtype=object)
+    return text[inverse]
+
+if __name__ == "__main__":
+    # Dumps the captured packets (optionally between two ISO timestamps) as JSON lines
+    import sys
+    import json
+    start = datetime.fromisoformat(sys.argv[1]) if len(sys.argv) > 1 else None
+    end = datetime.fromisoformat(sys.argv[2]) if len(sys.argv) > 2 else None
+    for when, packet_type, data in CaptureReader().records(start, end):
+        print(json.dumps({"time": when.isoformat(), "type": packet_type, **data}))
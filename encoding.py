@@ -0,0 +1,256 @@
+import csv
+import hashlib
+import io
+import json
+import time
+from email.utils import formatdate, parsedate_to_datetime
+
+try:
+    import orjson
+except ImportError:  # Falls back to the standard library encoder
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # MessagePack is only offered when installed
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:  # CBOR is only offered when installed
+    cbor2 = None
+
+# --- Configuration ---
+# Field selections encoded and kept per snapshot; rarer ones are encoded per request
+MAX_CACHED_SELECTIONS = 32
+# Rows encoded per chunk of a streamed CSV or NDJSON export
+EXPORT_CHUNK_ROWS = 1000
+
+# --- Formats ---
+# Media type of every response format; alternative names clients send map to the same format
+MEDIA_TYPES = {
+    "json": "application/json",
+    "msgpack": "application/msgpack",
+    "cbor": "application/cbor",
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+MEDIA_TYPE_ALIASES = {
+    "application/x-msgpack": "msgpack",
+    "application/vnd.msgpack": "msgpack",
+    "application/jsonl": "ndjson",
+    "application/jsonlines": "ndjson",
+}
+# The optional package each binary document format needs (requirements-optional.txt)
+FORMAT_PACKAGES = {"msgpack": "msgpack", "cbor": "cbor2"}
+# Document formats (as opposed to the streamed csv and ndjson) this installation can encode
+DOCUMENT_FORMATS = ["json"] + (["msgpack"] if msgpack else []) + (["cbor"] if cbor2 else [])
+
+def _default(value):
+    # Lazy records (packets.LazyRecord) are decoded in full when they are encoded
+    to_dict = getattr(value, "to_dict", None)
+    if to_dict is None:
+        raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+    return to_dict()
+
+def _cbor_default(encoder, value):
+    encoder.encode(_default(value))
+
+def dumps(value):
+    """Encodes value as compact UTF-8 JSON bytes, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(value, default=_default)
+    return json.dumps(value, separators=(",", ":"), default=_default).encode()
+
+def encode(value, format="json"):
+    """Encodes value as a JSON, MessagePack or CBOR document."""
+    if format == "msgpack":
+        return msgpack.packb(value, default=_default)
+    if format == "cbor":
+        return cbor2.dumps(value, default=_cbor_default)
+    return dumps(value)
+
+def negotiate(accept, offered=DOCUMENT_FORMATS):
+    """
+    The offered format an Accept header value prefers, or None when it
+    names none of them. A missing header or a wildcard picks the first.
+    """
+    if not accept:
+        return offered[0]
+    ranges = []
+    for position, item in enumerate(accept.split(",")):
+        media_type, *params = [part.strip() for part in item.split(";")]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            ranges.append((-quality, position, media_type.lower()))
+    for _, _, media_type in sorted(ranges):
+        if media_type in ("*/*", "application/*"):
+            return offered[0]
+        format = MEDIA_TYPE_ALIASES.get(media_type)
+        if format is None:
+            format = next((name for name, known in MEDIA_TYPES.items() if known == media_type), None)
+        if format in offered:
+            return format
+    return None
+
+def _map_header(format, length):
+    """The bytes that start a map of length entries in a binary format."""
+    if format == "msgpack":
+        return msgpack.Packer().pack_map_header(length)
+    # CBOR major type 5 with the length in the smallest argument that holds it
+    if length < 24:
+        return bytes([0xa0 | length])
+    for marker, size in ((0xb8, 1), (0xb9, 2), (0xba, 4)):
+        if length < 1 << (8 * size):
+            return bytes([marker]) + length.to_bytes(size, "big")
+    raise ValueError("Map too large.")
+
+class EncodedSnapshot:
+    """
+    A document encoded once (JSON by default, or MessagePack or CBOR), with
+    the validators needed to serve it as is: a strong ETag derived from the
+    body and a Last-Modified date.
+    """
+
+    __slots__ = ("body", "etag", "last_modified", "format")
+
+    def __init__(self, value, modified=None, format="json"):
+        self.body = encode(value, format)
+        self.etag = '"' + hashlib.blake2b(self.body, digest_size=12).hexdigest() + '"'
+        self.last_modified = formatdate(time.time() if modified is None else modified, usegmt=True)
+        self.format = format
+
+    @property
+    def media_type(self):
+        return MEDIA_TYPES[self.format]
+
+    @classmethod
+    def restore(cls, body, etag, last_modified, format="json"):
+        """Rebuilds a snapshot that was encoded elsewhere, without encoding it again."""
+        snapshot = cls.__new__(cls)
+        snapshot.body = body
+        snapshot.etag = etag
+        snapshot.last_modified = last_modified
+        snapshot.format = format
+        return snapshot
+
+    @classmethod
+    def combine(cls, parts, format="json"):
+        """
+        A map of encoded snapshots (all in format) by key, built from their
+        bodies without decoding or encoding them again. Its ETag changes
+        whenever one of theirs does; it was last modified when the newest
+        one was.
+        """
+        if format == "json":
+            body = b"{" + b",".join(dumps(key) + b":" + part.body for key, part in parts.items()) + b"}"
+        else:
+            body = _map_header(format, len(parts)) + b"".join(
+                encode(key, format) + part.body for key, part in parts.items())
+        tags = "".join(part.etag for part in parts.values()).encode()
+        etag = '"' + hashlib.blake2b(tags, digest_size=12).hexdigest() + '"'
+        last_modified = max((part.last_modified for part in parts.values()), key=parsedate_to_datetime)
+        return cls.restore(body, etag, last_modified, format)
+
+    def matches(self, if_none_match):
+        """True when an If-None-Match header value names this snapshot."""
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        # Weak comparison, as If-None-Match requires
+        tags = (tag.strip() for tag in if_none_match.split(","))
+        return self.etag in (tag[2:] if tag.startswith("W/") else tag for tag in tags)
+
+class LazySnapshot:
+    """
+    The latest snapshot, encoded only as far as requests need it. The full
+    document is encoded on the first request for it, and each selection of
+    fields into a small document of its own, with its own ETag, on the
+    first request for that selection. Sections may hold lazy records, so a
+    section nobody asks for is never decoded at all. Binary formats are
+    encoded the same way, once per selection and format.
+    """
+
+    def __init__(self, value=None, encoded=None, modified=None):
+        self._value = value
+        self._encoded = encoded
+        self.modified = time.time() if modified is None else modified
+        self.selections = {}
+
+    @classmethod
+    def from_encoded(cls, encoded):
+        """Wraps a snapshot that was encoded elsewhere; it is only decoded for selections."""
+        return cls(encoded=encoded)
+
+    @property
+    def value(self):
+        if self._value is None:
+            self._value = json.loads(self._encoded.body)
+        return self._value
+
+    def encoded(self, selection=None, format="json"):
+        """
+        The EncodedSnapshot of the whole document, or of the (section, field)
+        pairs in selection: {section: {field: value}, "error": ...}.
+        """
+        if selection is None and format == "json":
+            if self._encoded is None:
+                self._encoded = EncodedSnapshot(self._value, self.modified)
+            return self._encoded
+        encoded = self.selections.get((selection, format))
+        if encoded is None:
+            value = self.value if selection is None else self.select(selection)
+            encoded = EncodedSnapshot(value, self.modified, format)
+            if len(self.selections) < MAX_CACHED_SELECTIONS:
+                self.selections[selection, format] = encoded
+        return encoded
+
+    def select(self, selection):
+        value = self.value
+        selected = {}
+        for section, name in selection:
+            data = value.get(section)
+            selected.setdefault(section, {})[name] = None if data is None else data.get(name)
+        selected["error"] = value.get("error")
+        return selected
+
+# --- Streamed Exports ---
+
+def iter_csv(rows):
+    """
+    Encodes rows (an iterator yielding the column names first) as CSV,
+    one chunk of EXPORT_CHUNK_ROWS rows at a time. Missing values are empty.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(next(rows))
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+        if count == EXPORT_CHUNK_ROWS:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+            count = 0
+    yield buffer.getvalue().encode()
+
+def iter_ndjson(rows):
+    """Encodes rows (an iterator yielding the column names first) as one JSON object per line."""
+    names = next(rows)
+    chunk = []
+    for row in rows:
+        chunk.append(dumps(dict(zip(names, row))))
+        if len(chunk) == EXPORT_CHUNK_ROWS:
+            yield b"\n".join(chunk) + b"\n"
+            chunk = []
+    if chunk:
+        yield b"\n".join(chunk) + b"\n"
@@ -0,0 +1,31 @@
+import logging
+
+# --- Configuration ---
+LOG_LEVEL = logging.INFO
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+# Attributes every LogRecord has; anything else was passed through extra=
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+class KeyValueFormatter(logging.Formatter):
+    """
+    Appends the fields passed through extra= to the message as key=value
+    pairs, so log lines stay readable and can be parsed by log collectors:
+
+        2024-01-01 12:00:00,000 WARNING weather_station: Wake up failed. attempt=2 response=b'\\x00'
+    """
+
+    def format(self, record):
+        line = super().format(record)
+        fields = [
+            f"{key}={value!r}" if isinstance(value, (str, bytes)) else f"{key}={value}"
+            for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES
+        ]
+        return f"{line} {' '.join(fields)}" if fields else line
+
+def setup_logging(level=LOG_LEVEL):
+    handler = logging.StreamHandler()
+    handler.setFormatter(KeyValueFormatter(LOG_FORMAT))
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
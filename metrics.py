@@ -0,0 +1,212 @@
+import time
+from bisect import bisect_left
+
+# --- Configuration ---
+# Histogram bucket upper bounds (seconds)
+COMMAND_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PARSE_BUCKETS = (0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001)
+REQUEST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5)
+
+# Metrics are recorded by plain attribute updates without locks: the
+# serial link and the request handlers that record them all run on the
+# event loop, and a scrape that reads a value mid-update is off by at most
+# one observation.
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.children = {}
+        REGISTRY.append(self)
+
+    def labels(self, *values):
+        """The child for one combination of label values, created on first use."""
+        child = self.children.get(values)
+        if child is None:
+            child = self.children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _label_text(self, values, extra=()):
+        pairs = list(zip(self.labelnames, values)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        children = self.children if self.labelnames else {(): self._root()}
+        for values, child in children.items():
+            lines.extend(child.render(self, values))
+        return lines
+
+    def _root(self):
+        return self.labels()
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def set(self, value):
+        self.value = value
+
+    def render(self, metric, values):
+        return [f"{metric.name}{metric._label_text(values)} {_format(self.value)}"]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value):
+        self.labels().set(value)
+
+class _HistogramValue:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # One count per bucket plus the +Inf bucket; made cumulative on export
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def time(self):
+        return _Timer(self)
+
+    def render(self, metric, values):
+        lines = []
+        total = 0
+        for bound, count in zip(self.bounds + (float("inf"),), self.counts):
+            total += count
+            le = "+Inf" if bound == float("inf") else _format(bound)
+            lines.append(f"{metric.name}_bucket{metric._label_text(values, [('le', le)])} {total}")
+        lines.append(f"{metric.name}_sum{metric._label_text(values)} {_format(self.sum)}")
+        lines.append(f"{metric.name}_count{metric._label_text(values)} {total}")
+        return lines
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=COMMAND_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, help, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+class _Timer:
+    """Context manager observing the elapsed time into a histogram child."""
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format(value):
+    if isinstance(value, float):
+        return repr(value) if value == value else "NaN"
+    return str(value)
+
+REGISTRY = []
+
+def render_prometheus(prefixes=None):
+    """
+    Registered metrics in the Prometheus text exposition format; prefixes
+    optionally limits them to names starting with one of the given strings.
+    """
+    lines = []
+    for metric in REGISTRY:
+        if prefixes is None or metric.name.startswith(tuple(prefixes)):
+            lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+# --- Metrics ---
+# Serial link metrics live in the process that owns the port; with several
+# web workers the serial reader process shares them through a snapshot file
+SERIAL_PREFIXES = ("davis_",)
+SERVER_PREFIXES = ("weather_", "http_")
+
+COMMAND_SECONDS = Histogram(
+    "davis_command_duration_seconds", "Time taken by each serial command.", ["command"], COMMAND_BUCKETS)
+COMMAND_FAILURES = Counter(
+    "davis_command_failures_total", "Serial commands that failed or timed out.", ["command"])
+BYTES_READ = Counter("davis_bytes_read_total", "Bytes received from the console.")
+CRC_ERRORS = Counter("davis_crc_errors_total", "Packets rejected by their CRC.", ["packet"])
+RESYNC_BYTES = Counter("davis_resync_bytes_total", "Bytes skipped to find the start of the next packet.")
+PARSE_SECONDS = Histogram(
+    "davis_parse_duration_seconds", "Time taken to validate and decode a packet.", ["packet"], PARSE_BUCKETS)
+WAKE_RETRIES = Counter("davis_wakeup_retries_total", "Wake-up attempts that got no valid reply.")
+RECONNECTS = Counter("davis_reconnects_total", "Times the serial port was reopened after the first connection.")
+LINK_DROPS = Counter("davis_link_drops_total", "Times the serial link was closed after an error.")
+SNAPSHOT_AGE = Gauge(
+    "weather_snapshot_age_seconds", "Age of each section of each station's current snapshot.", ["station", "section"])
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests served.", ["endpoint", "status"])
+HTTP_SECONDS = Histogram(
+    "http_request_duration_seconds", "Time taken to produce an HTTP response.", ["endpoint"], REQUEST_BUCKETS)
+
+class MetricsMiddleware:
+    """
+    ASGI middleware counting HTTP requests by route and status and timing
+    them until the response has started, so streaming endpoints are timed
+    to their first byte.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        status = [500]
+
+        async def send_and_record(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                HTTP_SECONDS.labels(_endpoint(scope)).observe(time.perf_counter() - start)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_and_record)
+        finally:
+            HTTP_REQUESTS.labels(_endpoint(scope), status[0]).inc()
+
+def _endpoint(scope):
+    # The route template keeps path parameters out of the label values
+    route = scope.get("route")
+    return getattr(route, "path", "unmatched")
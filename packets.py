@@ -0,0 +1,369 @@
+import struct
+from collections import namedtuple
+from collections.abc import Mapping
+
+# --- Unit Conversion & Helpers ---
+
+def f_to_c(f_temp):
+    if f_temp is None: return None
+    return (f_temp - 32.0) * 5.0 / 9.0
+
+def mph_to_ms(mph_speed):
+    if mph_speed is None: return None
+    return mph_speed * 0.44704
+
+def inhg_to_hpa(inhg_press):
+    if inhg_press is None: return None
+    return inhg_press * 33.8639
+
+def parse_time(time_val):
+    if time_val == 65535: # 0xFFFF
+        return None
+    try:
+        hour = time_val // 100
+        minute = time_val % 100
+        return f"{hour:02d}:{minute:02d}"
+    except Exception:
+        return None
+
+def format_clock(time_val):
+    return f"{time_val // 100:02d}:{time_val % 100:02d}"
+
+def wind_deg_to_text(deg):
+    if deg is None:
+        return None
+    directions = [
+        "N", "NNE", "NE", "ENE", "E", "ESE", "SE", "SSE",
+        "S", "SSW", "SW", "WSW", "W", "WNW", "NW", "NNW"
+    ]
+    index = round(deg / (360. / 16)) % 16
+    return directions[index]
+
+def round_safe(value, precision=3):
+    if isinstance(value, (int, float)):
+        return round(value, precision)
+    return value
+
+# Python expressions converting a raw value x (already divided by the
+# field's scale) from the console's unit to the unit reported by the API.
+# They are inlined into the generated decoders and match the helpers above.
+UNIT_EXPRESSIONS = {
+    "F": "({x} - 32.0) * 5.0 / 9.0",
+    "mph": "{x} * 0.44704",
+    "inHg": "{x} * 33.8639",
+    "in": "{x} * 25.4",
+    "clicks": "({x} * 0.01) * 25.4",
+    "battery": "(({x} * 300) / 512) / 100.0",
+    "compass": "{x} * 22.5",
+}
+# Units converted to text; these are not rounded
+TEXT_UNITS = {
+    "time": "parse_time({x})",
+    "clock": "format_clock({x})",
+}
+# The inverse conversions, from the API unit back to the console's unit
+UNIT_INVERSES = {
+    "F": lambda x: x * 9.0 / 5.0 + 32.0,
+    "mph": lambda x: x / 0.44704,
+    "inHg": lambda x: x / 33.8639,
+    "in": lambda x: x / 25.4,
+    "clicks": lambda x: x / 25.4 / 0.01,
+    "battery": lambda x: x * 100.0 * 512 / 300,
+    "compass": lambda x: x / 22.5,
+    "time": lambda x: int(x[:2]) * 100 + int(x[3:5]),
+    "clock": lambda x: int(x[:2]) * 100 + int(x[3:5]),
+}
+
+# --- Packet Layouts ---
+
+# One field of a packet: the raw value is read with the struct format at the
+# given offset, is None if it equals the sentinel, is divided by scale, and is
+# then converted from the given console unit (see UNIT_EXPRESSIONS).
+Field = namedtuple("Field", "name offset format sentinel scale unit", defaults=(None, 1, None))
+
+def _field_expression(field, x):
+    if field.unit in TEXT_UNITS:
+        return TEXT_UNITS[field.unit].format(x=x)
+    if field.scale != 1:
+        x = f"({x} / {field.scale})"
+    if field.unit is None:
+        return x if field.scale == 1 else f"round({x}, 3)"
+    return f"round({UNIT_EXPRESSIONS[field.unit].format(x=x)}, 3)"
+
+def _value_expression(field, x):
+    expression = _field_expression(field, x)
+    if field.sentinel is not None:
+        expression = f"None if {x} == {field.sentinel} else {expression}"
+    return expression
+
+def _clamp(fmt, raw):
+    bits = 8 * struct.calcsize(fmt)
+    if fmt.islower():
+        return max(-(1 << (bits - 1)), min((1 << (bits - 1)) - 1, raw))
+    return max(0, min((1 << bits) - 1, raw))
+
+class PacketLayout:
+    """
+    A packet type described by a table of Fields.
+
+    All fields are compiled into one little-endian struct.Struct, so a whole
+    packet is unpacked with a single call, and into one generated function
+    that applies every sentinel, scale and unit conversion inline. Derived
+    fields are computed from decoded ones, e.g. the compass text from the
+    wind direction.
+    """
+
+    def __init__(self, name, size, fields, derived=()):
+        self.name = name
+        self.size = size
+        self.fields = fields
+        self.derived = derived
+
+        ordered = sorted(fields, key=lambda field: field.offset)
+        fmt, position = "<", 0
+        for field in ordered:
+            if field.offset < position:
+                raise ValueError(f"{name}: field {field.name} overlaps the previous field")
+            fmt += "x" * (field.offset - position) + field.format
+            position = field.offset + struct.calcsize("<" + field.format)
+        self.struct = struct.Struct(fmt)
+        # The same layout padded to the full packet size, for back-to-back records
+        self.record_struct = struct.Struct(fmt + "x" * (size - position))
+        self.decode_values = self._compile(ordered)
+        self.names = []
+        for field in fields:
+            self.names.append(field.name)
+            self.names += [name for name, source, _ in derived if source == field.name]
+        # Single-field decoders for lazy records, compiled on first use
+        self.field_decoders = {}
+
+    def _compile(self, ordered):
+        """Generates decode_values(values) for the tuple returned by self.struct."""
+        variables = {field.name: f"v{i}" for i, field in enumerate(ordered)}
+        lines = ["def decode_values(values):", f"    {', '.join(variables.values())}, = values"]
+        # Sources of derived fields are decoded once, up front
+        sources = {source for _, source, _ in self.derived}
+        for field in self.fields:
+            if field.name in sources:
+                lines.append(f"    d{variables[field.name]} = {_value_expression(field, variables[field.name])}")
+        # Derived fields follow their source, where the old parsers put them
+        lines.append("    return {")
+        for field in self.fields:
+            variable = variables[field.name]
+            if field.name not in sources:
+                lines.append(f"        {field.name!r}: {_value_expression(field, variable)},")
+                continue
+            lines.append(f"        {field.name!r}: d{variable},")
+            for i, (name, source, _) in enumerate(self.derived):
+                if source == field.name:
+                    lines.append(f"        {name!r}: derived_{i}(d{variable}),")
+        lines.append("    }")
+
+        namespace = {"parse_time": parse_time, "format_clock": format_clock}
+        for i, (_, _, convert) in enumerate(self.derived):
+            namespace[f"derived_{i}"] = convert
+        exec("\n".join(lines), namespace)
+        return namespace["decode_values"]
+
+    def _compile_field(self, name):
+        """Generates decode(packet) for a single field, or its derived value."""
+        for derived_name, source, convert in self.derived:
+            if derived_name == name:
+                decode_source = self.field_decoder(source)
+                return lambda packet: convert(decode_source(packet))
+        field = self.field(name)
+        lines = [
+            "def decode(packet):",
+            f"    x, = unpack_from(packet, {field.offset})",
+            f"    return {_value_expression(field, 'x')}",
+        ]
+        namespace = {
+            "unpack_from": struct.Struct("<" + field.format).unpack_from,
+            "parse_time": parse_time,
+            "format_clock": format_clock,
+        }
+        exec("\n".join(lines), namespace)
+        return namespace["decode"]
+
+    def field(self, name):
+        field = next((field for field in self.fields if field.name == name), None)
+        if field is None:
+            raise KeyError(name)
+        return field
+
+    def field_decoder(self, name):
+        """A function decoding just the named field from a packet; raises KeyError for unknown names."""
+        decoder = self.field_decoders.get(name)
+        if decoder is None:
+            decoder = self.field_decoders[name] = self._compile_field(name)
+        return decoder
+
+    def decode(self, packet):
+        """Decodes one packet (bytes, bytearray or memoryview) into a dict."""
+        return self.decode_values(self.struct.unpack_from(packet))
+
+    def lazy(self, packet):
+        """Wraps a validated packet in a LazyRecord that decodes fields on access."""
+        return LazyRecord(self, packet)
+
+    def encode(self, values):
+        """
+        Builds a packet of this layout's size from a dict of API values, the
+        inverse of decode(). Missing or None values are written as the
+        field's sentinel (or 0); bytes not covered by a field are zero.
+        """
+        packet = bytearray(self.size)
+        for field in self.fields:
+            value = values.get(field.name)
+            if value is None:
+                raw = field.sentinel or 0
+            else:
+                if field.unit is not None:
+                    value = UNIT_INVERSES[field.unit](value)
+                raw = _clamp(field.format, round(value * field.scale))
+            struct.pack_into("<" + field.format, packet, field.offset, raw)
+        return packet
+
+    def decode_many(self, packets):
+        """
+        Decodes many packets at once. Accepts a list of packets or one
+        contiguous buffer of back-to-back packets of this layout's size.
+        """
+        if not isinstance(packets, (bytes, bytearray, memoryview)):
+            packets = b"".join(packets)
+        decode_values = self.decode_values
+        return [decode_values(values) for values in self.record_struct.iter_unpack(packets)]
+
+class LazyRecord(Mapping):
+    """
+    The fields of one packet as a read-only mapping over its raw bytes.
+    Each field is decoded the first time it is read and then cached, so a
+    caller reading a few fields of a large packet skips the rest of the
+    decode. to_dict() decodes everything at once, e.g. for encoding.
+    """
+
+    __slots__ = ("layout", "packet", "values", "complete")
+
+    def __init__(self, layout, packet):
+        self.layout = layout
+        self.packet = bytes(packet)
+        self.values = {}
+        self.complete = False
+
+    def __getitem__(self, name):
+        if name in self.values:
+            return self.values[name]
+        value = self.values[name] = self.layout.field_decoder(name)(self.packet)
+        return value
+
+    def __iter__(self):
+        return iter(self.layout.names)
+
+    def __len__(self):
+        return len(self.layout.names)
+
+    def to_dict(self):
+        if not self.complete:
+            self.values = self.layout.decode(self.packet)
+            self.complete = True
+        return dict(self.values)
+
+# LOOP (type 0) packet, 99 bytes
+LOOP_LAYOUT = PacketLayout("LOOP", 99, [
+    Field("barometerHpa", 7, "H", sentinel=0, scale=1000, unit="inHg"),
+    Field("insideTempC", 9, "h", sentinel=32767, scale=10, unit="F"),
+    Field("insideHumidityPercent", 11, "B", sentinel=255),
+    Field("outsideTempC", 12, "h", sentinel=32767, scale=10, unit="F"),
+    Field("windSpeedMs", 14, "B", unit="mph"),
+    Field("avgWind10minMs", 15, "B", unit="mph"),
+    Field("windDirectionDeg", 16, "H"),
+    Field("outsideHumidityPercent", 33, "B", sentinel=255),
+    Field("rainRateMmHr", 41, "H", unit="clicks"),
+    Field("dailyRainMm", 50, "H", unit="clicks"),
+    Field("stormRainMm", 46, "H", unit="clicks"),
+    Field("monthlyRainMm", 52, "H", unit="clicks"),
+    Field("yearlyRainMm", 54, "H", unit="clicks"),
+    Field("uvIndex", 43, "B", sentinel=255, scale=10),
+    Field("solarRadiationWm2", 44, "H", sentinel=32767),
+    Field("dayEtMm", 56, "H", scale=1000, unit="in"),
+    Field("monthEtMm", 58, "H", scale=100, unit="in"),
+    Field("yearEtMm", 60, "H", scale=100, unit="in"),
+    Field("consoleBatteryV", 87, "H", unit="battery"),
+    Field("sunrise", 91, "H", unit="clock"),
+    Field("sunset", 93, "H", unit="clock"),
+], derived=[
+    ("windDirectionText", "windDirectionDeg", wind_deg_to_text),
+])
+
+# LOOP2 (type 1) packet, 99 bytes
+LOOP2_LAYOUT = PacketLayout("LOOP2", 99, [
+    Field("avgWind10minMsHires", 18, "H", sentinel=32767, scale=10, unit="mph"),
+    Field("avgWind2minMs", 20, "H", sentinel=32767, scale=10, unit="mph"),
+    Field("windGust10minMs", 22, "H", sentinel=32767, scale=10, unit="mph"),
+    Field("windGust10minDirDeg", 24, "H"),
+    Field("dewpointC", 30, "h", sentinel=32767, unit="F"),
+    Field("heatIndexC", 35, "h", sentinel=32767, unit="F"),
+    Field("windChillC", 37, "h", sentinel=32767, unit="F"),
+    Field("thswIndexC", 39, "h", sentinel=32767, unit="F"),
+    Field("last15minRainMm", 52, "H", unit="clicks"),
+    Field("lastHourRainMm", 54, "H", unit="clicks"),
+    Field("last24hrRainMm", 58, "H", unit="clicks"),
+])
+
+# HILOWS packet, 438 bytes
+HILOWS_LAYOUT = PacketLayout("HILOWS", 438, [
+    Field("baroDayLowHpa", 0, "H", scale=1000, unit="inHg"),
+    Field("baroDayHighHpa", 2, "H", scale=1000, unit="inHg"),
+    Field("baroDayLowTime", 12, "H", unit="time"),
+    Field("baroDayHighTime", 14, "H", unit="time"),
+    Field("windDayHighMs", 16, "B", unit="mph"),
+    Field("windDayHighTime", 17, "H", unit="time"),
+    Field("windMonthHighMs", 19, "B", unit="mph"),
+    Field("windYearHighMs", 20, "B", unit="mph"),
+    Field("inTempDayHighC", 21, "h", scale=10, unit="F"),
+    Field("inTempDayLowC", 23, "h", scale=10, unit="F"),
+    Field("inTempDayHighTime", 25, "H", unit="time"),
+    Field("inTempDayLowTime", 27, "H", unit="time"),
+    Field("outTempDayLowC", 47, "h", scale=10, unit="F"),
+    Field("outTempDayHighC", 49, "h", scale=10, unit="F"),
+    Field("outTempDayLowTime", 51, "H", unit="time"),
+    Field("outTempDayHighTime", 53, "H", unit="time"),
+    Field("windChillDayLowC", 79, "h", unit="F"),
+    Field("windChillDayLowTime", 81, "H", unit="time"),
+    Field("windChillMonthLowC", 83, "h", unit="F"),
+    Field("windChillYearLowC", 85, "h", unit="F"),
+    Field("heatIndexDayHighC", 87, "h", unit="F"),
+    Field("heatIndexDayHighTime", 89, "H", unit="time"),
+    Field("heatIndexMonthHighC", 91, "h", unit="F"),
+    Field("heatIndexYearHighC", 93, "h", unit="F"),
+    Field("rainRateDayHighMmHr", 116, "H", unit="clicks"),
+    Field("rainRateDayHighTime", 118, "H", unit="time"),
+    Field("rainRateHourHighMmHr", 120, "H", unit="clicks"),
+])
+
+# Rev B archive record, 52 bytes (five per DMP/DMPAFT page)
+ARCHIVE_LAYOUT = PacketLayout("ARCHIVE", 52, [
+    Field("dateStamp", 0, "H"),
+    Field("timeStamp", 2, "H"),
+    Field("outsideTempC", 4, "h", sentinel=32767, scale=10, unit="F"),
+    Field("outsideTempHighC", 6, "h", sentinel=-32768, scale=10, unit="F"),
+    Field("outsideTempLowC", 8, "h", sentinel=32767, scale=10, unit="F"),
+    Field("rainfallMm", 10, "H", unit="clicks"),
+    Field("rainRateHighMmHr", 12, "H", unit="clicks"),
+    Field("barometerHpa", 14, "H", sentinel=0, scale=1000, unit="inHg"),
+    Field("solarRadiationWm2", 16, "H", sentinel=32767),
+    Field("windSamples", 18, "H"),
+    Field("insideTempC", 20, "h", sentinel=32767, scale=10, unit="F"),
+    Field("insideHumidityPercent", 22, "B", sentinel=255),
+    Field("outsideHumidityPercent", 23, "B", sentinel=255),
+    Field("avgWindSpeedMs", 24, "B", sentinel=255, unit="mph"),
+    Field("windSpeedHighMs", 25, "B", unit="mph"),
+    Field("windDirectionHighDeg", 26, "B", sentinel=255, unit="compass"),
+    Field("prevailingWindDirDeg", 27, "B", sentinel=255, unit="compass"),
+    Field("uvIndex", 28, "B", sentinel=255, scale=10),
+    Field("etMm", 29, "B", scale=1000, unit="in"),
+    Field("solarRadiationHighWm2", 30, "H", sentinel=32767),
+    Field("uvIndexHigh", 32, "B", sentinel=255, scale=10),
+    Field("forecastRule", 33, "B"),
+    Field("recordType", 42, "B"),
+])
@@ -0,0 +1,241 @@
+import math
+import time
+from array import array
+from datetime import datetime
+from threading import Lock
+from packets import LOOP_LAYOUT, LOOP2_LAYOUT, TEXT_UNITS
+
+try:
+    import numpy as np
+except ImportError:  # Queries fall back to pure Python
+    np = None
+
+# --- Configuration ---
+# 24 hours of samples at the console's fastest rate (one every 2 seconds)
+RING_CAPACITY = 43200
+# 24 hours of per-minute aggregates, plus the minute a 24 h window starting
+# mid-minute reaches back into (window / step + 1 buckets)
+MINUTE_CAPACITY = 1441
+# Largest number of buckets a single query may return
+MAX_BUCKETS = 10000
+
+# Every numeric LOOP/LOOP2 field is kept
+LIVE_FIELDS = [
+    field.name for field in LOOP_LAYOUT.fields + LOOP2_LAYOUT.fields
+    if field.unit not in TEXT_UNITS
+]
+
+class _Ring:
+    """Timestamps plus named columns in preallocated typed arrays."""
+
+    def __init__(self, capacity, columns):
+        self.capacity = capacity
+        self.times = array('d', bytes(8 * capacity))
+        self.columns = {
+            name: array(typecode, bytes(array(typecode).itemsize * capacity))
+            for name, typecode in columns.items()
+        }
+        self.head = 0
+        self.count = 0
+
+    @property
+    def last(self):
+        return (self.head - 1) % self.capacity
+
+    def advance(self, timestamp):
+        slot = self.head
+        self.times[slot] = timestamp
+        self.head = (slot + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        return slot
+
+    def segments(self, first):
+        """Physical (start, stop) ranges holding logical rows first..count, oldest first."""
+        oldest = self.head if self.count == self.capacity else 0
+        start = (oldest + first) % self.capacity
+        length = self.count - first
+        if start + length <= self.capacity:
+            return [(start, start + length)]
+        return [(start, self.capacity), (0, start + length - self.capacity)]
+
+    def window(self, start, names):
+        """
+        Copies the rows at or after start, oldest first, as a times vector and
+        a (names x rows) float64 block (NumPy) or a dict of lists (pure Python).
+        """
+        if np is None:
+            ordered = [t for a, b in self.segments(0) for t in self.times[a:b]]
+            first = next((i for i, t in enumerate(ordered) if t >= start), len(ordered))
+            segments = self.segments(first)
+            return ordered[first:], {
+                name: [v for a, b in segments for v in self.columns[name][a:b]] for name in names
+            }
+
+        times_view = np.frombuffer(self.times, np.float64)
+        ordered = np.concatenate([times_view[a:b] for a, b in self.segments(0)])
+        first = int(np.searchsorted(ordered, start))
+        segments = self.segments(first)
+        block = np.empty((len(names), self.count - first), np.float64)
+        for row, name in enumerate(names):
+            view = np.frombuffer(self.columns[name], self.columns[name].typecode)
+            column = 0
+            for a, b in segments:
+                block[row, column:column + b - a] = view[a:b]
+                column += b - a
+        return ordered[first:], block
+
+class SampleRing:
+    """
+    Fixed-capacity ring buffer of recent live samples.
+
+    Timestamps are stored in an array('d') and every field in a preallocated
+    array('f') (missing values are NaN). A second ring keeps per-minute
+    min/max/sum/count for every field, updated as samples arrive, so queries
+    with a step that is a whole number of minutes only touch 1441 rows for a
+    24 h window. Memory use is fixed by the two capacities. Queries are
+    vectorized with NumPy when it is installed.
+    """
+
+    def __init__(self, fields=LIVE_FIELDS, capacity=RING_CAPACITY, minute_capacity=MINUTE_CAPACITY):
+        self.fields = list(fields)
+        self.samples = _Ring(capacity, {name: 'f' for name in self.fields})
+        columns = {}
+        for name in self.fields:
+            columns.update({f"{name}.min": 'f', f"{name}.max": 'f', f"{name}.sum": 'd', f"{name}.count": 'l'})
+        self.minutes = _Ring(minute_capacity, columns)
+        self.lock = Lock()
+
+    def __len__(self):
+        return self.samples.count
+
+    def append(self, live_data):
+        timestamp = datetime.fromisoformat(live_data["liveDataTimestamp"]).timestamp()
+        minute = timestamp // 60 * 60
+        with self.lock:
+            slot = self.samples.advance(timestamp)
+            for name, values in self.samples.columns.items():
+                value = live_data.get(name)
+                values[slot] = math.nan if value is None else value
+
+            minutes = self.minutes
+            if minutes.count == 0 or minutes.times[minutes.last] != minute:
+                slot = minutes.advance(minute)
+                for name in self.fields:
+                    minutes.columns[f"{name}.min"][slot] = math.nan
+                    minutes.columns[f"{name}.max"][slot] = math.nan
+                    minutes.columns[f"{name}.sum"][slot] = 0.0
+                    minutes.columns[f"{name}.count"][slot] = 0
+            slot = minutes.last
+            for name in self.fields:
+                value = live_data.get(name)
+                if value is None:
+                    continue
+                columns = minutes.columns
+                count = columns[f"{name}.count"][slot]
+                if count == 0 or value < columns[f"{name}.min"][slot]:
+                    columns[f"{name}.min"][slot] = value
+                if count == 0 or value > columns[f"{name}.max"][slot]:
+                    columns[f"{name}.max"][slot] = value
+                columns[f"{name}.sum"][slot] += value
+                columns[f"{name}.count"][slot] = count + 1
+
+    def query(self, window, step, fields=None, now=None):
+        """
+        Downsamples the last window seconds into buckets of step seconds,
+        aligned to multiples of step. Returns bucket start times (unix
+        seconds) and per-field min, max and mean series; buckets without
+        samples are left out.
+        """
+        if step <= 0 or window <= 0:
+            raise ValueError("window and step must be positive.")
+        if window / step > MAX_BUCKETS:
+            raise ValueError(f"window/step may produce at most {MAX_BUCKETS} buckets.")
+        fields = list(fields or self.fields)
+        unknown = [name for name in fields if name not in self.samples.columns]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+
+        now = time.time() if now is None else now
+        start = (now - window) // step * step
+        result = {"window": window, "step": step, "time": [], "fields": {}}
+        k = len(fields)
+        # Both the NumPy and the pure Python path read the same rows, so they
+        # return the same buckets
+        if step % 60 == 0:
+            names = [f"{name}.{part}" for part in ("min", "max", "sum", "count") for name in fields]
+            with self.lock:
+                times, block = self.minutes.window(start, names)
+            if np is None:
+                block = [block[name] for name in names]
+            mins, maxs, sums, counts = block[:k], block[k:2 * k], block[2 * k:3 * k], block[3 * k:]
+        else:
+            with self.lock:
+                times, values = self.samples.window(start, fields)
+            if np is None:
+                values = [values[name] for name in fields]
+                counts = [[0 if value != value else 1 for value in column] for column in values]
+                sums = [[0.0 if value != value else value for value in column] for column in values]
+            else:
+                counts = ~np.isnan(values)
+                sums = np.where(counts, values, 0.0)
+            mins = maxs = values
+
+        if np is None:
+            return _downsample_python(result, step, times, fields, mins, maxs, sums, counts)
+        if len(times) == 0:
+            result["fields"] = {name: {"min": [], "max": [], "mean": []} for name in fields}
+            return result
+
+        if step == 60:
+            # Every minute row is already a bucket of its own
+            result["time"] = times.tolist()
+        else:
+            # Rows are sorted, so bucket boundaries are found by binary search
+            edges = start + step * np.arange(int((times[-1] - start) // step) + 2)
+            bounds = np.searchsorted(times, edges)
+            filled = bounds[:-1] < bounds[1:]
+            starts = bounds[:-1][filled]
+            counts = np.add.reduceat(counts, starts, axis=1)
+            sums = np.add.reduceat(sums, starts, axis=1)
+            mins = np.fmin.reduceat(mins, starts, axis=1)
+            maxs = np.fmax.reduceat(maxs, starts, axis=1)
+            result["time"] = edges[:-1][filled].tolist()
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = sums / counts
+
+        # Converted a whole (fields x buckets) block at a time
+        mins, maxs, means = _to_list(mins), _to_list(maxs), _to_list(means)
+        for row, name in enumerate(fields):
+            result["fields"][name] = {"min": mins[row], "max": maxs[row], "mean": means[row]}
+        return result
+
+def _downsample_python(result, step, times, fields, mins, maxs, sums, counts):
+    buckets = {}
+    for i, t in enumerate(times):
+        bucket = t // step * step
+        if bucket not in buckets:
+            buckets[bucket] = []
+            result["time"].append(bucket)
+        buckets[bucket].append(i)
+    for row, name in enumerate(fields):
+        series = {"min": [], "max": [], "mean": []}
+        for rows in buckets.values():
+            count = sum(counts[row][i] for i in rows)
+            if not count:
+                series["min"].append(None)
+                series["max"].append(None)
+                series["mean"].append(None)
+                continue
+            # Rows without values hold NaN, which never compares below or above
+            series["min"].append(round(min(mins[row][i] for i in rows if mins[row][i] == mins[row][i]), 3))
+            series["max"].append(round(max(maxs[row][i] for i in rows if maxs[row][i] == maxs[row][i]), 3))
+            series["mean"].append(round(sum(sums[row][i] for i in rows) / count, 3))
+        result["fields"][name] = series
+    return result
+
+def _to_list(block):
+    # NaN marks buckets where a field had no values; JSON needs null instead
+    rows = block.round(3).tolist()
+    if not np.isnan(block).any():
+        return rows
+    return [[None if value != value else value for value in row] for row in rows]
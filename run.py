@@ -1,62 +1,394 @@
-import uvicorn
-from fastapi import FastAPI
-from threading import Thread, Lock
-import time
-from weather_station import fetch_all_data
-
-# --- Global Cache and Lock ---
-# This dictionary will hold the latest weather data
-weather_data_cache = {
-    "liveData": None,
-    "hiLowData": None,
-    "consoleInfo": None,
-    "error": "Data is being fetched for the first time. Please wait..."
-}
-# A lock to ensure only one thread accesses the cache at a time
-cache_lock = Lock()
-
-# --- FastAPI App ---
-app = FastAPI(
-    title="Vantage Pro2 Weather API",
-    description="Provides live and summary data from a Davis Vantage Pro2 weather station.",
-    version="1.0.0"
-)
-
-# --- Background Task ---
-def update_weather_data_periodically():
-    """
-    A function to be run in a background thread.
-    It calls fetch_all_data() every 60 seconds and updates the cache.
-    """
-    global weather_data_cache
-    while True:
-        print("[INFO] Background thread: Fetching new weather data...")
-        data = fetch_all_data()
-        
-        with cache_lock:
-            weather_data_cache = data
-        
-        print("[INFO] Background thread: Cache updated. Sleeping for 5 seconds.")
-        time.sleep(5) # Wait 5 seconds before fetching again
-
-# --- API Endpoint ---
-@app.get("/data")
-def get_data():
-    """
-    Returns the most recent weather data from the cache.
-    The cache is updated by a background thread every 60 seconds.
-    """
-    with cache_lock:
-        return weather_data_cache
-
-# --- Server Startup ---
-if __name__ == "__main__":
-    # Start the background thread on a separate daemon thread
-    # This means it will stop when the main app stops
-    print("[INFO] Starting background data-fetching thread...")
-    data_thread = Thread(target=update_weather_data_periodically, daemon=True)
-    data_thread.start()
-    
-    # Start the FastAPI server
-    print("[INFO] Starting FastAPI server on http://0.0.0.0:8888")
-    uvicorn.run(app, host="0.0.0.0", port=8888)
\ No newline at end of file
+import asyncio
+import logging
+import os
+import sqlite3
+import uvicorn
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from fastapi import FastAPI, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from multiprocessing import Process
+from scheduler import resolve_fields, section_ages
+from storage import parse_time_param
+from ring_buffer import SampleRing
+from stations import StationRegistry
+from broadcast import Broadcaster, KEEPALIVE_SECONDS
+from encoding import (
+    EncodedSnapshot, LazySnapshot, DOCUMENT_FORMATS, FORMAT_PACKAGES, MEDIA_TYPES, encode, negotiate, iter_csv,
+    iter_ndjson
+)
+from shared_snapshot import SnapshotReader, SNAPSHOT_PATH, METRICS_SUFFIX
+from serial_reader import run_serial_reader
+from logs import setup_logging
+from metrics import MetricsMiddleware, SNAPSHOT_AGE, SERVER_PREFIXES, render_prometheus
+
+# --- Server Configuration ---
+# With more than one web worker, the serial port is owned by a separate
+# reader process and the workers serve the snapshots it publishes
+WEB_WORKERS = 1
+# Set (to the snapshot file) in the environment of workers that follow a reader process
+SHARED_SNAPSHOT_ENV = "VANTAGE_SHARED_SNAPSHOT"
+# How often a worker checks the shared snapshot for a new sequence number
+FOLLOW_INTERVAL_SECONDS = 0.1
+# How long a worker waits after failing to read the shared snapshot
+FOLLOW_RETRY_SECONDS = 1.0
+
+log = logging.getLogger(__name__)
+
+# --- Stations ---
+# Every configured console is polled independently, with its own cache and
+# store (see stations.py). With several web workers only the primary
+# station is served, from the snapshots of the reader process, and its
+# database is only read: the reader process creates and upgrades it.
+# Stations are built in the lifespan of the process that serves them, so
+# importing this module (e.g. in the process supervising the workers)
+# opens nothing.
+stations = None
+primary_station = None
+
+# --- History Store ---
+# /history, /recent, /stream and /ws serve the primary station.
+# Every LOOP sample and archive record is kept on disk for /history
+sample_store = None
+# The last 24 hours of live samples are also kept in memory for /recent
+recent_samples = SampleRing()
+# Live samples are pushed to /stream and /ws subscribers as they arrive
+broadcaster = Broadcaster()
+# Serial link metrics published by the reader process (multi-worker mode only)
+serial_metrics_reader = SnapshotReader(os.environ.get(SHARED_SNAPSHOT_ENV, SNAPSHOT_PATH) + METRICS_SUFFIX)
+
+def load_stations():
+    """Builds the stations this process serves (see above)."""
+    global stations, primary_station, sample_store
+    worker_mode = bool(os.environ.get(SHARED_SNAPSHOT_ENV))
+    stations = StationRegistry.load(primary_only=worker_mode, readonly=worker_mode)
+    primary_station = stations.primary
+    sample_store = primary_station.store
+
+# --- FastAPI App ---
+@asynccontextmanager
+async def lifespan(app):
+    setup_logging()
+    load_stations()
+    broadcaster.bind(asyncio.get_running_loop())
+    if os.environ.get(SHARED_SNAPSHOT_ENV):
+        backfill_recent_samples()
+        updaters = [asyncio.create_task(follow_shared_snapshot(SnapshotReader(os.environ[SHARED_SNAPSHOT_ENV])))]
+    else:
+        primary_station.scheduler.add_sample_listener(recent_samples.append)
+        primary_station.scheduler.add_sample_listener(
+            lambda sample: broadcaster.publish(sample, primary_station.scheduler.derived))
+        log.info("Starting serial polling tasks.", extra={"stations": len(stations)})
+        updaters = [asyncio.create_task(station.run()) for station in stations]
+    yield
+    # Cancelling also closes the serial ports
+    for updater in updaters:
+        updater.cancel()
+    await asyncio.gather(*updaters, return_exceptions=True)
+    stations.close()
+
+app = FastAPI(
+    title="Vantage Pro2 Weather API",
+    description="Provides live and summary data from a Davis Vantage Pro2 weather station.",
+    version="1.0.0",
+    lifespan=lifespan
+)
+app.add_middleware(MetricsMiddleware)
+
+# --- Background Tasks ---
+def backfill_recent_samples():
+    """Loads the stored LOOP samples of the last 24 hours into the in-memory ring."""
+    if not os.path.exists(sample_store.path):
+        # The reader process has not created the database yet
+        return
+    end = datetime.now()
+    for sample in sample_store.history(end - timedelta(days=1), end, "raw")["samples"]:
+        if sample.pop("source") == "loop":
+            sample["liveDataTimestamp"] = sample.pop("time")
+            recent_samples.append(sample)
+
+async def follow_shared_snapshot(reader):
+    """
+    Runs in web workers instead of the serial polling tasks: serves the
+    snapshots published by the reader process as the primary station's and
+    feeds each new live sample to the in-memory ring and the push subscribers.
+    """
+    last_snapshot = None
+    last_sample = None
+    while True:
+        try:
+            snapshot = reader.read()
+            if snapshot is not None and snapshot is not last_snapshot:
+                last_snapshot = snapshot
+                primary_station.cache = LazySnapshot.from_encoded(snapshot)
+                live_data = primary_station.cache.value["liveData"]
+                if live_data and live_data["liveDataTimestamp"] != last_sample:
+                    last_sample = live_data["liveDataTimestamp"]
+                    recent_samples.append(live_data)
+                    primary_station.sample_arrived(live_data)
+                    broadcaster.publish(live_data, primary_station.cache.value.get("derived"))
+        except Exception:
+            # Keep following: the next snapshot the reader publishes may be fine
+            log.exception("Failed to read shared snapshot.", extra={"path": reader.path})
+            await asyncio.sleep(FOLLOW_RETRY_SECONDS)
+        await asyncio.sleep(FOLLOW_INTERVAL_SECONDS)
+
+# --- API Endpoints ---
+# Formats of the history endpoints: documents, plus streamed exports for /history
+EXPORT_FORMATS = {"csv": iter_csv, "ndjson": iter_ndjson}
+
+def response_format(request, offered=DOCUMENT_FORMATS, requested=None):
+    """
+    The format to answer in: requested (a format query parameter) if given,
+    otherwise the one the Accept header prefers. An Accept header naming none
+    of the offered formats gets JSON, as before formats could be negotiated;
+    only a format parameter that cannot be served is rejected with 406.
+    """
+    if requested is not None:
+        if requested in FORMAT_PACKAGES and requested not in offered:
+            raise HTTPException(status_code=406, detail=(
+                f"Format {requested!r} needs the optional {FORMAT_PACKAGES[requested]} package, which is not installed."))
+        if requested not in offered:
+            raise HTTPException(status_code=406, detail=f"Unknown format {requested!r}. Use one of {', '.join(offered)}.")
+        return requested
+    return negotiate(request.headers.get("accept"), offered) or offered[0]
+
+def document_response(value, format):
+    return Response(encode(value, format), media_type=MEDIA_TYPES[format], headers={"Vary": "Accept"})
+
+def snapshot_response(request, snapshot):
+    headers = {"ETag": snapshot.etag, "Last-Modified": snapshot.last_modified, "Cache-Control": "no-cache",
+               "Vary": "Accept"}
+    if snapshot.matches(request.headers.get("if-none-match")):
+        return Response(status_code=304, headers=headers)
+    return Response(snapshot.body, media_type=snapshot.media_type, headers=headers)
+
+async def station_cache(station, max_age):
+    """The station's cache, after waiting for a sample newer than max_age seconds if given."""
+    if max_age is None:
+        return station.cache
+    try:
+        return await station.fresh_cache(max_age)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail=f"No live data newer than {max_age:g} s arrived in time.")
+
+def field_selection(fields):
+    try:
+        return resolve_fields(fields.split(",")) if fields else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/data")
+async def get_data(request: Request, fields: str = None,
+                   max_age: float = Query(None, alias="maxAge", ge=0)):
+    """
+    Returns the most recent weather data of the primary station from the cache.
+    Each section is updated by the background scheduler at its own cadence;
+    sectionUpdated reports when each one was. fields (comma-separated)
+    returns only those fields, grouped by section, without decoding or
+    encoding the rest. The body is encoded once per update and selection;
+    clients sending the last ETag in If-None-Match get a 304. With maxAge,
+    live data older than that many seconds is not served: the request waits
+    for the next sample, sharing it with every other waiting request, and
+    gets a 503 if none arrives in time. The Accept header picks JSON,
+    MessagePack (application/msgpack) or CBOR (application/cbor).
+    """
+    format = response_format(request)
+    selection = field_selection(fields)
+    cache = await station_cache(primary_station, max_age)
+    return snapshot_response(request, cache.encoded(selection, format))
+
+@app.get("/stations")
+async def get_stations():
+    """Lists the configured stations with the age of their data and their last error."""
+    return [station.summary() for station in stations]
+
+@app.get("/stations/data")
+async def get_all_stations_data(request: Request, fields: str = None):
+    """
+    Returns the data of every station in one response, keyed by station id.
+    Each station's cached body is embedded as is; fields works as for /data.
+    """
+    format = response_format(request)
+    selection = field_selection(fields)
+    return snapshot_response(request, EncodedSnapshot.combine(
+        {station.id: station.cache.encoded(selection, format) for station in stations}, format
+    ))
+
+@app.get("/stations/{station_id}/data")
+async def get_station_data(request: Request, station_id: str, fields: str = None,
+                           max_age: float = Query(None, alias="maxAge", ge=0)):
+    """Returns the most recent data of one station; same options as /data."""
+    station = stations.get(station_id)
+    if station is None:
+        raise HTTPException(status_code=404, detail=f"Unknown station {station_id!r}.")
+    format = response_format(request)
+    selection = field_selection(fields)
+    cache = await station_cache(station, max_age)
+    return snapshot_response(request, cache.encoded(selection, format))
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Prometheus metrics: serial command latency and failures, bytes read,
+    CRC errors, parse time, wake-up retries, reconnects, snapshot section
+    ages and HTTP request counts and latency.
+    """
+    now = datetime.now()
+    for station in stations:
+        for section, age in section_ages(station.cache.value.get("sectionUpdated"), now).items():
+            if age is not None:
+                SNAPSHOT_AGE.labels(station.id, section).set(age)
+    if os.environ.get(SHARED_SNAPSHOT_ENV):
+        # The serial link metrics come from the reader process
+        serial_metrics = serial_metrics_reader.read()
+        text = render_prometheus(SERVER_PREFIXES) + (serial_metrics.body.decode() if serial_metrics else "")
+    else:
+        text = render_prometheus()
+    return Response(text, media_type="text/plain; version=0.0.4")
+
+@app.get("/history")
+def get_history(request: Request, start: str = None, end: str = None, resolution: str = None,
+                fields: str = None, layout: str = "rows", format: str = None):
+    """
+    Returns stored samples between start and end (unix seconds or ISO 8601;
+    defaults to the last 24 hours). resolution is raw, 1m, 1h or 1d; rollups
+    report min/max/mean/sum/count per bucket. Without a resolution the finest
+    one that keeps the response small is used. fields is a comma-separated list.
+
+    layout=columns lists the column names once followed by one array per
+    column. The Accept header (or format) picks JSON, MessagePack or CBOR,
+    or CSV and NDJSON, which are streamed in chunks so that exports of any
+    length are never held in memory; without a resolution they are raw.
+    """
+    format = response_format(request, DOCUMENT_FORMATS + list(EXPORT_FORMATS), format)
+    if layout not in ("rows", "columns"):
+        raise HTTPException(status_code=400, detail="layout must be rows or columns.")
+    try:
+        end_time = parse_time_param(end) if end else datetime.now()
+        start_time = parse_time_param(start) if start else end_time - timedelta(days=1)
+        field_list = fields.split(",") if fields else None
+        if format in EXPORT_FORMATS:
+            rows = sample_store.iter_history(start_time, end_time, resolution or "raw", field_list)
+            return StreamingResponse(EXPORT_FORMATS[format](rows), media_type=MEDIA_TYPES[format],
+                                     headers={"Vary": "Accept"})
+        if layout == "columns":
+            return document_response(sample_store.history_columns(start_time, end_time, resolution, field_list), format)
+        return document_response(sample_store.history(start_time, end_time, resolution, field_list), format)
+    except (ValueError, OverflowError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except sqlite3.OperationalError:
+        # A web worker started before the reader process created the database
+        log.warning("History database not readable.", exc_info=True, extra={"path": sample_store.path})
+        raise HTTPException(status_code=503, detail="History is not available yet.")
+
+@app.get("/recent")
+def get_recent(request: Request, window: float = 3600, step: float = 60, fields: str = None, format: str = None):
+    """
+    Returns the last window seconds of live samples from memory, downsampled
+    into buckets of step seconds with min/max/mean per field. Steps that are
+    whole minutes are answered from per-minute aggregates. Formats are
+    negotiated as for /data.
+    """
+    format = response_format(request, requested=format)
+    try:
+        return document_response(recent_samples.query(window, step, fields.split(",") if fields else None), format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# Sections whose fields /stream and /ws messages carry
+PUSH_SECTIONS = ("liveData", "derived")
+
+def push_fields(fields):
+    """Field names of a push subscription; raises ValueError for names that are never pushed."""
+    if not fields:
+        return None
+    selection = resolve_fields(fields.split(","))
+    others = [name for section, name in selection if section not in PUSH_SECTIONS]
+    if others:
+        raise ValueError(f"Field(s) not pushed: {', '.join(others)}. Only liveData and derived fields are.")
+    return [name for _, name in selection]
+
+@app.get("/stream")
+async def stream(fields: str = None, min_interval: float = Query(0, alias="minInterval")):
+    """
+    Pushes every new live sample as a Server-Sent Event. fields limits the
+    fields sent (liveDataTimestamp is always included) and minInterval the
+    rate, in seconds. A client that falls too far behind is disconnected.
+    """
+    try:
+        subscription = broadcaster.subscribe(push_fields(fields), min_interval)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def events():
+        try:
+            while True:
+                try:
+                    message = await subscription.get(KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    # Comment line so proxies do not close an idle stream
+                    yield ": keep-alive\n\n"
+                    continue
+                if message is None:
+                    return
+                yield f"data: {message}\n\n"
+        finally:
+            broadcaster.unsubscribe(subscription)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.websocket("/ws")
+async def websocket_stream(websocket: WebSocket, fields: str = None, min_interval: float = Query(0, alias="minInterval")):
+    """
+    Pushes every new live sample as a JSON text message; same options as
+    /stream. Unknown fields close the connection with code 1008.
+    """
+    await websocket.accept()
+    try:
+        subscription = broadcaster.subscribe(push_fields(fields), min_interval)
+    except ValueError as e:
+        await websocket.close(code=1008, reason=str(e))
+        return
+
+    async def send():
+        while True:
+            message = await subscription.get()
+            if message is None:
+                # Policy violation: the client did not keep up
+                await websocket.close(code=1008)
+                return
+            await websocket.send_text(message)
+
+    async def receive():
+        # Client messages are ignored; reading them is how a close is
+        # noticed while no sample is due
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+
+    sender, receiver = asyncio.create_task(send()), asyncio.create_task(receive())
+    try:
+        done, _ = await asyncio.wait((sender, receiver), return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            task.result()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        sender.cancel()
+        receiver.cancel()
+        broadcaster.unsubscribe(subscription)
+
+# --- Server Startup ---
+if __name__ == "__main__":
+    setup_logging()
+    if WEB_WORKERS > 1:
+        # Only the reader process opens the serial port; the workers find
+        # the snapshot file through the environment they inherit
+        Process(target=run_serial_reader, args=(SNAPSHOT_PATH,), daemon=True).start()
+        os.environ[SHARED_SNAPSHOT_ENV] = SNAPSHOT_PATH
+        log.info("Starting FastAPI server.", extra={"url": "http://0.0.0.0:8888", "workers": WEB_WORKERS})
+        uvicorn.run("run:app", host="0.0.0.0", port=8888, workers=WEB_WORKERS)
+    else:
+        # Serial polling runs on the server's own event loop (see lifespan)
+        log.info("Starting FastAPI server.", extra={"url": "http://0.0.0.0:8888"})
+        uvicorn.run(app, host="0.0.0.0", port=8888)
\ No newline at end of file
@@ -0,0 +1,306 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+import serial
+from aggregates import RollingAggregates, DERIVED_FIELDS
+from archive import download_archive
+from packets import LOOP_LAYOUT, LOOP2_LAYOUT, HILOWS_LAYOUT
+from weather_station import (
+    LoopStream, fetch_hilows_data, get_console_time, get_firmware_ver, get_firmware_nver
+)
+
+# --- Default Cadences (seconds) ---
+HILOWS_INTERVAL = 60
+# Triggered HILOWS fetches are never closer together than this
+HILOWS_MIN_INTERVAL = 10
+CONSOLE_TIME_INTERVAL = 3600
+# How long a failed task waits before it is tried again
+TASK_RETRY_SECONDS = 30
+# Shortest wait before retrying after a serial error; after a dropped link
+# the session's reconnect backoff is waited out instead
+ERROR_RETRY_SECONDS = 1
+
+log = logging.getLogger(__name__)
+
+# --- HILOWS Triggers ---
+# (liveData field, hiLowData field, direction): HILOWS is fetched early as soon
+# as the live value goes above a high (+1) or below a low (-1) record.
+HILOW_TRIGGERS = [
+    ("barometerHpa", "baroDayHighHpa", 1),
+    ("barometerHpa", "baroDayLowHpa", -1),
+    ("windSpeedMs", "windDayHighMs", 1),
+    ("insideTempC", "inTempDayHighC", 1),
+    ("insideTempC", "inTempDayLowC", -1),
+    ("outsideTempC", "outTempDayHighC", 1),
+    ("outsideTempC", "outTempDayLowC", -1),
+    ("windChillC", "windChillDayLowC", -1),
+    ("heatIndexC", "heatIndexDayHighC", 1),
+    ("rainRateMmHr", "rainRateDayHighMmHr", 1),
+]
+
+def hilows_exceeded(live_data, hilows_data):
+    if not live_data or not hilows_data:
+        return False
+    for live_field, hilow_field, direction in HILOW_TRIGGERS:
+        value = live_data.get(live_field)
+        record = hilows_data.get(hilow_field)
+        if value is None or record is None:
+            continue
+        if (value - record) * direction > 0:
+            return True
+    return False
+
+async def fetch_firmware_info(session):
+    log.debug("Fetching firmware info.")
+    firmware_date = await session.run(get_firmware_ver)
+    firmware_version = await session.run(get_firmware_nver)
+    if firmware_date is None and firmware_version is None:
+        return None
+    return {"firmwareDate": firmware_date, "firmwareVersion": firmware_version}
+
+async def fetch_hilows_lazily(session):
+    # Kept as raw bytes: fields are decoded only when a trigger or a request reads them
+    return await fetch_hilows_data(session, lazy=True)
+
+async def fetch_console_time(session):
+    log.debug("Fetching console time.")
+    return await session.run(get_console_time)
+
+def archive_fetcher(store):
+    """
+    Returns a task that downloads the archive records newer than the store's
+    newest sample. The store is only used through its writer thread, since a
+    /history query or a flush may hold it for a while. The download only
+    counts as done once every record is stored.
+    """
+    async def fetch_archive(session):
+        since = await asyncio.wrap_future(store.submit(store.latest_time))
+        # Pages must be acknowledged promptly, so their records are stored in the background
+        writes = []
+        count = await download_archive(
+            session, lambda records: writes.append(store.submit(store.add_archive_records, records)), since=since)
+        if count:
+            writes.append(store.submit(store.flush))
+        results = await asyncio.gather(*(asyncio.wrap_future(write) for write in writes), return_exceptions=True)
+        if any(isinstance(result, Exception) for result in results):
+            # Already logged by the store; the next download resumes after the newest stored record
+            return None
+        return count
+    return fetch_archive
+
+def section_ages(section_updated, now=None):
+    """Seconds since each section of a snapshot's sectionUpdated was updated, None if never."""
+    now = datetime.now() if now is None else now
+    return {
+        name: round((now - datetime.fromisoformat(updated)).total_seconds(), 1) if updated else None
+        for name, updated in (section_updated or {}).items()
+    }
+
+# --- Field Selection ---
+# The fields each data section of a snapshot can hold, for /data?fields=
+SECTION_FIELDS = {
+    "liveData": LOOP_LAYOUT.names + LOOP2_LAYOUT.names + ["liveDataTimestamp"],
+    "hiLowData": HILOWS_LAYOUT.names,
+    "consoleInfo": ["consoleTime", "firmwareDate", "firmwareVersion"],
+    "derived": DERIVED_FIELDS,
+}
+_FIELD_SECTIONS = {name: section for section, names in SECTION_FIELDS.items() for name in names}
+
+def resolve_fields(names):
+    """
+    Maps field names to (section, field) pairs for LazySnapshot.encoded().
+    Raises ValueError for unknown names.
+    """
+    unknown = [name for name in names if name not in _FIELD_SECTIONS]
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(unknown)}.")
+    return tuple((_FIELD_SECTIONS[name], name) for name in names)
+
+# --- Scheduling ---
+
+class PollTask:
+    """
+    A command type that runs at its own interval, once per connection, or
+    early when triggered.
+    """
+
+    def __init__(self, name, fetch, interval=None, min_interval=0, once_per_connection=False):
+        self.name = name
+        self.fetch = fetch
+        self.interval = interval
+        self.min_interval = min_interval
+        self.once_per_connection = once_per_connection
+        self.triggered = False
+        self.last_run = None
+        self.connection_id = None
+        self.retry_at = 0.0
+
+    def due(self, now, connection_id):
+        if now < self.retry_at:
+            return False
+        if self.triggered:
+            return self.last_run is None or now - self.last_run >= self.min_interval
+        if self.once_per_connection:
+            return self.connection_id != connection_id
+        return self.last_run is None or now - self.last_run >= self.interval
+
+    def done(self, now, connection_id, ok):
+        self.triggered = False
+        if ok:
+            self.last_run = now
+            self.connection_id = connection_id
+            self.retry_at = 0.0
+        else:
+            self.retry_at = now + TASK_RETRY_SECONDS
+
+class PollScheduler:
+    """
+    Owns the serial bus and runs each command type at its own cadence.
+
+    LOOP packets are streamed continuously and the stream is only paused
+    when another task is due: HILOWS every hilows_interval seconds, at
+    midnight, or as soon as a LOOP value passes the current high or low;
+    GETTIME every console_time_interval seconds; VER/NVER once per connection.
+    With a store, archive records missed while disconnected are downloaded
+    into it once per connection, before the stream starts.
+    After every update the merged snapshot is passed to on_update, every
+    LOOP sample to each sample listener and every raw LOOP packet to each
+    packet listener. Each LOOP sample also updates the rolling aggregates,
+    published as the snapshot's derived section. run_forever() is a
+    coroutine meant to run as a task on the server's event loop;
+    cancelling it stops polling at once.
+    """
+
+    def __init__(self, session, hilows_interval=HILOWS_INTERVAL,
+                 console_time_interval=CONSOLE_TIME_INTERVAL, on_update=None, store=None):
+        self.session = session
+        self.stream = LoopStream(session)
+        self.on_update = on_update
+        self.sample_listeners = []
+        self.aggregates = RollingAggregates()
+        self.derived = None
+        self.sample_requested = False
+        self.tasks_deferred = False
+        self.tasks = [] if store is None else [
+            PollTask("archive", archive_fetcher(store), once_per_connection=True),
+        ]
+        self.tasks += [
+            PollTask("hiLowData", fetch_hilows_lazily, interval=hilows_interval,
+                     min_interval=HILOWS_MIN_INTERVAL),
+            PollTask("consoleTime", fetch_console_time, interval=console_time_interval),
+            PollTask("firmware", fetch_firmware_info, once_per_connection=True),
+        ]
+        self.sections = {"liveData": None, "hiLowData": None, "consoleTime": None, "firmware": None}
+        if store is not None:
+            self.sections["archive"] = None
+        self.updated = dict.fromkeys(self.sections)
+        self.error = "Data is being fetched for the first time. Please wait..."
+        self.hilows_day = None
+
+    def add_sample_listener(self, listener):
+        self.sample_listeners.append(listener)
+
+    def add_packet_listener(self, listener):
+        self.stream.packet_listeners.append(listener)
+
+    def request_sample(self):
+        """
+        Asks for the next LOOP sample as soon as possible: commands that are
+        due wait until it has been read, but are never passed over twice in
+        a row.
+        """
+        self.sample_requested = True
+
+    def task(self, name):
+        return next(task for task in self.tasks if task.name == name)
+
+    def snapshot(self):
+        """
+        Merges the latest result of every section and reports when each was
+        last updated. Ages are left to whoever serves it (section_ages()),
+        since the snapshot is encoded once and served until the next update.
+        """
+        console_info = None
+        if self.sections["consoleTime"] is not None or self.sections["firmware"] is not None:
+            console_info = {
+                "consoleTime": self.sections["consoleTime"],
+                **(self.sections["firmware"] or {"firmwareDate": None, "firmwareVersion": None})
+            }
+        return {
+            "liveData": self.sections["liveData"],
+            "hiLowData": self.sections["hiLowData"],
+            "consoleInfo": console_info,
+            "derived": self.derived,
+            "sectionUpdated": {
+                name: updated.isoformat() if updated else None
+                for name, updated in self.updated.items()
+            },
+            "error": self.error
+        }
+
+    def publish(self, name=None, value=None, error=None):
+        if name is not None:
+            self.sections[name] = value
+            self.updated[name] = datetime.now()
+        self.error = error
+        if self.on_update:
+            self.on_update(self.snapshot())
+
+    async def run_due_tasks(self):
+        today = datetime.now().date()
+        if self.hilows_day is not None and self.hilows_day != today:
+            # The console resets its daily highs and lows at midnight
+            self.task("hiLowData").triggered = True
+
+        for task in self.tasks:
+            now = time.monotonic()
+            if not task.due(now, self.session.connection_id):
+                continue
+            await self.stream.stop()
+            result = await task.fetch(self.session)
+            task.done(time.monotonic(), self.session.connection_id, result is not None)
+            if result is not None:
+                if task.name == "hiLowData":
+                    self.hilows_day = today
+                self.publish(task.name, result, self.error)
+
+    async def poll_once(self):
+        if self.sample_requested and not self.tasks_deferred:
+            self.tasks_deferred = True
+        else:
+            self.tasks_deferred = False
+            await self.run_due_tasks()
+        live_data = await self.stream.read()
+        if live_data is None:
+            self.publish(error="Failed to read LOOP packets.")
+            return
+        self.sample_requested = False
+        if hilows_exceeded(live_data, self.sections["hiLowData"]):
+            self.task("hiLowData").triggered = True
+        self.derived = self.aggregates.add(live_data)
+        self.publish("liveData", live_data)
+        for listener in self.sample_listeners:
+            listener(live_data)
+
+    async def run_forever(self):
+        try:
+            while True:
+                try:
+                    await self.poll_once()
+                except serial.SerialException as e:
+                    retry_in = max(ERROR_RETRY_SECONDS, self.session.next_attempt - time.monotonic())
+                    log.error("Scheduler error.", extra={"error": str(e), "retry_in": round(retry_in, 1)})
+                    self.publish(error=str(e))
+                    await asyncio.sleep(retry_in)
+        finally:
+            self.close()
+
+    def close(self):
+        """Cancels a running LOOP stream and closes the serial port."""
+        if self.stream.active:
+            try:
+                self.session.ser.write(b'\n')
+            except serial.SerialException:
+                pass
+        self.session.close()
@@ -0,0 +1,42 @@
+import asyncio
+import logging
+from logs import setup_logging
+from metrics import render_prometheus, SERIAL_PREFIXES
+from shared_snapshot import SnapshotWriter, SNAPSHOT_PATH, METRICS_SUFFIX
+from stations import Station, load_station_configs
+
+log = logging.getLogger(__name__)
+
+def run_serial_reader(path=SNAPSHOT_PATH):
+    """
+    Owns the primary station's serial port in its own process: polls it,
+    stores samples, archive records and raw packets, and publishes every
+    encoded snapshot to the shared snapshot file that the web workers serve
+    from. Its serial link metrics are published after every sample for the
+    workers' /metrics.
+    """
+    # A spawned process does not inherit the parent's logging setup
+    setup_logging()
+    log.info("Starting serial reader process.", extra={"snapshot": path})
+    writer = SnapshotWriter(path)
+    metrics_writer = SnapshotWriter(path + METRICS_SUFFIX)
+    station = Station(**load_station_configs()[0], primary=True)
+    # Replaces whatever an earlier run left in the file
+    writer.publish(station.cache.encoded())
+    station.update_listeners.append(lambda cache: writer.publish(cache.encoded()))
+    station.scheduler.add_sample_listener(
+        lambda sample: metrics_writer.write(render_prometheus(SERIAL_PREFIXES).encode()))
+    try:
+        asyncio.run(station.run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        station.close()
+        writer.close()
+        metrics_writer.close()
+
+if __name__ == "__main__":
+    # Run alongside `uvicorn run:app --workers N` with VANTAGE_SHARED_SNAPSHOT set
+    # to the same path, or let `python run.py` start it when WEB_WORKERS > 1
+    import sys
+    run_serial_reader(sys.argv[1] if len(sys.argv) > 1 else SNAPSHOT_PATH)
@@ -0,0 +1,122 @@
+import mmap
+import os
+import struct
+from encoding import EncodedSnapshot
+
+# --- Configuration ---
+SNAPSHOT_PATH = 'weather_snapshot.bin'
+# The serial reader's metrics are shared through a second file next to it
+METRICS_SUFFIX = '.metrics'
+# Largest encoded snapshot (ETag, Last-Modified and body together)
+SNAPSHOT_CAPACITY = 1 << 20
+# Reads retried while the writer is mid-update before the previous copy is used
+MAX_READ_ATTEMPTS = 100
+
+# Sequence number, ETag length, Last-Modified length, body length
+HEADER = struct.Struct('<QIII')
+SEQUENCE = struct.Struct('<Q')
+
+class SnapshotWriter:
+    """
+    Publishes encoded snapshots into a memory-mapped file.
+
+    The file starts with a sequence number used as a seqlock: it is made odd
+    before the payload is overwritten and even again once the write is
+    complete, so readers in other processes can detect torn reads without
+    any lock. There must be only one writer per file.
+    """
+
+    def __init__(self, path=SNAPSHOT_PATH, capacity=SNAPSHOT_CAPACITY):
+        self.path = path
+        self.capacity = capacity
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, HEADER.size + capacity)
+            self.map = mmap.mmap(fd, HEADER.size + capacity)
+        finally:
+            os.close(fd)
+        # Continue after the last sequence number so readers of an older
+        # file notice the first write; an odd one was left by a crash
+        self.sequence = (SEQUENCE.unpack_from(self.map)[0] + 1) & ~1
+
+    def publish(self, snapshot):
+        self.write(snapshot.body, snapshot.etag.encode(), snapshot.last_modified.encode())
+
+    def write(self, body, etag=b"", last_modified=b""):
+        size = len(etag) + len(last_modified) + len(body)
+        if size > self.capacity:
+            raise ValueError(f"Snapshot of {size} bytes does not fit in {self.capacity} bytes.")
+
+        # Odd while the lengths and payload are being replaced
+        HEADER.pack_into(self.map, 0, self.sequence + 1, len(etag), len(last_modified), len(body))
+        offset = HEADER.size
+        for part in (etag, last_modified, body):
+            self.map[offset:offset + len(part)] = part
+            offset += len(part)
+        self.sequence += 2
+        SEQUENCE.pack_into(self.map, 0, self.sequence)
+
+    def close(self):
+        self.map.close()
+
+class SnapshotReader:
+    """
+    Reads the snapshots published by a SnapshotWriter, possibly in another
+    process. The payload is only copied when the sequence number changed;
+    otherwise the previously read snapshot is returned as is.
+    """
+
+    def __init__(self, path=SNAPSHOT_PATH):
+        self.path = path
+        self.map = None
+        self.sequence = None
+        self.snapshot = None
+
+    def open(self):
+        try:
+            fd = os.open(self.path, os.O_RDONLY)
+        except FileNotFoundError:
+            return False
+        try:
+            # The writer may have created the file without sizing it yet
+            if os.fstat(fd).st_size < HEADER.size:
+                return False
+            self.map = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+        return True
+
+    def read(self):
+        """The latest complete snapshot, or None until one has been published."""
+        if self.map is None and not self.open():
+            return None
+        for _ in range(MAX_READ_ATTEMPTS):
+            sequence, etag_length, modified_length, body_length = HEADER.unpack_from(self.map)
+            if sequence == self.sequence or sequence == 0:
+                break
+            if sequence % 2:
+                continue
+            start = HEADER.size
+            end = start + etag_length + modified_length + body_length
+            if end > len(self.map):
+                # Mapped before the writer resized the file: map it again
+                self.map.close()
+                self.map = None
+                if not self.open():
+                    return self.snapshot
+                continue
+            payload = self.map[start:end]
+            if SEQUENCE.unpack_from(self.map)[0] != sequence:
+                continue
+            self.snapshot = EncodedSnapshot.restore(
+                payload[etag_length + modified_length:],
+                payload[:etag_length].decode(),
+                payload[etag_length:etag_length + modified_length].decode()
+            )
+            self.sequence = sequence
+            break
+        return self.snapshot
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
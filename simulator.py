@@ -0,0 +1,484 @@
+import json
+import math
+import os
+import random
+import select
+import struct
+import sys
+import time
+from datetime import datetime, timedelta
+from threading import Thread
+from crc import crc16
+from packets import LOOP_LAYOUT, LOOP2_LAYOUT, HILOWS_LAYOUT, ARCHIVE_LAYOUT
+from archive import RECORDS_PER_PAGE, ACK, NAK, encode_datestamp
+
+# --- Configuration ---
+# Seconds between packets of an LPS stream (the console sends one every 2 s)
+LOOP_INTERVAL = 2.0
+# Archive records kept by the simulated console, one per interval
+ARCHIVE_INTERVAL_MINUTES = 5
+ARCHIVE_RECORDS = 288
+FIRMWARE_DATE = "Apr 10 2020"
+FIRMWARE_VERSION = "3.15"
+
+# --- Fault Injection ---
+
+class Faults:
+    """
+    Faults injected into the simulator's replies, changeable while it runs.
+
+    latency is added before every reply (seconds); drop, crc and wake are
+    probabilities that a reply loses one byte, that a packet's CRC is
+    corrupted, and that a wake-up is ignored. Parsed from and printed as
+    "latency=0.1,drop=0.01,crc=0.05,wake=0.2".
+    """
+
+    NAMES = ("latency", "drop", "crc", "wake")
+
+    def __init__(self, latency=0.0, drop=0.0, crc=0.0, wake=0.0):
+        self.latency = latency
+        self.drop = drop
+        self.crc = crc
+        self.wake = wake
+
+    def update(self, spec):
+        """Applies "name=value,..." settings; "reset" clears every fault."""
+        if spec.strip() == "reset":
+            self.__init__()
+            return
+        for setting in filter(None, spec.replace(" ", "").split(",")):
+            name, _, value = setting.partition("=")
+            if name not in self.NAMES:
+                raise ValueError(f"Unknown fault {name!r}. Use one of {', '.join(self.NAMES)}.")
+            setattr(self, name, float(value))
+
+    def __str__(self):
+        return ",".join(f"{name}={getattr(self, name)}" for name in self.NAMES)
+
+# --- Weather Traces ---
+
+class SyntheticTrace:
+    """
+    Plausible weather as a function of time: a daily temperature and solar
+    cycle, humidity that follows temperature, a wandering wind and
+    occasional showers. Values are in the units the API reports.
+    """
+
+    def __init__(self, seed=0):
+        self.random = random.Random(seed)
+        self.wind = 3.0
+        self.direction = 200.0
+        self.shower_until = None
+
+    def sample(self, when):
+        hours = when.hour + when.minute / 60 + when.second / 3600
+        day = math.sin(2 * math.pi * (hours - 9) / 24)
+        sun = max(0.0, math.sin(math.pi * (hours - 6) / 12))
+        noise = self.random.gauss
+
+        self.wind = min(25.0, max(0.0, self.wind + noise(0, 0.3)))
+        self.direction = (self.direction + noise(0, 8)) % 360
+        if self.shower_until is None and self.random.random() < 0.001:
+            self.shower_until = when + timedelta(minutes=self.random.randint(5, 40))
+        if self.shower_until is not None and when >= self.shower_until:
+            self.shower_until = None
+        raining = self.shower_until is not None
+
+        return {
+            "outsideTempC": 14 + 7 * day + noise(0, 0.1),
+            "insideTempC": 21 + noise(0, 0.05),
+            "outsideHumidityPercent": round(min(100, max(5, 65 - 20 * day + (25 if raining else 0)))),
+            "insideHumidityPercent": 42,
+            "barometerHpa": 1013 + 4 * math.sin(2 * math.pi * hours / 48) + noise(0, 0.05),
+            "windSpeedMs": self.wind,
+            "windGustMs": self.wind * (1.3 + abs(noise(0, 0.2))),
+            "windDirectionDeg": round(self.direction),
+            "rainRateMmHr": self.random.uniform(2, 12) if raining else 0.0,
+            "solarRadiationWm2": round(850 * sun),
+            "uvIndex": round(8 * sun, 1),
+            "consoleBatteryV": 4.7,
+        }
+
+class FileTrace:
+    """
+    Replays a JSON-lines trace, one object of API-unit values per line, at
+    step seconds per line, wrapping around at the end.
+    """
+
+    def __init__(self, path, step=LOOP_INTERVAL * 2):
+        with open(path) as f:
+            self.samples = [json.loads(line) for line in f if line.strip()]
+        if not self.samples:
+            raise ValueError(f"Trace {path} is empty.")
+        self.step = step
+        self.start = None
+
+    def sample(self, when):
+        if self.start is None:
+            self.start = when
+        index = int((when - self.start).total_seconds() // self.step)
+        return dict(self.samples[index % len(self.samples)])
+
+# --- Derived Values ---
+
+def dewpoint(temp_c, humidity):
+    gamma = math.log(max(humidity, 1) / 100) + 17.62 * temp_c / (243.12 + temp_c)
+    return 243.12 * gamma / (17.62 - gamma)
+
+def heat_index(temp_c, humidity):
+    if temp_c < 27:
+        return temp_c
+    t = temp_c * 9 / 5 + 32
+    f = (-42.379 + 2.04901523 * t + 10.14333127 * humidity - 0.22475541 * t * humidity
+         - 6.83783e-3 * t * t - 5.481717e-2 * humidity * humidity)
+    return (f - 32) * 5 / 9
+
+def wind_chill(temp_c, wind_ms):
+    kmh = wind_ms * 3.6
+    if temp_c > 10 or kmh < 4.8:
+        return temp_c
+    return 13.12 + 0.6215 * temp_c - 11.37 * kmh ** 0.16 + 0.3965 * temp_c * kmh ** 0.16
+
+# --- Simulated Console ---
+
+# (HILOWS field, its time field, live field, direction): the daily records
+# the console tracks, +1 for highs and -1 for lows
+HILOW_RECORDS = [
+    ("baroDayLowHpa", "baroDayLowTime", "barometerHpa", -1),
+    ("baroDayHighHpa", "baroDayHighTime", "barometerHpa", 1),
+    ("windDayHighMs", "windDayHighTime", "windSpeedMs", 1),
+    ("inTempDayHighC", "inTempDayHighTime", "insideTempC", 1),
+    ("inTempDayLowC", "inTempDayLowTime", "insideTempC", -1),
+    ("outTempDayHighC", "outTempDayHighTime", "outsideTempC", 1),
+    ("outTempDayLowC", "outTempDayLowTime", "outsideTempC", -1),
+    ("windChillDayLowC", "windChillDayLowTime", "windChillC", -1),
+    ("heatIndexDayHighC", "heatIndexDayHighTime", "heatIndexC", 1),
+    ("rainRateDayHighMmHr", "rainRateDayHighTime", "rainRateMmHr", 1),
+]
+
+def with_crc(payload):
+    payload = bytes(payload)
+    return payload + crc16(payload, 0).to_bytes(2, 'big')
+
+class ConsoleState:
+    """What the simulated console has measured: live values, rain totals, highs and lows, archive."""
+
+    def __init__(self, trace):
+        self.trace = trace
+        self.rain = {"dailyRainMm": 0.0, "stormRainMm": 0.0, "monthlyRainMm": 0.0, "yearlyRainMm": 0.0}
+        self.hilows = {}
+        self.day = None
+        self.last_update = None
+        self.live = None
+        self.archive = []
+        self._fill_archive(datetime.now())
+
+    def update(self, now):
+        if self.day != now.date():
+            self.day = now.date()
+            self.hilows = {}
+            self.rain["dailyRainMm"] = 0.0
+        values = self.trace.sample(now)
+        temp, humidity, wind = (values.get(name) for name in ("outsideTempC", "outsideHumidityPercent", "windSpeedMs"))
+        if temp is not None and humidity is not None:
+            values.setdefault("dewpointC", dewpoint(temp, humidity))
+            values.setdefault("heatIndexC", heat_index(temp, humidity))
+            values.setdefault("thswIndexC", values["heatIndexC"])
+        if temp is not None and wind is not None:
+            values.setdefault("windChillC", wind_chill(temp, wind))
+        if wind is not None:
+            values.setdefault("avgWind10minMs", wind)
+            values.setdefault("avgWind10minMsHires", wind)
+            values.setdefault("avgWind2minMs", wind)
+            values.setdefault("windGust10minMs", values.get("windGustMs", wind))
+        values.setdefault("windGust10minDirDeg", values.get("windDirectionDeg"))
+
+        if self.last_update is not None:
+            rain = values.get("rainRateMmHr", 0.0) * (now - self.last_update).total_seconds() / 3600
+            for total in self.rain:
+                self.rain[total] += rain
+        self.last_update = now
+        values.update({name: values.get(name, total) for name, total in self.rain.items()})
+        values.setdefault("last24hrRainMm", self.rain["dailyRainMm"])
+        values.setdefault("sunrise", "06:30")
+        values.setdefault("sunset", "18:45")
+        self._track_hilows(values, now.strftime("%H:%M"))
+        self.live = values
+        self._fill_archive(now)
+        return values
+
+    def _track_hilows(self, values, clock):
+        for record, time_field, source, direction in HILOW_RECORDS:
+            value = values.get(source)
+            current = self.hilows.get(record)
+            if value is not None and (current is None or (value - current) * direction > 0):
+                self.hilows[record] = value
+                self.hilows[time_field] = clock
+        # Month and year records are not tracked separately
+        for day, longer in (("windDayHighMs", ("windMonthHighMs", "windYearHighMs")),
+                            ("windChillDayLowC", ("windChillMonthLowC", "windChillYearLowC")),
+                            ("heatIndexDayHighC", ("heatIndexMonthHighC", "heatIndexYearHighC")),
+                            ("rainRateDayHighMmHr", ("rainRateHourHighMmHr",))):
+            for name in longer:
+                self.hilows[name] = self.hilows.get(day)
+
+    def _fill_archive(self, now):
+        """Adds a record for every archive interval that ended since the last one."""
+        interval = timedelta(minutes=ARCHIVE_INTERVAL_MINUTES)
+        latest = now.replace(second=0, microsecond=0)
+        latest -= timedelta(minutes=latest.minute % ARCHIVE_INTERVAL_MINUTES)
+        stamp = self.archive[-1][0] + interval if self.archive else latest - interval * (ARCHIVE_RECORDS - 1)
+        while stamp <= latest:
+            values = self.trace.sample(stamp)
+            date_stamp, time_stamp = struct.unpack('<HH', encode_datestamp(stamp))
+            temp = values.get("outsideTempC")
+            direction = values.get("windDirectionDeg")
+            compass = None if direction is None else round(direction / 22.5) % 16 * 22.5
+            self.archive.append((stamp, ARCHIVE_LAYOUT.encode({
+                **values,
+                "dateStamp": date_stamp,
+                "timeStamp": time_stamp,
+                "outsideTempHighC": None if temp is None else temp + 0.3,
+                "outsideTempLowC": None if temp is None else temp - 0.3,
+                "rainfallMm": values.get("rainRateMmHr", 0.0) * ARCHIVE_INTERVAL_MINUTES / 60,
+                "rainRateHighMmHr": values.get("rainRateMmHr", 0.0),
+                "windSamples": ARCHIVE_INTERVAL_MINUTES * 60 // 3,
+                "avgWindSpeedMs": values.get("windSpeedMs"),
+                "windSpeedHighMs": values.get("windGustMs", values.get("windSpeedMs")),
+                "windDirectionHighDeg": compass,
+                "prevailingWindDirDeg": compass,
+                "solarRadiationHighWm2": values.get("solarRadiationWm2"),
+                "uvIndexHigh": values.get("uvIndex"),
+            })))
+            stamp += interval
+        del self.archive[:-ARCHIVE_RECORDS]
+
+    # --- Packets ---
+
+    def loop_packet(self):
+        packet = LOOP_LAYOUT.encode(self.live)
+        packet[0:5] = b'LOO\x00\x00'
+        packet[95:97] = b'\n\r'
+        return with_crc(packet[:97])
+
+    def loop2_packet(self):
+        packet = LOOP2_LAYOUT.encode(self.live)
+        packet[0:5] = b'LOO\x00\x01'
+        packet[95:97] = b'\n\r'
+        return with_crc(packet[:97])
+
+    def hilows_packet(self):
+        return with_crc(HILOWS_LAYOUT.encode(self.hilows)[:436])
+
+    def archive_pages(self, since):
+        """DMPAFT pages holding the records newer than since, and the index of the first one."""
+        first = next((i for i, (stamp, _) in enumerate(self.archive) if since is None or stamp > since),
+                     len(self.archive))
+        start = first - first % RECORDS_PER_PAGE
+        pages = []
+        for number, offset in enumerate(range(start, len(self.archive), RECORDS_PER_PAGE)):
+            records = b''.join(record for _, record in self.archive[offset:offset + RECORDS_PER_PAGE])
+            records += b'\xff' * (RECORDS_PER_PAGE * ARCHIVE_LAYOUT.size - len(records))
+            pages.append(with_crc(bytes([number % 256]) + records + bytes(4)))
+        return pages, first - start
+
+class Simulator:
+    """
+    A Vantage Pro2 console on a pseudo-terminal.
+
+    Answers wake-ups, LPS/LOOP, HILOWS, GETTIME, VER, NVER and DMPAFT with
+    CRC-correct packets built from a weather trace, and injects the
+    configured faults. Point SERIAL_PORT at the path returned by open().
+    Needs a POSIX system with pseudo-terminals (Linux, macOS).
+    """
+
+    def __init__(self, trace=None, faults=None, loop_interval=LOOP_INTERVAL, seed=0):
+        self.state = ConsoleState(trace or SyntheticTrace(seed))
+        self.faults = faults or Faults()
+        self.loop_interval = loop_interval
+        self.random = random.Random(seed)
+        self.master = None
+        # The serial end is kept open too, so the master does not fail between clients
+        self.slave = None
+        self.thread = None
+        self.input = b''
+        self.stream = None
+        self.running = False
+
+    def open(self):
+        """Creates the pseudo-terminal and returns the path of its serial end."""
+        import pty
+        import tty
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.master)
+        tty.setraw(self.slave)
+        return os.ttyname(self.slave)
+
+    def start(self):
+        """Opens the pseudo-terminal, serves it from a daemon thread and returns its path."""
+        path = self.open()
+        self.thread = Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return path
+
+    def stop(self):
+        """Stops serving, waits for the serving thread to finish and closes the pseudo-terminal."""
+        self.running = False
+        if self.thread is not None:
+            # Every wait in the thread is a select() with a timeout, so this is quick
+            self.thread.join()
+            self.thread = None
+        for fd in (self.master, self.slave):
+            if fd is not None:
+                os.close(fd)
+        self.master = self.slave = None
+
+    # --- I/O ---
+
+    def send(self, data, packet=False):
+        if self.faults.latency:
+            time.sleep(self.faults.latency)
+        if packet and self.random.random() < self.faults.crc:
+            data = data[:-1] + bytes([data[-1] ^ 0xFF])
+        if self.random.random() < self.faults.drop and len(data) > 1:
+            index = self.random.randrange(len(data))
+            data = data[:index] + data[index + 1:]
+        os.write(self.master, data)
+
+    def receive(self, size, timeout=2.0):
+        """Reads exactly size bytes from the bridge (for DMPAFT), or None on timeout."""
+        deadline = time.monotonic() + timeout
+        while len(self.input) < size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([self.master], [], [], remaining)[0]:
+                return None
+            self.input += os.read(self.master, 1024)
+        data, self.input = self.input[:size], self.input[size:]
+        return data
+
+    def serve_forever(self, control=None):
+        """Serves the console; control is an optional file of fault settings, one per line."""
+        self.running = True
+        sources = [self.master] + ([control] if control is not None else [])
+        while self.running:
+            timeout = 0.05 if self.stream else 0.5
+            readable = select.select(sources, [], [], timeout)[0]
+            if control is not None and control in readable:
+                line = control.readline()
+                if not line:
+                    sources.remove(control)
+                elif line.strip():
+                    try:
+                        self.faults.update(line)
+                        print(f"Faults: {self.faults}", flush=True)
+                    except ValueError as e:
+                        print(e, flush=True)
+            if self.master in readable:
+                try:
+                    self.input += os.read(self.master, 1024)
+                except OSError:
+                    # The serial end was closed; wait for the next client
+                    time.sleep(0.1)
+                    continue
+                self.handle_input()
+            self.stream_packets()
+
+    def handle_input(self):
+        if self.stream is not None and b'\n' in self.input:
+            # A newline cancels a running LPS/LOOP stream without a reply
+            self.stream = None
+            self.input = self.input.split(b'\n', 1)[1]
+        while b'\n' in self.input:
+            line, self.input = self.input.split(b'\n', 1)
+            self.handle_command(line.strip().decode('ascii', 'replace'))
+
+    def handle_command(self, command):
+        words = command.split()
+        name = words[0].upper() if words else ""
+        if name == "":
+            if self.random.random() >= self.faults.wake:
+                self.send(b'\n\r')
+        elif name in ("LPS", "LOOP"):
+            types = int(words[1]) if name == "LPS" and len(words) > 2 else 1
+            count = int(words[-1]) if len(words) > 1 else 1
+            self.send(ACK)
+            self.stream = {"types": types, "remaining": count, "next": time.monotonic(), "sent": 0}
+        elif name == "HILOWS":
+            self.state.update(datetime.now())
+            self.send(ACK + self.state.hilows_packet(), packet=True)
+        elif name == "GETTIME":
+            now = datetime.now()
+            clock = bytes([now.second, now.minute, now.hour, now.day, now.month, now.year - 1900])
+            self.send(ACK + with_crc(clock), packet=True)
+        elif name == "VER":
+            self.send(f"\n\rOK\n\r{FIRMWARE_DATE}\n\r".encode('ascii'))
+        elif name == "NVER":
+            self.send(f"\n\rOK\n\r{FIRMWARE_VERSION}\n\r".encode('ascii'))
+        elif name == "DMPAFT":
+            self.dump_archive()
+        else:
+            self.send(b'\n\r')
+
+    def stream_packets(self):
+        stream = self.stream
+        if stream is None or time.monotonic() < stream["next"]:
+            return
+        if stream["sent"] % 2 == 0:
+            self.state.update(datetime.now())
+        # LPS 1 sends LOOP, LPS 2 LOOP2 and LPS 3 alternates, starting with LOOP
+        loop2 = stream["types"] == 2 or (stream["types"] == 3 and stream["sent"] % 2)
+        self.send(self.state.loop2_packet() if loop2 else self.state.loop_packet(), packet=True)
+        stream["sent"] += 1
+        stream["remaining"] -= 1
+        stream["next"] += self.loop_interval
+        if stream["remaining"] <= 0:
+            self.stream = None
+
+    def dump_archive(self):
+        self.send(ACK)
+        stamp = self.receive(6)
+        if stamp is None or crc16(stamp, 0) != 0:
+            self.send(NAK)
+            return
+        date_stamp, time_stamp = struct.unpack_from('<HH', stamp)
+        since = None
+        if date_stamp:
+            since = datetime(2000 + (date_stamp >> 9), (date_stamp >> 5) & 0x0F, date_stamp & 0x1F,
+                             time_stamp // 100, time_stamp % 100)
+        self.send(ACK)
+
+        self.state.update(datetime.now())
+        pages, first_index = self.state.archive_pages(since)
+        self.send(with_crc(struct.pack('<HH', len(pages), first_index)))
+        if self.receive(1) != ACK:
+            return
+        for page in pages:
+            while True:
+                self.send(page, packet=True)
+                reply = self.receive(1, timeout=5.0)
+                if reply == NAK:
+                    continue
+                if reply != ACK:
+                    return
+                break
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Simulated Vantage Pro2 console on a pseudo-terminal.")
+    parser.add_argument("--trace", help="JSON-lines weather trace (default: synthetic weather)")
+    parser.add_argument("--interval", type=float, default=LOOP_INTERVAL, help="seconds between LOOP packets")
+    parser.add_argument("--faults", default="", help="e.g. latency=0.05,drop=0.01,crc=0.02,wake=0.1")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    faults = Faults()
+    faults.update(args.faults)
+    simulator = Simulator(FileTrace(args.trace) if args.trace else None, faults, args.interval, args.seed)
+    print(simulator.open(), flush=True)
+    print("Type fault settings (e.g. crc=0.5) or 'reset' to change them while running.", file=sys.stderr)
+    try:
+        simulator.serve_forever(control=sys.stdin)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        simulator.stop()
@@ -0,0 +1,184 @@
+import asyncio
+import json
+import logging
+import os
+import re
+from datetime import datetime
+from capture import CaptureLog, CAPTURE_DIR
+from encoding import LazySnapshot
+from scheduler import PollScheduler, section_ages
+from storage import SampleStore, DATABASE_PATH
+from weather_station import StationSession, BAUD_RATE
+
+# --- Configuration ---
+# JSON file listing the consoles to poll, e.g.
+#   {"stations": [{"id": "roof", "name": "Roof", "port": "/dev/ttyUSB0"},
+#                 {"id": "field", "port": "/dev/ttyUSB1", "baudrate": 19200}]}
+# Without it, a single station "default" is polled on SERIAL_PORT
+# (weather_station.py).
+STATIONS_PATH = 'stations.json'
+# A station whose poller stopped on an unexpected error is restarted after this long
+STATION_RESTART_SECONDS = 30
+# Station ids appear in URLs and file names
+STATION_ID_PATTERN = re.compile(r'[A-Za-z0-9_-]+')
+# Longest wait for a sample newer than a request's maxAge
+REFRESH_TIMEOUT_SECONDS = 10
+
+log = logging.getLogger(__name__)
+
+INITIAL_SNAPSHOT = {
+    "liveData": None,
+    "hiLowData": None,
+    "consoleInfo": None,
+    "derived": None,
+    "error": "Data is being fetched for the first time. Please wait..."
+}
+
+class Station:
+    """
+    One console and everything polled from it: its own serial session,
+    scheduler, snapshot cache, sample store and capture log. Stations share
+    nothing, so a console that is slow or gone only affects its own data.
+
+    The primary station keeps the default database and capture paths; the
+    others get their id appended to them. A readonly station only reads its
+    store, for web workers that serve another process's station.
+    """
+
+    def __init__(self, id, port, name=None, baudrate=BAUD_RATE, primary=False, readonly=False):
+        if not STATION_ID_PATTERN.fullmatch(id):
+            raise ValueError(f"Invalid station id {id!r}: use letters, digits, '-' and '_'.")
+        self.id = id
+        self.name = name or id
+        self.primary = primary
+        session = StationSession(port, baudrate)
+        self.port = session.port
+        base, ext = os.path.splitext(DATABASE_PATH)
+        self.store = SampleStore(DATABASE_PATH if primary else f"{base}-{id}{ext}", readonly=readonly)
+        self.packet_log = CaptureLog(CAPTURE_DIR if primary else os.path.join(CAPTURE_DIR, id))
+        self.cache = LazySnapshot(INITIAL_SNAPSHOT)
+        self.update_listeners = []
+        # Time of the newest live sample, and the wait shared by requests for a newer one
+        self.sample_time = None
+        self.sample_waiter = None
+        self.scheduler = PollScheduler(session, on_update=self.update, store=self.store)
+        self.scheduler.add_packet_listener(self.packet_log.append)
+        self.scheduler.add_sample_listener(self.sample_arrived)
+
+    def update(self, snapshot):
+        """Called by the scheduler with the merged snapshot after every update."""
+        self.cache = LazySnapshot(snapshot)
+        for listener in self.update_listeners:
+            listener(self.cache)
+
+    def sample_arrived(self, sample):
+        """Called with every new live sample, once the cache holds it."""
+        self.sample_time = datetime.fromisoformat(sample["liveDataTimestamp"])
+        waiter, self.sample_waiter = self.sample_waiter, None
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    async def fresh_cache(self, max_age, timeout=REFRESH_TIMEOUT_SECONDS):
+        """
+        The cache once its live data is at most max_age seconds old. When it
+        is older, waits for the next sample; every request waiting at the
+        same time shares that one read, and the scheduler reads it before
+        any other due command. Raises asyncio.TimeoutError after timeout.
+        """
+        if self.sample_time is not None and (datetime.now() - self.sample_time).total_seconds() <= max_age:
+            return self.cache
+        if self.sample_waiter is None:
+            self.sample_waiter = asyncio.get_running_loop().create_future()
+            self.scheduler.request_sample()
+        # Shielded so that a client giving up does not cancel the others' wait
+        await asyncio.wait_for(asyncio.shield(self.sample_waiter), timeout)
+        return self.cache
+
+    def summary(self):
+        value = self.cache.value
+        return {
+            "id": self.id,
+            "name": self.name,
+            "port": self.port,
+            "primary": self.primary,
+            "sectionAgeSeconds": section_ages(value.get("sectionUpdated")),
+            "error": value.get("error"),
+        }
+
+    async def run(self):
+        """
+        Polls the console until cancelled. Serial errors are retried by the
+        scheduler itself; anything else restarts it after a pause instead of
+        ending the task, so one station cannot take the others down.
+        """
+        # Writing a batch to SQLite may wait for a /history query, so it is kept off the event loop
+        self.scheduler.add_sample_listener(lambda sample: self.store.submit(self.store.add_live_sample, sample))
+        while True:
+            try:
+                await self.scheduler.run_forever()
+            except Exception as e:
+                log.exception("Station poller failed.",
+                              extra={"station": self.id, "retry_in": STATION_RESTART_SECONDS})
+                self.scheduler.publish(error=f"Poller failed: {e}")
+                await asyncio.sleep(STATION_RESTART_SECONDS)
+
+    def close(self):
+        # Write out any samples still waiting for the next batch
+        self.store.close()
+        self.packet_log.close()
+
+def load_station_configs(path=STATIONS_PATH):
+    """The Station arguments of every configured console, in config order."""
+    if not os.path.exists(path):
+        return [{"id": "default", "port": None}]
+    with open(path) as f:
+        config = json.load(f)
+    configs = [
+        {"id": str(entry["id"]), "port": entry["port"], "name": entry.get("name"),
+         "baudrate": entry.get("baudrate", BAUD_RATE)}
+        for entry in config["stations"]
+    ]
+    log.info("Loaded station config.", extra={"path": path, "stations": ",".join(c["id"] for c in configs)})
+    return configs
+
+class StationRegistry:
+    """The configured stations by id, in config order; the first is the primary one."""
+
+    def __init__(self, stations):
+        if not stations:
+            raise ValueError("At least one station must be configured.")
+        self.stations = {}
+        ports = {}
+        for station in stations:
+            if station.id in self.stations:
+                raise ValueError(f"Duplicate station id {station.id!r}.")
+            # Two pollers on one serial port would garble each other's commands
+            if station.port in ports:
+                raise ValueError(f"Stations {ports[station.port]!r} and {station.id!r} share port {station.port!r}.")
+            self.stations[station.id] = station
+            ports[station.port] = station.id
+        self.primary = stations[0]
+
+    @classmethod
+    def load(cls, path=STATIONS_PATH, primary_only=False, readonly=False):
+        """
+        Builds the stations listed in the config file; primary_only skips all
+        but the first, and readonly opens their stores read-only.
+        """
+        configs = load_station_configs(path)
+        if primary_only:
+            configs = configs[:1]
+        return cls([Station(**config, primary=index == 0, readonly=readonly) for index, config in enumerate(configs)])
+
+    def __iter__(self):
+        return iter(self.stations.values())
+
+    def __len__(self):
+        return len(self.stations)
+
+    def get(self, station_id):
+        return self.stations.get(station_id)
+
+    def close(self):
+        for station in self:
+            station.close()
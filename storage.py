@@ -0,0 +1,518 @@
+import json
+import logging
+import math
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from threading import Lock
+from packets import ARCHIVE_LAYOUT, LOOP_LAYOUT, LOOP2_LAYOUT, TEXT_UNITS
+
+# --- Configuration ---
+DATABASE_PATH = 'weather_history.db'
+# Pending samples are written in one transaction once either limit is reached
+FLUSH_BATCH_SIZE = 30
+FLUSH_INTERVAL_SECONDS = 60
+
+# Rollup tables, keyed by name, in bucket widths (seconds)
+RESOLUTIONS = {"1m": 60, "1h": 3600, "1d": 86400}
+# Without an explicit resolution, /history picks the finest one that keeps
+# the response under this many buckets
+HISTORY_MAX_POINTS = 1500
+# Rows fetched from SQLite at a time while streaming an export
+EXPORT_BATCH_SIZE = 1000
+# Statistics of every field in a rollup row, in column order
+ROLLUP_STATISTICS = ("min", "max", "mean", "sum", "count")
+# Fields rolled up for each sample source: their numeric measurements.
+# Each source is rolled up per minute on its own; the 1m rollups take a
+# minute's LOOP rollup of a field and only fall back to the archive's where
+# no LOOP sample of that field fell into the minute (such as a backfill
+# after downtime), and the coarser rollups are derived from those, so an
+# hour mixing both sources counts every minute once
+ROLLUP_FIELDS = {
+    "loop": frozenset(
+        field.name for field in LOOP_LAYOUT.fields + LOOP2_LAYOUT.fields if field.unit not in TEXT_UNITS
+    ),
+    "archive": frozenset(
+        field.name for field in ARCHIVE_LAYOUT.fields if field.unit not in TEXT_UNITS
+    ) - {"dateStamp", "timeStamp", "windSamples", "forecastRule", "recordType"},
+}
+# Running and rolling totals kept by the console; adding them up means
+# nothing, so their rollups report no sum
+CUMULATIVE_FIELDS = frozenset({
+    "dailyRainMm", "stormRainMm", "monthlyRainMm", "yearlyRainMm", "dayEtMm", "monthEtMm", "yearEtMm",
+    "last15minRainMm", "lastHourRainMm", "last24hrRainMm",
+})
+# Fields stored by each sample source, in the column order of raw exports
+SOURCE_FIELDS = {
+    "loop": LOOP_LAYOUT.names + LOOP2_LAYOUT.names,
+    # The record's date and time stamps become its timestamp
+    "archive": [name for name in ARCHIVE_LAYOUT.names if name not in ("dateStamp", "timeStamp")],
+}
+# Stored as the database's user_version; an older database has its rollups
+# rebuilt from the samples when it is opened
+SCHEMA_VERSION = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    ts REAL NOT NULL,
+    source TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS samples_source_ts ON samples (source, ts);
+CREATE INDEX IF NOT EXISTS samples_ts ON samples (ts);
+"""
+
+MINUTE = RESOLUTIONS["1m"]
+
+ROLLUP_SCHEMA = """
+CREATE TABLE IF NOT EXISTS minute_rollups (
+    bucket INTEGER NOT NULL,
+    field TEXT NOT NULL,
+    source TEXT NOT NULL,
+    min_value REAL NOT NULL,
+    max_value REAL NOT NULL,
+    sum_value REAL NOT NULL,
+    sample_count INTEGER NOT NULL,
+    PRIMARY KEY (bucket, field, source)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rollups (
+    resolution INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    field TEXT NOT NULL,
+    min_value REAL NOT NULL,
+    max_value REAL NOT NULL,
+    sum_value REAL NOT NULL,
+    sample_count INTEGER NOT NULL,
+    PRIMARY KEY (resolution, bucket, field)
+) WITHOUT ROWID;
+"""
+
+UPSERT_MINUTE_ROLLUP = """
+INSERT INTO minute_rollups VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (bucket, field, source) DO UPDATE SET
+    min_value = min(min_value, excluded.min_value),
+    max_value = max(max_value, excluded.max_value),
+    sum_value = sum_value + excluded.sum_value,
+    sample_count = sample_count + excluded.sample_count
+"""
+
+# Recomputes the 1m rollups between two minutes from the per-source ones,
+# the LOOP ones preferred (see ROLLUP_FIELDS)
+MERGE_MINUTES = f"""
+INSERT OR REPLACE INTO rollups
+SELECT {MINUTE}, bucket, field, min_value, max_value, sum_value, sample_count FROM minute_rollups AS m
+WHERE bucket >= :start AND bucket < :end AND (source = 'loop' OR NOT EXISTS (
+    SELECT 1 FROM minute_rollups
+    WHERE bucket = m.bucket AND field = m.field AND source = 'loop'
+))
+"""
+
+# Recomputes the rollups of one resolution between two of its buckets from
+# those of the next finer resolution
+DERIVE_ROLLUPS = """
+INSERT OR REPLACE INTO rollups
+SELECT :resolution, bucket / :resolution * :resolution AS coarse, field,
+       min(min_value), max(max_value), sum(sum_value), sum(sample_count)
+FROM rollups
+WHERE resolution = :finer AND bucket >= :start AND bucket < :end
+GROUP BY coarse, field
+"""
+
+# The rollups of one resolution between two buckets
+SELECT_ROLLUPS = """
+SELECT bucket, field, min_value, max_value, sum_value, sample_count FROM rollups
+WHERE resolution = ? AND bucket >= ? AND bucket < ?
+ORDER BY bucket
+"""
+
+log = logging.getLogger(__name__)
+
+def parse_time_param(value):
+    """Accepts unix seconds or an ISO 8601 timestamp; raises ValueError otherwise."""
+    try:
+        seconds = float(value)
+    except ValueError:
+        return datetime.fromisoformat(value)
+    try:
+        return datetime.fromtimestamp(seconds)
+    except (OverflowError, OSError, ValueError):
+        raise ValueError(f"Time {value!r} is out of range.")
+
+def _iso_time(ts):
+    return datetime.fromtimestamp(ts).isoformat()
+
+def _unix_time(ts):
+    return int(ts) if ts == int(ts) else round(ts, 3)
+
+def numeric_fields(fields):
+    for name, value in fields.items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value):
+            yield name, value
+
+def rollup_rows(samples):
+    """Aggregates (ts, source, fields) samples into one row per minute, ROLLUP_FIELDS field and source."""
+    rollups = {}
+    for ts, source, fields in samples:
+        rolled_up = ROLLUP_FIELDS.get(source, ())
+        for name, value in numeric_fields(fields):
+            if name not in rolled_up:
+                continue
+            key = (int(ts // MINUTE) * MINUTE, name, source)
+            rollup = rollups.get(key)
+            if rollup is None:
+                rollups[key] = [value, value, value, 1]
+            else:
+                rollup[0] = min(rollup[0], value)
+                rollup[1] = max(rollup[1], value)
+                rollup[2] += value
+                rollup[3] += 1
+    return [key + tuple(rollup) for key, rollup in rollups.items()]
+
+def rollup_statistics(field, min_value, max_value, sum_value, count):
+    """A rollup row's values in ROLLUP_STATISTICS order."""
+    total = None if field in CUMULATIVE_FIELDS else round(sum_value, 3)
+    return min_value, max_value, round(sum_value / count, 3), total, count
+
+def _log_write_failure(future):
+    if not future.cancelled() and future.exception() is not None:
+        log.error("Failed to store samples.", exc_info=future.exception())
+
+class SampleStore:
+    """
+    On-disk time-series store for LOOP samples and archive records.
+
+    Every sample is kept in the samples table (indexed by timestamp) and
+    folded into the min/max/sum/count rollups of its source and minute,
+    from which the rollups of each resolution in RESOLUTIONS are derived.
+    Samples are buffered and written in one transaction per batch, so a
+    sample does not cost an fsync. The database runs in WAL mode. Callers on
+    the event loop hand their writes to submit(), which runs them in order
+    on the store's one writer thread.
+
+    A readonly store (as opened by the web workers) only reads the database
+    and leaves creating and upgrading it to the process that writes. It
+    connects on first use, so the workers can start before that process
+    has created the file.
+    """
+
+    def __init__(self, path=DATABASE_PATH, batch_size=FLUSH_BATCH_SIZE,
+                 flush_interval=FLUSH_INTERVAL_SECONDS, readonly=False):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.readonly = readonly
+        self.lock = Lock()
+        self.pending = []
+        self.last_flush = time.monotonic()
+        self._db = None
+        if readonly:
+            self.writer = None
+            return
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        self.db.executescript(ROLLUP_SCHEMA)
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sample-store")
+        if self.db.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            self.rebuild_rollups()
+
+    @property
+    def db(self):
+        if self._db is None:
+            # Only a readonly store gets here; raises sqlite3.OperationalError
+            # until the process that writes has created the database
+            self._db = self._reader()
+        return self._db
+
+    # --- Writing ---
+
+    def submit(self, write, *args):
+        """
+        Queues write(*args), e.g. self.add_live_sample, on the writer thread
+        and returns its concurrent.futures.Future. Failures are logged.
+        """
+        future = self.writer.submit(write, *args)
+        future.add_done_callback(_log_write_failure)
+        return future
+
+    def wait_for_writes(self):
+        """
+        Flushes the pending samples on the writer thread, after the writes
+        queued before it, and waits for it, so a read sees them.
+        """
+        if self.writer is not None:
+            self.submit(self.flush).result()
+
+    def add(self, timestamp, fields, source="loop"):
+        """Buffers one sample; timestamp is a datetime."""
+        with self.lock:
+            self.pending.append((timestamp.timestamp(), source, fields))
+            due = (len(self.pending) >= self.batch_size
+                   or time.monotonic() - self.last_flush >= self.flush_interval)
+        if due:
+            self.flush()
+
+    def add_live_sample(self, live_data):
+        fields = dict(live_data)
+        timestamp = datetime.fromisoformat(fields.pop("liveDataTimestamp"))
+        self.add(timestamp, fields, "loop")
+
+    def add_archive_records(self, records):
+        for record in records:
+            fields = dict(record)
+            timestamp = datetime.fromisoformat(fields.pop("timestamp"))
+            self.add(timestamp, fields, "archive")
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, []
+            self.last_flush = time.monotonic()
+            if not pending:
+                return
+
+            with self.db:
+                # Samples already stored (e.g. a re-downloaded archive record)
+                # are ignored and must not be counted in the rollups again
+                fresh = []
+                for ts, source, fields in pending:
+                    cursor = self.db.execute(
+                        "INSERT OR IGNORE INTO samples VALUES (?, ?, ?)",
+                        (ts, source, json.dumps(fields))
+                    )
+                    if cursor.rowcount:
+                        fresh.append((ts, source, fields))
+                rows = rollup_rows(fresh)
+                self.db.executemany(UPSERT_MINUTE_ROLLUP, rows)
+                self._derive_rollups({bucket for bucket, _, _, _, _, _, _ in rows})
+
+    def _derive_rollups(self, minutes):
+        """Recomputes the rollups of every resolution covering the given minute buckets."""
+        self.db.executemany(MERGE_MINUTES, [{"start": bucket, "end": bucket + MINUTE} for bucket in minutes])
+        buckets, finer = minutes, MINUTE
+        for resolution in RESOLUTIONS.values():
+            if resolution == MINUTE:
+                continue
+            buckets = {bucket // resolution * resolution for bucket in buckets}
+            self.db.executemany(DERIVE_ROLLUPS, [
+                {"resolution": resolution, "finer": finer, "start": bucket, "end": bucket + resolution}
+                for bucket in buckets
+            ])
+            finer = resolution
+
+    def rebuild_rollups(self):
+        """Recreates the rollup tables and recomputes every rollup from the stored samples, in batches."""
+        with self.lock, self.db:
+            self.db.execute("DROP TABLE IF EXISTS minute_rollups")
+            self.db.execute("DROP TABLE IF EXISTS rollups")
+            self.db.executescript(ROLLUP_SCHEMA)
+            cursor = self.db.execute("SELECT ts, source, data FROM samples")
+            while True:
+                rows = cursor.fetchmany(EXPORT_BATCH_SIZE)
+                if not rows:
+                    break
+                samples = [(ts, source, json.loads(data)) for ts, source, data in rows]
+                self.db.executemany(UPSERT_MINUTE_ROLLUP, rollup_rows(samples))
+            everything = {"start": 0, "end": 1 << 62}
+            self.db.execute(MERGE_MINUTES, everything)
+            finer = MINUTE
+            for resolution in RESOLUTIONS.values():
+                if resolution != MINUTE:
+                    self.db.execute(DERIVE_ROLLUPS, {"resolution": resolution, "finer": finer, **everything})
+                    finer = resolution
+            self.db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def close(self):
+        if self.writer is not None:
+            # Writes still queued are run before the connection closes
+            self.writer.shutdown(wait=True)
+            self.flush()
+        with self.lock:
+            if self._db is not None:
+                self._db.close()
+
+    # --- Reading ---
+
+    def latest_time(self):
+        """Newest sample timestamp of any source, including unflushed ones."""
+        with self.lock:
+            newest = self.db.execute("SELECT max(ts) FROM samples").fetchone()[0]
+            if self.pending:
+                newest = max(newest or 0, max(ts for ts, _, _ in self.pending))
+        return datetime.fromtimestamp(newest) if newest else None
+
+    def pick_resolution(self, start, end):
+        span = (end - start).total_seconds()
+        for name, seconds in RESOLUTIONS.items():
+            if span / seconds <= HISTORY_MAX_POINTS:
+                return name
+        return list(RESOLUTIONS)[-1]
+
+    def resolve_resolution(self, start, end, resolution=None):
+        resolution = resolution or self.pick_resolution(start, end)
+        if resolution != "raw" and resolution not in RESOLUTIONS:
+            raise ValueError(f"Unknown resolution {resolution!r}. Use raw or one of {', '.join(RESOLUTIONS)}.")
+        return resolution
+
+    def history(self, start, end, resolution=None, fields=None):
+        """
+        Returns samples between start and end (datetimes). resolution is
+        "raw" or a key of RESOLUTIONS; rollup queries only read the rollup
+        table of that resolution. fields optionally limits the fields returned.
+        """
+        self.wait_for_writes()
+        resolution = self.resolve_resolution(start, end, resolution)
+
+        result = {"resolution": resolution, "start": start.isoformat(), "end": end.isoformat()}
+        with self.lock:
+            if resolution == "raw":
+                rows = self.db.execute(
+                    "SELECT ts, source, data FROM samples WHERE ts >= ? AND ts < ? ORDER BY ts",
+                    (start.timestamp(), end.timestamp())
+                ).fetchall()
+            else:
+                seconds = RESOLUTIONS[resolution]
+                rows = self.db.execute(
+                    SELECT_ROLLUPS,
+                    (seconds, int(start.timestamp() // seconds) * seconds, end.timestamp())
+                ).fetchall()
+
+        if resolution == "raw":
+            samples = []
+            for ts, source, data in rows:
+                sample = json.loads(data)
+                if fields:
+                    sample = {name: sample.get(name) for name in fields}
+                samples.append({"time": datetime.fromtimestamp(ts).isoformat(), "source": source, **sample})
+            result["samples"] = samples
+            return result
+
+        buckets = {}
+        for bucket, field, min_value, max_value, sum_value, count in rows:
+            if fields and field not in fields:
+                continue
+            entry = buckets.setdefault(bucket, {"time": datetime.fromtimestamp(bucket).isoformat()})
+            entry[field] = dict(zip(ROLLUP_STATISTICS, rollup_statistics(field, min_value, max_value, sum_value, count)))
+        result["buckets"] = list(buckets.values())
+        return result
+
+    # --- Columns and Exports ---
+
+    def sample_fields(self, start, end):
+        """The fields of every source with samples between start and end, in SOURCE_FIELDS order."""
+        fields = []
+        with self.lock:
+            for source, names in SOURCE_FIELDS.items():
+                stored = self.db.execute(
+                    "SELECT 1 FROM samples WHERE source = ? AND ts >= ? AND ts < ? LIMIT 1",
+                    (source, start.timestamp(), end.timestamp())
+                ).fetchone()
+                if stored:
+                    fields += [name for name in names if name not in fields]
+        return fields
+
+    def stored_fields(self, start, end):
+        """The rolled-up fields stored between start and end, from the daily rollups."""
+        seconds = RESOLUTIONS["1d"]
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT DISTINCT field FROM rollups WHERE resolution = ? AND bucket >= ? AND bucket < ? ORDER BY field",
+                (seconds, int(start.timestamp() // seconds) * seconds, end.timestamp())
+            ).fetchall()
+        return [field for field, in rows]
+
+    def iter_history(self, start, end, resolution="raw", fields=None, unix_time=False):
+        """
+        The rows of history(), flattened: yields the column names first, then
+        one list per sample or bucket. Raw columns are time, source and the
+        fields; rollup columns are time and <field>.<statistic> for every
+        statistic in ROLLUP_STATISTICS. Without fields, raw rows have every
+        field of the sources stored in the range (sample_fields()) and rollup
+        rows every rolled-up field (stored_fields()). Times are ISO 8601, or
+        unix seconds with unix_time.
+
+        Rows are fetched in batches through a read-only connection of their
+        own, so any range can be streamed in little memory without holding
+        up writes. Arguments are checked before the first row is requested.
+        """
+        self.wait_for_writes()
+        resolution = self.resolve_resolution(start, end, resolution)
+        if fields:
+            fields = list(fields)
+        elif resolution == "raw":
+            fields = self.sample_fields(start, end)
+        else:
+            fields = self.stored_fields(start, end)
+        time_format = _unix_time if unix_time else _iso_time
+        if resolution == "raw":
+            return self._iter_samples(start, end, fields, time_format)
+        return self._iter_rollups(start, end, RESOLUTIONS[resolution], fields, time_format)
+
+    def _reader(self):
+        # Used from whichever threadpool thread advances the export
+        return sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+
+    def _iter_samples(self, start, end, fields, time_format):
+        yield ["time", "source"] + fields
+        db = self._reader()
+        try:
+            cursor = db.execute(
+                "SELECT ts, source, data FROM samples WHERE ts >= ? AND ts < ? ORDER BY ts",
+                (start.timestamp(), end.timestamp())
+            )
+            while True:
+                rows = cursor.fetchmany(EXPORT_BATCH_SIZE)
+                if not rows:
+                    return
+                for ts, source, data in rows:
+                    sample = json.loads(data)
+                    yield [time_format(ts), source] + [sample.get(name) for name in fields]
+        finally:
+            db.close()
+
+    def _iter_rollups(self, start, end, seconds, fields, time_format):
+        yield ["time"] + [f"{name}.{statistic}" for name in fields for statistic in ROLLUP_STATISTICS]
+        columns = {name: index for index, name in enumerate(fields)}
+        width = len(ROLLUP_STATISTICS)
+        db = self._reader()
+        try:
+            cursor = db.execute(
+                SELECT_ROLLUPS,
+                (seconds, int(start.timestamp() // seconds) * seconds, end.timestamp())
+            )
+            # A bucket's fields arrive together, so each row is complete once the bucket changes
+            current, row = None, None
+            while True:
+                rows = cursor.fetchmany(EXPORT_BATCH_SIZE)
+                if not rows:
+                    break
+                for bucket, field, min_value, max_value, sum_value, count in rows:
+                    index = columns.get(field)
+                    if index is None:
+                        continue
+                    if bucket != current:
+                        if row is not None:
+                            yield row
+                        current = bucket
+                        row = [time_format(bucket)] + [None] * (width * len(fields))
+                    row[1 + index * width:1 + (index + 1) * width] = rollup_statistics(
+                        field, min_value, max_value, sum_value, count
+                    )
+            if row is not None:
+                yield row
+        finally:
+            db.close()
+
+    def history_columns(self, start, end, resolution=None, fields=None):
+        """
+        history() in a columnar layout: the column names of iter_history()
+        once, then one array per column, instead of repeating every name
+        in every sample. Times are unix seconds, as in /recent.
+        """
+        resolution = self.resolve_resolution(start, end, resolution)
+        rows = self.iter_history(start, end, resolution, fields, unix_time=True)
+        names = next(rows)
+        columns = [list(column) for column in zip(*rows)] or [[] for _ in names]
+        return {"resolution": resolution, "start": start.isoformat(), "end": end.isoformat(),
+                "fields": names, "columns": columns}
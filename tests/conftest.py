@@ -0,0 +1,16 @@
+import sys
+
+import pytest
+
+from simulator import Faults, Simulator
+
+@pytest.fixture
+def console():
+    """A simulated console on a pseudo-terminal: yields the Simulator and the path of its serial end."""
+    pytest.importorskip("serial_asyncio")
+    if sys.platform == "win32":
+        pytest.skip("The simulator needs a pseudo-terminal.")
+    simulator = Simulator(faults=Faults(), loop_interval=0.05, seed=1)
+    port = simulator.start()
+    yield simulator, port
+    simulator.stop()
@@ -0,0 +1,56 @@
+import math
+import random
+
+import pytest
+
+from aggregates import RollingAggregates, RollingWindow, VectorWindow
+
+@pytest.mark.parametrize("directions,expected", [((355, 5), 0.0), ((350, 0), 355.0), ((359.999, 0.001), 0.0)])
+def test_vector_direction_averages_across_north(directions, expected):
+    aggregates = RollingAggregates()
+    for now, direction in enumerate(directions):
+        derived = aggregates.add({"windSpeedMs": 2.0, "windDirectionDeg": direction}, now=now)
+    assert derived["windVectorDirectionDeg1m"] == expected
+
+def test_rolling_window_matches_brute_force_as_values_expire():
+    rng = random.Random(3)
+    window = RollingWindow(30)
+    added = []
+    for now in range(200):
+        value = rng.uniform(-10, 10)
+        window.add(now, value)
+        added.append((now, value))
+        window.expire(now)
+        current = [v for t, v in added if t > now - 30]
+        assert len(window) == len(current)
+        assert window.min() == min(current)
+        assert window.max() == max(current)
+        assert window.mean() == pytest.approx(sum(current) / len(current))
+
+def test_rolling_window_is_empty_once_everything_expired():
+    window = RollingWindow(10)
+    window.add(0, 5.0)
+    window.add(1, 7.0)
+    window.expire(11)
+    assert (len(window), window.mean(), window.min(), window.max(), window.total) == (0, None, None, None, 0.0)
+
+def test_vector_window_mean_and_expiry():
+    window = VectorWindow(60)
+    window.add(0, 2.0, 90)
+    window.add(10, 2.0, 180)
+    assert window.direction() == pytest.approx(135)
+    assert window.speed() == pytest.approx(math.sqrt(2))
+    # Opposite winds cancel out: no mean direction
+    window.add(20, 2.0, 270)
+    window.add(30, 2.0, 0)
+    assert window.direction() is None
+    # The east wind expired; south and north cancel, leaving west
+    window.expire(65)
+    assert window.direction() == pytest.approx(270)
+    assert window.speed() == pytest.approx(2 / 3)
+
+def test_rain_is_summed_from_the_daily_total_across_midnight():
+    aggregates = RollingAggregates()
+    for now, total in enumerate([1.0, 1.4, 2.0, 0.2]):
+        derived = aggregates.add({"dailyRainMm": total}, now=now)
+    assert derived["rainMm1m"] == 1.2
@@ -0,0 +1,112 @@
+import json
+
+import pytest
+
+# FastAPI's test client needs httpx, which the app itself does not
+pytest.importorskip("httpx")
+from fastapi.testclient import TestClient
+
+import run
+from stations import Station, StationRegistry
+
+def live_snapshot(temperature, error=None):
+    return {
+        "liveData": {"liveDataTimestamp": "2026-09-01T12:00:00", "outsideTempC": temperature},
+        "hiLowData": None,
+        "consoleInfo": None,
+        "derived": None,
+        "sectionUpdated": {"liveData": "2026-09-01T12:00:00"},
+        "error": error,
+    }
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    """A client for the app serving two stations that are not polled (the lifespan is not run)."""
+    monkeypatch.chdir(tmp_path)
+    stations = StationRegistry([Station("roof", "/dev/ttyS90", primary=True), Station("field", "/dev/ttyS91")])
+    monkeypatch.setattr(run, "stations", stations)
+    monkeypatch.setattr(run, "primary_station", stations.primary)
+    monkeypatch.setattr(run, "sample_store", stations.primary.store)
+    for index, station in enumerate(stations):
+        station.update(live_snapshot(20.0 + index))
+    yield TestClient(run.app), stations
+    stations.close()
+
+@pytest.mark.parametrize("path", ["/data", "/stations/roof/data"])
+def test_conditional_get(api, path):
+    client, stations = api
+    first = client.get(path)
+    assert first.status_code == 200
+    assert first.json()["liveData"]["outsideTempC"] == 20.0
+    etag = first.headers["etag"]
+    assert etag.startswith('"') and first.headers["last-modified"].endswith(" GMT")
+    assert first.headers["cache-control"] == "no-cache"
+
+    for if_none_match in [etag, "W/" + etag, "*", f'"stale", {etag}', f'"stale",W/{etag}']:
+        cached = client.get(path, headers={"If-None-Match": if_none_match})
+        assert cached.status_code == 304, if_none_match
+        assert cached.content == b""
+        assert cached.headers["etag"] == etag
+        assert cached.headers["last-modified"] == first.headers["last-modified"]
+    assert client.get(path, headers={"If-None-Match": '"stale"'}).status_code == 200
+
+    # A new sample changes the body and so the ETag
+    stations.primary.update(live_snapshot(21.5))
+    updated = client.get(path, headers={"If-None-Match": etag})
+    assert updated.status_code == 200
+    assert updated.json()["liveData"]["outsideTempC"] == 21.5
+    assert updated.headers["etag"] != etag
+    assert client.get(path, headers={"If-None-Match": updated.headers["etag"]}).status_code == 304
+
+def test_selections_have_their_own_etag(api):
+    client, _ = api
+    full = client.get("/data")
+    selected = client.get("/data", params={"fields": "outsideTempC"})
+    assert selected.json() == {"liveData": {"outsideTempC": 20.0}, "error": None}
+    assert selected.headers["etag"] != full.headers["etag"]
+    assert client.get("/data", params={"fields": "outsideTempC"},
+                      headers={"If-None-Match": selected.headers["etag"]}).status_code == 304
+    assert client.get("/data", headers={"If-None-Match": selected.headers["etag"]}).status_code == 200
+
+def test_stations_are_listed_in_config_order(api):
+    client, stations = api
+    stations.get("field").update(live_snapshot(None, error="Serial link down."))
+    listed = client.get("/stations").json()
+    assert [station["id"] for station in listed] == ["roof", "field"]
+    assert [station["primary"] for station in listed] == [True, False]
+    assert listed[0]["port"] == "/dev/ttyS90"
+    assert listed[0]["error"] is None and listed[1]["error"] == "Serial link down."
+
+def test_unknown_station_is_not_found(api):
+    client, _ = api
+    response = client.get("/stations/attic/data")
+    assert response.status_code == 404
+    assert "attic" in response.json()["detail"]
+
+def test_all_stations_data_embeds_each_station_body(api):
+    client, stations = api
+    response = client.get("/stations/data")
+    assert response.status_code == 200
+    body = response.json()
+    assert list(body) == ["roof", "field"]
+    # Each station's own cached bytes, unchanged
+    for station in stations:
+        assert body[station.id] == json.loads(station.cache.encoded().body)
+    etag = response.headers["etag"]
+    assert client.get("/stations/data", headers={"If-None-Match": etag}).status_code == 304
+
+    selected = client.get("/stations/data", params={"fields": "outsideTempC"}).json()
+    assert selected["field"] == {"liveData": {"outsideTempC": 21.0}, "error": None}
+
+    # Any one station's update changes the combined ETag
+    stations.get("field").update(live_snapshot(22.0))
+    assert client.get("/stations/data", headers={"If-None-Match": etag}).status_code == 200
+
+def test_failing_station_does_not_affect_the_others(api):
+    client, stations = api
+    stations.get("field").update(live_snapshot(None, error="Failed to wake up console."))
+    roof = client.get("/stations/roof/data").json()
+    assert roof["liveData"]["outsideTempC"] == 20.0 and roof["error"] is None
+    body = client.get("/stations/data").json()
+    assert body["roof"] == roof
+    assert body["field"]["error"] == "Failed to wake up console."
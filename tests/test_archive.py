@@ -0,0 +1,108 @@
+import asyncio
+from datetime import datetime
+
+from archive import (
+    ARCHIVE_PAGE_SIZE, MAX_PAGE_RETRIES, NAK, RECORDS_PER_PAGE, decode_archive_page, download_archive,
+    read_archive_page
+)
+from metrics import CRC_ERRORS
+from simulator import ARCHIVE_RECORDS, ConsoleState, SyntheticTrace
+from transport import DavisProtocol
+from weather_station import StationSession
+
+def test_decode_archive_page():
+    state = ConsoleState(SyntheticTrace(1))
+    pages, first_index = state.archive_pages(None)
+    assert first_index == 0
+    stamps = [stamp for stamp, _ in state.archive]
+
+    records = decode_archive_page(pages[0])
+    assert [record["timestamp"] for record in records] == [stamp.isoformat() for stamp in stamps[:RECORDS_PER_PAGE]]
+    assert "dateStamp" not in records[0] and isinstance(records[0]["outsideTempC"], float)
+    # Records before first_index and those not newer than after are skipped
+    assert len(decode_archive_page(pages[0], first_index=2)) == RECORDS_PER_PAGE - 2
+    assert len(decode_archive_page(pages[0], after=stamps[3])) == 1
+    # The unused slots of the last page hold no timestamp
+    assert len(decode_archive_page(pages[-1])) == ARCHIVE_RECORDS - RECORDS_PER_PAGE * (len(pages) - 1)
+
+def test_decode_archive_pages_in_one_buffer():
+    state = ConsoleState(SyntheticTrace(1))
+    pages, _ = state.archive_pages(None)
+    stamps = [stamp.isoformat() for stamp, _ in state.archive]
+    buffer = bytearray(b"".join(pages[:3]))
+    assert [record["timestamp"] for record in decode_archive_page(buffer, first_index=1)] == stamps[1:3 * RECORDS_PER_PAGE]
+    # A page failing its CRC is skipped, the others are still decoded
+    buffer[ARCHIVE_PAGE_SIZE + 10] ^= 0xFF
+    records = decode_archive_page(buffer)
+    assert [record["timestamp"] for record in records] == stamps[:RECORDS_PER_PAGE] + stamps[2 * RECORDS_PER_PAGE:3 * RECORDS_PER_PAGE]
+
+def download(port, since=None):
+    """Runs download_archive over a fresh session; returns its result and the records handed over."""
+    records = []
+
+    async def run():
+        session = StationSession(port)
+        try:
+            return await download_archive(session, records.extend, since=since)
+        finally:
+            session.close()
+
+    return asyncio.run(run()), records
+
+def test_download_resumes_after_since(console):
+    _, port = console
+    count, records = download(port)
+    assert count == len(records) == ARCHIVE_RECORDS
+    times = [datetime.fromisoformat(record["timestamp"]) for record in records]
+    assert times == sorted(times)
+
+    count, resumed = download(port, since=times[9])
+    assert count == ARCHIVE_RECORDS - 10
+    assert resumed == records[10:]
+    assert download(port, since=times[-1]) == (0, [])
+
+def test_corrupt_pages_are_requested_again(console):
+    simulator, port = console
+    simulator.faults.update("crc=0.1")
+    errors = CRC_ERRORS.labels("archive").value
+    count, records = download(port)
+    assert count == len(records) == ARCHIVE_RECORDS
+    assert CRC_ERRORS.labels("archive").value > errors
+
+def test_download_gives_up_on_a_page_that_never_arrives_intact(console):
+    simulator, port = console
+    simulator.faults.update("crc=1")
+    errors = CRC_ERRORS.labels("archive").value
+    assert download(port) == (None, [])
+    assert CRC_ERRORS.labels("archive").value - errors == MAX_PAGE_RETRIES
+    # The console was released with ESC, so the next download works
+    simulator.faults.update("reset")
+    assert download(port)[0] == ARCHIVE_RECORDS
+
+class CorruptPageTransport:
+    """Records what is written and answers every NAK with another corrupt page."""
+
+    def __init__(self, protocol):
+        self.protocol = protocol
+        self.written = []
+
+    def is_closing(self):
+        return False
+
+    def write(self, data):
+        self.written.append(data)
+        if data == NAK:
+            asyncio.get_running_loop().call_soon(self.protocol.data_received, bytes(ARCHIVE_PAGE_SIZE - 1) + b'\x01')
+
+def test_last_corrupt_page_is_not_naked():
+    async def read_corrupt_page():
+        ser = DavisProtocol(timeout=0.2)
+        transport = CorruptPageTransport(ser)
+        ser.connection_made(transport)
+        ser.data_received(bytes(ARCHIVE_PAGE_SIZE - 1) + b'\x01')
+        return await read_archive_page(ser), transport.written
+
+    page, written = asyncio.run(read_corrupt_page())
+    assert page is None
+    # The caller cancels with ESC after the last bad copy instead
+    assert written == [NAK] * (MAX_PAGE_RETRIES - 1)
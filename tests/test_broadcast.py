@@ -0,0 +1,90 @@
+import asyncio
+import json
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import broadcast
+from broadcast import MAX_CONSECUTIVE_DROPS, SUBSCRIBER_QUEUE_SIZE, Broadcaster
+
+def sample(index):
+    return {"liveDataTimestamp": f"2026-09-01T12:00:{index:02d}", "outsideTempC": 20.0 + index, "windSpeedMs": 3.0}
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A clock for the broadcaster only, advanced by hand."""
+    now = SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(broadcast, "time", SimpleNamespace(monotonic=lambda: now.value))
+    return now
+
+def drain(subscription):
+    messages = []
+    while not subscription.queue.empty():
+        messages.append(subscription.queue.get_nowait())
+    return messages
+
+def test_slow_subscriber_only_drops_its_own_old_messages(clock):
+    broadcaster = Broadcaster()
+    slow, fast = broadcaster.subscribe(), broadcaster.subscribe()
+    received = []
+    count = SUBSCRIBER_QUEUE_SIZE + 4
+    for index in range(count):
+        # Delivery never waits for a reader
+        broadcaster._deliver(sample(index))
+        received += drain(fast)
+    assert [json.loads(message)["outsideTempC"] for message in received] == [20.0 + i for i in range(count)]
+    kept = [json.loads(message)["outsideTempC"] for message in drain(slow)]
+    assert kept == [20.0 + i for i in range(4, count)]
+    assert not slow.closed
+
+def test_subscriber_that_never_catches_up_is_closed(clock):
+    broadcaster = Broadcaster()
+    stuck = broadcaster.subscribe()
+    for index in range(SUBSCRIBER_QUEUE_SIZE + MAX_CONSECUTIVE_DROPS):
+        broadcaster._deliver(sample(index % 60))
+    assert stuck.closed
+    # The stream ends with None, and the next sample forgets the subscriber
+    assert drain(stuck)[-1] is None
+    broadcaster._deliver(sample(0))
+    assert stuck not in broadcaster.subscribers
+
+def test_min_interval_skips_samples_in_between(clock):
+    broadcaster = Broadcaster()
+    every, slow = broadcaster.subscribe(), broadcaster.subscribe(min_interval=5)
+    for index in range(11):
+        broadcaster._deliver(sample(index))
+        clock.value += 1
+    assert len(drain(every)) == 11
+    assert [json.loads(message)["outsideTempC"] for message in drain(slow)] == [20.0, 25.0, 30.0]
+
+def test_fields_are_filtered_and_encoded_once_per_subset(clock):
+    broadcaster = Broadcaster()
+    first = broadcaster.subscribe(["outsideTempC", "windGustMs"])
+    second = broadcaster.subscribe(["outsideTempC", "windGustMs"])
+    everything = broadcaster.subscribe()
+    broadcaster._deliver(sample(1), derived={"windGustMs": 7.5})
+    (a,), (b,), (full,) = drain(first), drain(second), drain(everything)
+    # One string is shared by every subscriber asking for the same fields
+    assert a is b
+    assert json.loads(a) == {"liveDataTimestamp": "2026-09-01T12:00:01", "outsideTempC": 21.0, "windGustMs": 7.5}
+    assert json.loads(full) == {**sample(1), "derived": {"windGustMs": 7.5}}
+
+def test_unsubscribed_clients_get_nothing(clock):
+    broadcaster = Broadcaster()
+    subscription = broadcaster.subscribe()
+    broadcaster.unsubscribe(subscription)
+    broadcaster._deliver(sample(1))
+    assert drain(subscription) == []
+
+def test_publish_from_another_thread_is_delivered_on_the_loop():
+    async def publish_from_thread():
+        broadcaster = Broadcaster()
+        broadcaster.bind(asyncio.get_running_loop())
+        subscription = broadcaster.subscribe(["outsideTempC"])
+        thread = threading.Thread(target=broadcaster.publish, args=(sample(2),))
+        thread.start()
+        thread.join()
+        return await subscription.get(timeout=1)
+
+    assert json.loads(asyncio.run(publish_from_thread()))["outsideTempC"] == 22.0
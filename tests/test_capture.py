@@ -0,0 +1,82 @@
+import math
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+import capture
+from capture import RECORD_SIZE, CaptureLog, CaptureReader, capture_path
+from crc import crc16
+from packets import LOOP_LAYOUT, LOOP2_LAYOUT
+from simulator import ConsoleState, SyntheticTrace
+
+START = datetime(2026, 9, 1, 23, 50)
+
+def captured_packets(directory, count=40):
+    """Writes count alternating LOOP/LOOP2 packets 30 s apart (across midnight); every 7th is corrupt."""
+    state = ConsoleState(SyntheticTrace(1))
+    log = CaptureLog(directory)
+    written = []
+    for i in range(count):
+        when = START + timedelta(seconds=30 * i)
+        state.update(when)
+        packet = state.loop2_packet() if i % 2 else state.loop_packet()
+        if i % 7 == 3:
+            packet = packet[:-1] + bytes([packet[-1] ^ 0xFF])
+        log.append(packet, when.timestamp())
+        written.append((when, packet))
+    log.close()
+    return written
+
+@pytest.fixture
+def packets(tmp_path):
+    return captured_packets(str(tmp_path)), CaptureReader(str(tmp_path))
+
+def test_records_decode_like_the_live_parsers(packets):
+    written, reader = packets
+    intact = [(when, packet) for when, packet in written if crc16(packet, 0) == 0]
+    records = list(reader.records())
+    assert len(reader.files()) == 2
+    assert [when for when, _, _ in records] == [when for when, _ in intact]
+    for (_, kind, data), (_, packet) in zip(records, intact):
+        assert kind == packet[4]
+        assert data == (LOOP2_LAYOUT if kind else LOOP_LAYOUT).decode(packet)
+
+    assert len(list(reader.records(verify=False))) == len(written)
+    window = list(reader.records(START + timedelta(minutes=5), START + timedelta(minutes=15), packet_type=1))
+    assert window and all(kind == 1 and START + timedelta(minutes=5) <= when <= START + timedelta(minutes=15)
+                          for when, kind, _ in window)
+
+def test_torn_record_is_cut_off_when_reopened(tmp_path):
+    written = captured_packets(str(tmp_path), count=2)
+    path = capture_path(str(tmp_path), START.date())
+    with open(path, "ab") as f:
+        f.write(b"\x01" * 50)
+    log = CaptureLog(str(tmp_path))
+    log.append(written[0][1], (START + timedelta(minutes=1)).timestamp())
+    log.close()
+    assert os.path.getsize(path) % RECORD_SIZE == 0
+    assert len(list(CaptureReader(str(tmp_path)).records())) == 3
+
+@pytest.mark.parametrize("packet_type", [0, 1])
+def test_numpy_and_python_columns_agree(packets, monkeypatch, packet_type):
+    pytest.importorskip("numpy")
+    _, reader = packets
+    vectorized = reader.columns(packet_type)
+    monkeypatch.setattr(capture, "numpy", None)
+    plain = reader.columns(packet_type)
+
+    # datetime64 in UTC against local datetimes: compared as microseconds since the epoch
+    assert vectorized["time"].astype("int64").tolist() == [round(when.timestamp() * 1e6) for when in plain["time"]]
+    for name, values in plain.items():
+        if name == "time":
+            continue
+        converted = [None if isinstance(value, float) and math.isnan(value) else value
+                     for value in vectorized[name].tolist()]
+        assert converted == pytest.approx(values), name
+
+def test_vectorized_crc_check_matches_crc16(packets):
+    numpy = pytest.importorskip("numpy")
+    written, _ = packets
+    rows = numpy.frombuffer(b"".join(packet for _, packet in written), dtype=numpy.uint8).reshape(len(written), 99)
+    assert capture._crc_ok(rows).tolist() == [crc16(packet, 0) == 0 for _, packet in written]
@@ -0,0 +1,21 @@
+from crc import Crc16, check_packet, crc16, validate_many
+
+def framed(payload):
+    return payload + crc16(payload, 0).to_bytes(2, 'big')
+
+def test_incremental_crc_matches_one_call():
+    packet = framed(bytes(range(97)))
+    crc = Crc16()
+    for start in range(0, len(packet), 10):
+        crc.update(packet[start:start + 10])
+    assert crc.valid and check_packet(packet)
+    crc.reset()
+    assert not crc.update(packet[:-1]).valid
+
+def test_validate_many_checks_strided_frames_in_place():
+    frames = [framed(bytes([i]) * 5) for i in range(4)]
+    frames[2] = frames[2][:-1] + b'\x00'
+    assert validate_many(b"".join(frames), 7) == [True, True, False, True]
+    # Frames at an offset inside larger records, ignoring a trailing partial record
+    records = bytearray(b"".join(b"hdr" + frame + b"pad" for frame in frames) + b"hdr")
+    assert validate_many(records, 7, stride=13, offset=3) == [True, True, False, True]
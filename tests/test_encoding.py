@@ -0,0 +1,84 @@
+import json
+from datetime import datetime
+from itertools import combinations, islice
+
+from encoding import DOCUMENT_FORMATS, MAX_CACHED_SELECTIONS, EncodedSnapshot, LazySnapshot
+from packets import HILOWS_LAYOUT
+from scheduler import resolve_fields
+from simulator import ConsoleState, SyntheticTrace
+from weather_station import parse_hilows_packet, parse_loop_packet
+
+MODIFIED = 1_790_000_000
+
+def snapshot_value():
+    """A snapshot as the scheduler builds it, with HILOWS left as a lazy record."""
+    state = ConsoleState(SyntheticTrace(2))
+    state.update(datetime(2026, 9, 1, 14))
+    return {
+        "liveData": parse_loop_packet(state.loop_packet()),
+        "hiLowData": parse_hilows_packet(state.hilows_packet(), lazy=True),
+        "consoleInfo": None,
+        "derived": None,
+        "error": None,
+    }
+
+def test_selection_is_encoded_once_and_skips_other_sections():
+    value = snapshot_value()
+    snapshot = LazySnapshot(value, modified=MODIFIED)
+    selection = resolve_fields(["outsideTempC", "windDirectionText"])
+    encoded = snapshot.encoded(selection)
+    assert json.loads(encoded.body) == {
+        "liveData": {"outsideTempC": value["liveData"]["outsideTempC"],
+                     "windDirectionText": value["liveData"]["windDirectionText"]},
+        "error": None,
+    }
+    # The same bytes are served again, and HILOWS was never decoded
+    assert snapshot.encoded(selection) is encoded
+    assert value["hiLowData"].values == {}
+
+    hilows = snapshot.encoded(resolve_fields(["outTempDayHighC"]))
+    assert json.loads(hilows.body)["hiLowData"]["outTempDayHighC"] == value["hiLowData"]["outTempDayHighC"]
+    assert list(value["hiLowData"].values) == ["outTempDayHighC"]
+
+def test_every_selection_and_format_has_its_own_stable_etag():
+    selections = [None, resolve_fields(["outsideTempC"]), resolve_fields(["outsideTempC", "barometerHpa"])]
+    value = snapshot_value()
+    first, again = LazySnapshot(value, modified=MODIFIED), LazySnapshot(value, modified=MODIFIED)
+    tags = {}
+    for selection in selections:
+        for format in DOCUMENT_FORMATS:
+            encoded = first.encoded(selection, format)
+            assert encoded.media_type.startswith("application/")
+            # Encoding the same document again gives the same ETag
+            assert again.encoded(selection, format).etag == encoded.etag
+            tags[selection, format] = encoded.etag
+    assert len(set(tags.values())) == len(tags)
+    assert first.encoded().last_modified == "Mon, 21 Sep 2026 14:13:20 GMT"
+
+def test_full_document_decodes_lazy_sections():
+    value = snapshot_value()
+    body = json.loads(LazySnapshot(value).encoded().body)
+    assert body["hiLowData"] == HILOWS_LAYOUT.decode(value["hiLowData"].packet)
+    assert list(body["hiLowData"]) == HILOWS_LAYOUT.names
+
+def test_rare_selections_are_not_cached_past_the_limit():
+    snapshot = LazySnapshot(snapshot_value())
+    pairs = combinations(snapshot.value["liveData"], 2)
+    selections = [resolve_fields(pair) for pair in islice(pairs, MAX_CACHED_SELECTIONS + 2)]
+    for selection in selections:
+        snapshot.encoded(selection)
+    assert len(snapshot.selections) == MAX_CACHED_SELECTIONS
+    # Still answered, just encoded per request
+    assert snapshot.encoded(selections[-1]) is not snapshot.encoded(selections[-1])
+
+def test_combined_snapshot_reuses_each_body():
+    older = LazySnapshot({"liveData": {"outsideTempC": 20.0}, "error": None}, modified=MODIFIED).encoded()
+    newer = LazySnapshot({"liveData": None, "error": "Serial link down."}, modified=MODIFIED + 60).encoded()
+    combined = EncodedSnapshot.combine({"roof": older, "field": newer})
+    assert combined.body == b'{"roof":' + older.body + b',"field":' + newer.body + b"}"
+    assert json.loads(combined.body)["field"]["error"] == "Serial link down."
+    assert combined.last_modified == newer.last_modified
+    # The ETag follows every part's ETag, and the key order
+    assert combined.etag == EncodedSnapshot.combine({"roof": older, "field": newer}).etag
+    assert combined.etag != EncodedSnapshot.combine({"roof": older, "field": older}).etag
+    assert combined.matches("W/" + combined.etag)
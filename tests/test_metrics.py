@@ -0,0 +1,77 @@
+import pytest
+
+import metrics
+from metrics import HTTP_REQUESTS, HTTP_SECONDS, Counter, Gauge, Histogram, MetricsMiddleware, render_prometheus
+
+@pytest.fixture
+def registry(monkeypatch):
+    """An empty registry, so only the metrics made by the test are rendered."""
+    monkeypatch.setattr(metrics, "REGISTRY", [])
+    return metrics.REGISTRY
+
+def test_counters_and_gauges_escape_label_values(registry):
+    errors = Counter("test_errors_total", "Errors seen.", ["packet"])
+    errors.labels('LOOP "2"').inc()
+    errors.labels("back\\slash\nnewline").inc(3)
+    Gauge("test_age_seconds", "Age.").set(1.5)
+    assert render_prometheus() == (
+        "# HELP test_errors_total Errors seen.\n"
+        "# TYPE test_errors_total counter\n"
+        'test_errors_total{packet="LOOP \\"2\\""} 1\n'
+        'test_errors_total{packet="back\\\\slash\\nnewline"} 3\n'
+        "# HELP test_age_seconds Age.\n"
+        "# TYPE test_age_seconds gauge\n"
+        "test_age_seconds 1.5\n"
+    )
+
+def test_histogram_buckets_are_cumulative_and_end_with_inf(registry):
+    latency = Histogram("test_seconds", "Latency.", ["command"], buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        latency.labels("LOOP").observe(value)
+    assert render_prometheus().splitlines()[2:] == [
+        'test_seconds_bucket{command="LOOP",le="0.1"} 2',
+        'test_seconds_bucket{command="LOOP",le="1.0"} 3',
+        'test_seconds_bucket{command="LOOP",le="+Inf"} 4',
+        'test_seconds_sum{command="LOOP"} 2.65',
+        'test_seconds_count{command="LOOP"} 4',
+    ]
+
+def test_unlabelled_metrics_render_before_first_use_and_prefixes_filter(registry):
+    Counter("test_reconnects_total", "Reconnects.")
+    Histogram("other_seconds", "Other.", buckets=(1.0,))
+    assert render_prometheus(["test_"]).splitlines() == [
+        "# HELP test_reconnects_total Reconnects.",
+        "# TYPE test_reconnects_total counter",
+        "test_reconnects_total 0",
+    ]
+    assert "other_seconds_bucket{le=\"+Inf\"} 0" in render_prometheus(["other_"])
+
+def test_middleware_labels_requests_by_route_template():
+    pytest.importorskip("httpx")
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get("/test/items/{item_id}")
+    async def get_item(item_id: int):
+        return {"id": item_id}
+
+    def requests(endpoint, status):
+        return HTTP_REQUESTS.labels(endpoint, status).value
+
+    before = (requests("/test/items/{item_id}", 200), requests("/test/items/{item_id}", 422),
+              requests("unmatched", 404))
+    timed = HTTP_SECONDS.labels("/test/items/{item_id}").counts[:]
+    client = TestClient(app)
+    assert client.get("/test/items/1").status_code == 200
+    assert client.get("/test/items/2").status_code == 200
+    assert client.get("/test/items/x").status_code == 422
+    assert client.get("/test/nothing/here").status_code == 404
+    after = (requests("/test/items/{item_id}", 200), requests("/test/items/{item_id}", 422),
+             requests("unmatched", 404))
+    # Path parameters never become label values
+    assert [b - a for a, b in zip(before, after)] == [2, 1, 1]
+    assert sum(HTTP_SECONDS.labels("/test/items/{item_id}").counts) - sum(timed) == 3
+    assert not any("/test/items/1" in values for values in HTTP_REQUESTS.children)
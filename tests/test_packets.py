@@ -0,0 +1,147 @@
+import struct
+from datetime import datetime, timedelta
+
+import pytest
+
+from bench import CORPUS_PATH, load_corpus
+from packets import (
+    HILOWS_LAYOUT, LOOP_LAYOUT, LOOP2_LAYOUT, f_to_c, inhg_to_hpa, mph_to_ms, parse_time, round_safe, wind_deg_to_text
+)
+from simulator import ConsoleState, SyntheticTrace
+from weather_station import parse_hilows_packet, parse_loop2_packet, parse_loop_packet
+
+# Reference decoders transcribing the field-by-field parsers the layouts
+# replaced, so the compiled decoders are checked against an independent copy
+
+def rain(clicks):
+    return round_safe((clicks * 0.01) * 25.4)
+
+def reference_loop(packet):
+    u = lambda fmt, offset: struct.unpack_from(fmt, packet, offset)[0]
+    barometer, inside, outside = u('<H', 7), u('<h', 9), u('<h', 12)
+    return {
+        'barometerHpa': round_safe(inhg_to_hpa(barometer / 1000.0 if barometer != 0 else None)),
+        'insideTempC': round_safe(f_to_c(inside / 10.0 if inside != 32767 else None)),
+        'insideHumidityPercent': u('B', 11) if u('B', 11) != 255 else None,
+        'outsideTempC': round_safe(f_to_c(outside / 10.0 if outside != 32767 else None)),
+        'windSpeedMs': round_safe(mph_to_ms(u('B', 14))),
+        'avgWind10minMs': round_safe(mph_to_ms(u('B', 15))),
+        'windDirectionDeg': u('<H', 16),
+        'windDirectionText': wind_deg_to_text(u('<H', 16)),
+        'outsideHumidityPercent': u('B', 33) if u('B', 33) != 255 else None,
+        'rainRateMmHr': rain(u('<H', 41)),
+        'dailyRainMm': rain(u('<H', 50)),
+        'stormRainMm': rain(u('<H', 46)),
+        'monthlyRainMm': rain(u('<H', 52)),
+        'yearlyRainMm': rain(u('<H', 54)),
+        'consoleBatteryV': round_safe(((u('<H', 87) * 300) / 512) / 100.0),
+        'sunrise': f"{u('<H', 91) // 100:02d}:{u('<H', 91) % 100:02d}",
+        'sunset': f"{u('<H', 93) // 100:02d}:{u('<H', 93) % 100:02d}",
+    }
+
+def reference_loop2(packet):
+    u = lambda fmt, offset: struct.unpack_from(fmt, packet, offset)[0]
+    wind = lambda offset: round_safe(mph_to_ms(u('<H', offset) / 10.0 if u('<H', offset) != 32767 else None))
+    temp = lambda offset: round_safe(f_to_c(u('<h', offset) if u('<h', offset) != 32767 else None))
+    return {
+        'avgWind10minMsHires': wind(18),
+        'avgWind2minMs': wind(20),
+        'windGust10minMs': wind(22),
+        'windGust10minDirDeg': u('<H', 24),
+        'dewpointC': temp(30),
+        'heatIndexC': temp(35),
+        'windChillC': temp(37),
+        'thswIndexC': temp(39),
+        'last15minRainMm': rain(u('<H', 52)),
+        'lastHourRainMm': rain(u('<H', 54)),
+        'last24hrRainMm': rain(u('<H', 58)),
+    }
+
+def reference_hilows(packet):
+    u = lambda fmt, offset: struct.unpack_from(fmt, packet, offset)[0]
+    time = lambda offset: parse_time(u('<H', offset))
+    return {
+        'baroDayLowHpa': round_safe(inhg_to_hpa(u('<H', 0) / 1000.0)),
+        'baroDayHighHpa': round_safe(inhg_to_hpa(u('<H', 2) / 1000.0)),
+        'baroDayLowTime': time(12),
+        'baroDayHighTime': time(14),
+        'windDayHighMs': round_safe(mph_to_ms(u('B', 16))),
+        'windDayHighTime': time(17),
+        'windMonthHighMs': round_safe(mph_to_ms(u('B', 19))),
+        'windYearHighMs': round_safe(mph_to_ms(u('B', 20))),
+        'inTempDayHighC': round_safe(f_to_c(u('<h', 21) / 10.0)),
+        'inTempDayLowC': round_safe(f_to_c(u('<h', 23) / 10.0)),
+        'inTempDayHighTime': time(25),
+        'inTempDayLowTime': time(27),
+        'outTempDayLowC': round_safe(f_to_c(u('<h', 47) / 10.0)),
+        'outTempDayHighC': round_safe(f_to_c(u('<h', 49) / 10.0)),
+        'outTempDayLowTime': time(51),
+        'outTempDayHighTime': time(53),
+        'windChillDayLowC': round_safe(f_to_c(u('<h', 79))),
+        'windChillDayLowTime': time(81),
+        'windChillMonthLowC': round_safe(f_to_c(u('<h', 83))),
+        'windChillYearLowC': round_safe(f_to_c(u('<h', 85))),
+        'heatIndexDayHighC': round_safe(f_to_c(u('<h', 87))),
+        'heatIndexDayHighTime': time(89),
+        'heatIndexMonthHighC': round_safe(f_to_c(u('<h', 91))),
+        'heatIndexYearHighC': round_safe(f_to_c(u('<h', 93))),
+        'rainRateDayHighMmHr': rain(u('<H', 116)),
+        'rainRateDayHighTime': time(118),
+        'rainRateHourHighMmHr': rain(u('<H', 120)),
+    }
+
+PARSERS = {
+    "loop": (parse_loop_packet, reference_loop),
+    "loop2": (parse_loop2_packet, reference_loop2),
+    "hilows": (parse_hilows_packet, reference_hilows),
+}
+
+def simulated_packets():
+    """Packets of every kind from a simulated day, sampled every 20 minutes."""
+    state = ConsoleState(SyntheticTrace(3))
+    packets = {kind: [] for kind in PARSERS}
+    start = datetime(2026, 9, 1)
+    for step in range(72):
+        state.update(start + timedelta(minutes=20 * step))
+        packets["loop"].append(state.loop_packet())
+        packets["loop2"].append(state.loop2_packet())
+        packets["hilows"].append(state.hilows_packet())
+    return packets
+
+def recorded_packets():
+    """The intact packets of the benchmark corpus, including its "no sensor" cases."""
+    corpus = load_corpus(CORPUS_PATH)
+    return {kind: corpus.get((kind, "valid"), []) + corpus.get((kind, "sentinel"), []) for kind in PARSERS}
+
+@pytest.mark.parametrize("packets", [simulated_packets(), recorded_packets()], ids=["simulated", "recorded"])
+@pytest.mark.parametrize("kind", list(PARSERS))
+def test_layouts_decode_like_the_old_parsers(packets, kind):
+    parse, reference = PARSERS[kind]
+    assert packets[kind]
+    for packet in packets[kind]:
+        decoded, expected = parse(packet), reference(packet)
+        assert {name: decoded[name] for name in expected} == expected
+        # Fields added since keep the old fields' order, so the JSON keeps its shape
+        assert [name for name in decoded if name in expected] == list(expected)
+
+@pytest.mark.parametrize("layout", [LOOP_LAYOUT, LOOP2_LAYOUT, HILOWS_LAYOUT], ids=lambda layout: layout.name)
+def test_lazy_fields_decode_like_the_whole_packet(layout):
+    kind = {"LOOP": "loop", "LOOP2": "loop2", "HILOWS": "hilows"}[layout.name]
+    for packet in simulated_packets()[kind][::12] + recorded_packets()[kind]:
+        decoded = layout.decode(packet)
+        lazy = layout.lazy(packet)
+        # Derived fields such as windDirectionText are decoded from their source on their own
+        assert {name: lazy[name] for name in reversed(list(lazy))} == decoded
+        assert list(lazy) == list(decoded) == layout.names
+        assert list(layout.lazy(packet).to_dict()) == list(decoded)
+    with pytest.raises(KeyError):
+        layout.lazy(packet)["noSuchField"]
+
+def test_helpers_are_still_importable_from_weather_station():
+    import crc
+    import packets
+    import weather_station
+    assert weather_station.CRC_TABLE is crc.CRC_TABLE
+    for name in ("f_to_c", "mph_to_ms", "inhg_to_hpa", "parse_time", "wind_deg_to_text", "round_safe"):
+        assert getattr(weather_station, name) is getattr(packets, name)
+    assert weather_station.f_to_c(212) == 100.0
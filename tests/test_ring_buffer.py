@@ -0,0 +1,53 @@
+import random
+from datetime import datetime, timezone
+from functools import lru_cache
+
+import pytest
+
+import ring_buffer
+from ring_buffer import SampleRing
+
+FIELDS = ["outsideTempC", "windSpeedMs", "barometerHpa"]
+
+@lru_cache
+def filled_ring(interval, count, start=1_700_000_001.0):
+    """A ring of count samples, interval seconds apart, with some values missing; shared between tests."""
+    ring = SampleRing(fields=FIELDS)
+    rng = random.Random(1)
+    for i in range(count):
+        timestamp = datetime.fromtimestamp(start + interval * i, timezone.utc).isoformat()
+        sample = {"liveDataTimestamp": timestamp}
+        for name in FIELDS:
+            sample[name] = None if rng.random() < 0.1 else round(rng.uniform(0, 100), 1)
+        ring.append(sample)
+    return ring, start + interval * (count - 1)
+
+def assert_same_buckets(expected, actual):
+    # NumPy and Python may round a tie to 3 decimals in opposite directions
+    assert actual["time"] == expected["time"]
+    for name in FIELDS:
+        for part in ("min", "max", "mean"):
+            assert [value is None for value in actual["fields"][name][part]] == \
+                [value is None for value in expected["fields"][name][part]]
+            assert [value for value in actual["fields"][name][part] if value is not None] == pytest.approx(
+                [value for value in expected["fields"][name][part] if value is not None], abs=2e-3)
+
+# 2.5 s samples reach back further than a 24 h window, 2 s samples just
+# cover it; offsets of 1 s start the window mid-minute
+@pytest.mark.parametrize("interval,count", [(2.5, 40000), (2, 50000), (7, 300)])
+@pytest.mark.parametrize("window,step,offset", [
+    (86400, 60, 1), (86400, 60, 45), (86400, 300, 1), (3600, 60, 1), (3600, 10, 7), (600, 7, 3),
+])
+def test_numpy_and_python_paths_return_the_same_buckets(monkeypatch, interval, count, window, step, offset):
+    pytest.importorskip("numpy")
+    ring, last = filled_ring(interval, count)
+    now = last + offset
+    vectorized = ring.query(window, step, now=now)
+    monkeypatch.setattr(ring_buffer, "np", None)
+    assert_same_buckets(vectorized, ring.query(window, step, now=now))
+
+def test_day_of_minutes_fits_the_minute_ring():
+    ring, last = filled_ring(2.5, 40000)
+    result = ring.query(86400, 60, now=last + 1)
+    assert len(result["time"]) == 86400 // 60 + 1
+    assert result["time"][0] == (last + 1 - 86400) // 60 * 60
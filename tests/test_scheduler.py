@@ -0,0 +1,98 @@
+import asyncio
+from datetime import date, timedelta
+
+from scheduler import TASK_RETRY_SECONDS, PollScheduler, PollTask, hilows_exceeded
+from weather_station import StationSession
+
+def task(**options):
+    return PollTask("test", fetch=None, **options)
+
+def test_interval_task_runs_again_once_its_interval_passed():
+    hilows = task(interval=60)
+    assert hilows.due(100, connection_id=1)
+    hilows.done(100, 1, ok=True)
+    assert not hilows.due(159, 1)
+    assert hilows.due(160, 1)
+    # A new connection does not make it due early
+    assert not hilows.due(120, 2)
+
+def test_triggered_task_is_throttled_by_min_interval():
+    hilows = task(interval=60, min_interval=10)
+    hilows.done(100, 1, ok=True)
+    hilows.triggered = True
+    assert not hilows.due(105, 1)
+    assert hilows.due(110, 1)
+    hilows.done(110, 1, ok=True)
+    # The trigger is used up; the interval applies again
+    assert not hilows.triggered
+    assert not hilows.due(125, 1)
+    assert hilows.due(170, 1)
+
+def test_once_per_connection_task_reruns_after_a_reconnect():
+    firmware = task(once_per_connection=True)
+    assert firmware.due(0, 1)
+    firmware.done(0, 1, ok=True)
+    assert not firmware.due(10_000, 1)
+    assert firmware.due(10, 2)
+
+def test_failed_task_waits_before_it_is_retried():
+    console_time = task(interval=3600, min_interval=10)
+    console_time.done(100, 1, ok=False)
+    assert console_time.last_run is None
+    assert not console_time.due(100 + TASK_RETRY_SECONDS - 1, 1)
+    # Not even a trigger overrides the retry delay
+    console_time.triggered = True
+    assert not console_time.due(100 + TASK_RETRY_SECONDS - 1, 2)
+    assert console_time.due(100 + TASK_RETRY_SECONDS, 1)
+
+def test_hilows_are_exceeded_when_a_live_value_passes_a_record():
+    records = {"outTempDayHighC": 25.0, "outTempDayLowC": 10.0, "windDayHighMs": 8.0}
+    assert not hilows_exceeded({"outsideTempC": 25.0, "windSpeedMs": 8.0}, records)
+    assert hilows_exceeded({"outsideTempC": 25.1}, records)
+    assert hilows_exceeded({"outsideTempC": 9.9}, records)
+    assert hilows_exceeded({"windSpeedMs": 8.5}, records)
+    # Missing values and records never trigger
+    assert not hilows_exceeded({"outsideTempC": None, "barometerHpa": 1020.0}, records)
+    assert not hilows_exceeded({"outsideTempC": 30.0}, None)
+
+def test_scheduler_refreshes_hilows_on_records_and_at_midnight(console):
+    _, port = console
+
+    async def poll():
+        session = StationSession(port)
+        updates = []
+        scheduler = PollScheduler(session, on_update=updates.append)
+        try:
+            await scheduler.poll_once()
+            first = dict(scheduler.updated)
+            hilows = scheduler.task("hiLowData")
+
+            # Within its interval HILOWS is left alone
+            await scheduler.poll_once()
+            assert scheduler.updated["hiLowData"] == first["hiLowData"]
+
+            # A live value above the day's high triggers it, once min_interval has passed.
+            # The simulated temperature may already have passed the fetched high, so
+            # any trigger from that is cleared first
+            hilows.triggered = False
+            scheduler.sections["hiLowData"] = {"outTempDayHighC": -100.0}
+            hilows.last_run -= hilows.min_interval
+            await scheduler.poll_once()
+            assert hilows.triggered
+            await scheduler.poll_once()
+            triggered = scheduler.updated["hiLowData"]
+
+            # So does the first poll after midnight
+            scheduler.hilows_day = date.today() - timedelta(days=1)
+            hilows.last_run -= hilows.min_interval
+            await scheduler.poll_once()
+            return first, triggered, scheduler.updated["hiLowData"], scheduler.hilows_day, updates
+        finally:
+            scheduler.close()
+
+    first, triggered, midnight, day, updates = asyncio.run(poll())
+    # Every section was fetched on the first poll, on the new connection
+    assert all(first[name] is not None for name in ("liveData", "hiLowData", "consoleTime", "firmware"))
+    assert first["hiLowData"] < triggered < midnight
+    assert day == date.today()
+    assert updates[-1]["liveData"] is not None and updates[-1]["error"] is None
@@ -0,0 +1,77 @@
+import pytest
+
+from encoding import EncodedSnapshot
+from shared_snapshot import HEADER, SEQUENCE, SnapshotReader, SnapshotWriter
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "snapshot.bin")
+
+def test_round_trip_and_unchanged_snapshot_is_reused(path):
+    writer, reader = SnapshotWriter(path, capacity=4096), SnapshotReader(path)
+    try:
+        assert reader.read() is None
+        published = EncodedSnapshot({"liveData": {"outsideTempC": 21.5}}, modified=0)
+        writer.publish(published)
+        snapshot = reader.read()
+        assert (snapshot.body, snapshot.etag, snapshot.last_modified) == \
+            (published.body, published.etag, published.last_modified)
+        assert reader.read() is snapshot
+
+        writer.write(b'{"liveData":null}', b'"b"', b"Thu, 01 Jan 1970 00:00:01 GMT")
+        assert reader.read().body == b'{"liveData":null}'
+    finally:
+        writer.close()
+        reader.close()
+
+def test_reader_keeps_previous_snapshot_during_a_write(path):
+    writer, reader = SnapshotWriter(path, capacity=4096), SnapshotReader(path)
+    try:
+        writer.write(b"first", b'"1"')
+        assert reader.read().body == b"first"
+        # A write in progress leaves the sequence number odd
+        SEQUENCE.pack_into(writer.map, 0, writer.sequence + 1)
+        assert reader.read().body == b"first"
+    finally:
+        writer.close()
+        reader.close()
+
+def test_restarted_writer_is_noticed(path):
+    writer, reader = SnapshotWriter(path, capacity=4096), SnapshotReader(path)
+    writer.write(b"before", b'"1"')
+    assert reader.read().body == b"before"
+    # Crashed mid-write: the odd sequence number is left in the file
+    SEQUENCE.pack_into(writer.map, 0, writer.sequence + 1)
+    writer.close()
+
+    writer = SnapshotWriter(path, capacity=8192)
+    try:
+        writer.write(b"after", b'"2"')
+        assert reader.read().body == b"after"
+        # The larger file is mapped again for a payload past the old end
+        writer.write(b"x" * 6000, b'"3"')
+        assert reader.read().body == b"x" * 6000
+    finally:
+        writer.close()
+        reader.close()
+
+def test_oversize_snapshot_is_rejected_and_previous_one_kept(path):
+    writer, reader = SnapshotWriter(path, capacity=64), SnapshotReader(path)
+    try:
+        writer.write(b"small", b'"1"')
+        with pytest.raises(ValueError, match="does not fit"):
+            writer.write(b"x" * 65)
+        assert reader.read().body == b"small"
+        assert SEQUENCE.unpack_from(writer.map)[0] % 2 == 0
+    finally:
+        writer.close()
+        reader.close()
+
+def test_unsized_file_reads_as_nothing_published(path):
+    open(path, "wb").close()
+    reader = SnapshotReader(path)
+    assert reader.read() is None
+    with open(path, "wb") as f:
+        f.write(b"\0" * HEADER.size)
+    assert reader.read() is None
+    reader.close()
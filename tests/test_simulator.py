@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+from simulator import Simulator
+
+@pytest.mark.skipif(sys.platform == "win32", reason="The simulator needs a pseudo-terminal.")
+def test_stop_closes_the_pseudo_terminal_and_joins_the_thread():
+    simulator = Simulator()
+    simulator.start()
+    thread, fds = simulator.thread, (simulator.master, simulator.slave)
+    simulator.stop()
+    assert not thread.is_alive()
+    for fd in fds:
+        with pytest.raises(OSError):
+            os.fstat(fd)
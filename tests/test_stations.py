@@ -0,0 +1,75 @@
+import asyncio
+import json
+from datetime import datetime
+
+import pytest
+
+from stations import Station, StationRegistry
+
+async def running_station(port):
+    station = Station("sim", port)
+    task = asyncio.create_task(station.run())
+    # Waits for the first sample
+    await station.fresh_cache(max_age=60)
+    return station, task
+
+async def stop_station(station, task):
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    station.close()
+
+def test_max_age_requests_share_one_sample(console, monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    _, port = console
+
+    async def concurrent_requests():
+        station, task = await running_station(port)
+        reads = []
+        request_sample = station.scheduler.request_sample
+        station.scheduler.request_sample = lambda: reads.append(request_sample())
+        try:
+            requested = datetime.now()
+            caches = await asyncio.gather(*[station.fresh_cache(max_age=0) for _ in range(20)])
+            return requested, caches, len(reads), station.sample_waiter
+        finally:
+            await stop_station(station, task)
+
+    requested, caches, reads, waiter = asyncio.run(concurrent_requests())
+    # One sample read was asked for, and every request was answered with it
+    assert reads == 1
+    assert len({id(cache) for cache in caches}) == 1
+    sample_time = datetime.fromisoformat(caches[0].value["liveData"]["liveDataTimestamp"])
+    assert sample_time >= requested
+    assert waiter is None
+
+def test_max_age_times_out_without_fresh_samples(console, monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    simulator, port = console
+
+    async def request_from_dead_link():
+        station, task = await running_station(port)
+        try:
+            simulator.faults.update("crc=1")
+            await asyncio.sleep(0.2)
+            with pytest.raises(asyncio.TimeoutError):
+                await station.fresh_cache(max_age=0, timeout=0.5)
+        finally:
+            await stop_station(station, task)
+
+    asyncio.run(request_from_dead_link())
+
+def test_registry_rejects_stations_sharing_a_port(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    config = {"stations": [{"id": "roof", "port": "/dev/ttyS90"}, {"id": "field", "port": "/dev/ttyS90"}]}
+    (tmp_path / "stations.json").write_text(json.dumps(config))
+    with pytest.raises(ValueError, match="share port '/dev/ttyS90'"):
+        StationRegistry.load("stations.json")
+
+    config["stations"][1]["port"] = "/dev/ttyS91"
+    (tmp_path / "stations.json").write_text(json.dumps(config))
+    stations = StationRegistry.load("stations.json")
+    try:
+        assert [station.id for station in stations] == ["roof", "field"]
+        assert stations.primary.id == "roof"
+    finally:
+        stations.close()
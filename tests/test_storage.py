@@ -0,0 +1,147 @@
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+
+from encoding import iter_csv
+from storage import SCHEMA_VERSION, SOURCE_FIELDS, SampleStore
+
+START = datetime(2026, 9, 1)
+
+def archive_record(time, temperature):
+    record = {name: 0 for name in SOURCE_FIELDS["archive"]}
+    record.update(timestamp=time.isoformat(), outsideTempC=temperature, rainfallMm=0.2, forecastRule=7)
+    return record
+
+@pytest.fixture
+def store(tmp_path):
+    store = SampleStore(str(tmp_path / "history.db"))
+    yield store
+    store.close()
+
+def test_raw_export_of_archive_only_range_keeps_archive_fields(store):
+    store.add_archive_records([archive_record(START + timedelta(minutes=5 * i), 10.0 + i) for i in range(12)])
+    rows = list(store.iter_history(START, START + timedelta(hours=1)))
+    header = rows[0]
+    assert header == ["time", "source"] + SOURCE_FIELDS["archive"]
+    assert len(rows) == 13
+    first = dict(zip(header, rows[1]))
+    assert first["source"] == "archive"
+    assert (first["outsideTempC"], first["rainfallMm"], first["forecastRule"]) == (10.0, 0.2, 7)
+
+    lines = b"".join(iter_csv(store.iter_history(START, START + timedelta(hours=1)))).decode().splitlines()
+    assert lines[0] == ",".join(header)
+    assert dict(zip(header, lines[1].split(",")))["rainfallMm"] == "0.2"
+
+def test_columns_of_mixed_range_cover_both_sources(store):
+    store.add_archive_records([archive_record(START, 10.0)])
+    store.add_live_sample({"liveDataTimestamp": (START + timedelta(minutes=1)).isoformat(),
+                           "outsideTempC": 11.0, "windDirectionText": "N"})
+    columns = store.history_columns(START, START + timedelta(hours=1), "raw")
+    assert columns["fields"][:2] == ["time", "source"]
+    assert {"windDirectionText", "rainfallMm", "outsideTempC"} <= set(columns["fields"])
+    assert columns["columns"][1] == ["archive", "loop"]
+
+def test_rollups_fall_back_to_archive_records_without_counting_twice(store):
+    # An hour backfilled from the archive, then an hour with both sources
+    store.add_archive_records([archive_record(START + timedelta(minutes=5 * i), 10.0) for i in range(24)])
+    for i in range(30):
+        store.add_live_sample({"liveDataTimestamp": (START + timedelta(hours=1, minutes=i)).isoformat(),
+                               "outsideTempC": 20.0})
+    buckets = store.history(START, START + timedelta(hours=2), "1h")["buckets"]
+    # The second hour takes its first 30 minutes from LOOP and the rest from the archive
+    assert [bucket["outsideTempC"]["count"] for bucket in buckets] == [12, 36]
+    assert [bucket["outsideTempC"]["mean"] for bucket in buckets] == [10.0, 18.333]
+    # Archive-only fields still come from the archive records
+    assert [bucket["rainfallMm"]["count"] for bucket in buckets] == [12, 12]
+    assert "forecastRule" not in buckets[0]
+
+    minutes = store.history(START + timedelta(hours=1), START + timedelta(hours=1, minutes=40), "1m")["buckets"]
+    assert [bucket["outsideTempC"]["mean"] for bucket in minutes] == [20.0] * 30 + [10.0, 10.0]
+
+    rows = list(store.iter_history(START, START + timedelta(hours=2), "1h", ["outsideTempC"]))
+    assert [row[1:] for row in rows[1:]] == [[10.0, 10.0, 10.0, 120.0, 12], [10.0, 20.0, 18.333, 660.0, 36]]
+    daily = store.history(START, START + timedelta(days=1), "1d")["buckets"]
+    assert daily[0]["outsideTempC"]["count"] == 48
+
+def test_running_totals_have_no_sum(store):
+    for i in range(3):
+        store.add_live_sample({"liveDataTimestamp": (START + timedelta(minutes=i)).isoformat(),
+                               "dailyRainMm": 1.0 + i, "rainRateMmHr": 2.0})
+    bucket = store.history(START, START + timedelta(hours=1), "1h")["buckets"][0]
+    assert bucket["dailyRainMm"] == {"min": 1.0, "max": 3.0, "mean": 2.0, "sum": None, "count": 3}
+    assert bucket["rainRateMmHr"]["sum"] == 6.0
+
+def make_old_database(path):
+    """A database from before rollups were kept per source, holding one archive record."""
+    store = SampleStore(path)
+    store.add_archive_records([archive_record(START, 10.0)])
+    store.close()
+    db = sqlite3.connect(path)
+    db.executescript("""
+        DROP TABLE rollups;
+        CREATE TABLE rollups (resolution INTEGER, bucket INTEGER, field TEXT, min_value REAL, max_value REAL,
+                              sum_value REAL, sample_count INTEGER, PRIMARY KEY (resolution, bucket, field));
+        PRAGMA user_version = 1;
+    """)
+    db.close()
+
+def test_old_rollups_are_rebuilt_per_source(tmp_path):
+    path = str(tmp_path / "history.db")
+    make_old_database(path)
+    store = SampleStore(path)
+    try:
+        buckets = store.history(START, START + timedelta(hours=1), "1h")["buckets"]
+        assert buckets[0]["outsideTempC"]["mean"] == 10.0
+        assert store.db.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+    finally:
+        store.close()
+
+def test_readonly_store_reads_without_upgrading(tmp_path):
+    path = str(tmp_path / "history.db")
+    make_old_database(path)
+    store = SampleStore(path, readonly=True)
+    try:
+        samples = store.history(START, START + timedelta(hours=1), "raw")["samples"]
+        assert [sample["outsideTempC"] for sample in samples] == [10.0]
+        # Upgrading is left to the process that writes
+        assert store.db.execute("PRAGMA user_version").fetchone()[0] == 1
+        with pytest.raises(sqlite3.OperationalError):
+            store.db.execute("DELETE FROM samples")
+    finally:
+        store.close()
+
+def test_readonly_store_can_open_before_the_database_exists(tmp_path):
+    path = str(tmp_path / "history.db")
+    reader = SampleStore(path, readonly=True)
+    try:
+        with pytest.raises(sqlite3.OperationalError):
+            reader.history(START, START + timedelta(hours=1), "raw")
+        writer = SampleStore(path)
+        writer.add_archive_records([archive_record(START, 10.0)])
+        writer.close()
+        samples = reader.history(START, START + timedelta(hours=1), "raw")["samples"]
+        assert [sample["outsideTempC"] for sample in samples] == [10.0]
+    finally:
+        reader.close()
+
+def test_submitted_writes_run_in_order_and_are_drained_on_close(tmp_path):
+    path = str(tmp_path / "history.db")
+    store = SampleStore(path)
+    for i in range(100):
+        store.submit(store.add_live_sample, {"liveDataTimestamp": (START + timedelta(seconds=i)).isoformat(),
+                                            "outsideTempC": float(i)})
+    store.close()
+
+    store = SampleStore(path)
+    try:
+        samples = store.history(START, START + timedelta(minutes=5), "raw")["samples"]
+        assert [sample["outsideTempC"] for sample in samples] == [float(i) for i in range(100)]
+    finally:
+        store.close()
+
+def test_failed_write_is_logged(store, caplog):
+    future = store.submit(store.add_archive_records, [{"outsideTempC": 1.0}])
+    with pytest.raises(KeyError):
+        future.result()
+    assert "Failed to store samples." in caplog.text
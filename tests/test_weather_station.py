@@ -0,0 +1,198 @@
+import asyncio
+import time
+
+import pytest
+import serial
+
+from metrics import WAKE_RETRIES
+from simulator import with_crc
+from transport import RESPONSE_TIMEOUT_MAX, DavisProtocol
+from weather_station import RECONNECT_BACKOFF_MIN, LoopStream, StationSession, get_console_time, wake_up
+
+class ReplyingTransport:
+    """Feeds the queued replies to the protocol, one per write."""
+
+    def __init__(self, protocol, replies):
+        self.protocol = protocol
+        self.replies = list(replies)
+
+    def is_closing(self):
+        return False
+
+    def write(self, data):
+        for delay, chunk in self.replies.pop(0) if self.replies else []:
+            asyncio.get_running_loop().call_later(delay, self.protocol.data_received, chunk)
+
+def test_loop_stream_resyncs_after_bad_crc(console):
+    simulator, port = console
+    simulator.faults.update("crc=0.2")
+
+    async def read_samples():
+        session = StationSession(port)
+        stream = LoopStream(session)
+        starts = []
+        start = stream.start
+
+        async def counted_start():
+            starts.append(time.monotonic())
+            return await start()
+
+        stream.start = counted_start
+        try:
+            samples = [await stream.read() for _ in range(20)]
+            return samples, len(starts), session.ser.corrupt_frames
+        finally:
+            await stream.stop()
+            session.close()
+
+    samples, starts, corrupt = asyncio.run(read_samples())
+    assert all(sample is not None for sample in samples)
+    assert corrupt > 0
+    # Every corrupt packet was skipped within the one running LPS command
+    assert starts == 1
+
+def test_wake_up_retries_an_unanswered_wake_up(console):
+    simulator, port = console
+
+    async def wake_after_ignored_attempt():
+        session = StationSession(port)
+        try:
+            await session.ensure_ready()
+            # Teaches the link's response timer how quickly the console replies
+            assert await session.run(get_console_time) is not None
+
+            simulator.faults.update("wake=1")
+            asyncio.get_running_loop().call_later(0.15, simulator.faults.update, "reset")
+            retries = WAKE_RETRIES.labels().value
+            session.last_activity = 0.0
+            started = time.monotonic()
+            await session.ensure_ready()
+            elapsed = time.monotonic() - started
+            return WAKE_RETRIES.labels().value - retries, elapsed, await session.run(get_console_time)
+        finally:
+            session.close()
+
+    retries, elapsed, console_time = asyncio.run(wake_after_ignored_attempt())
+    assert retries >= 1
+    # Retried on the observed reply time instead of a fixed worst-case wait
+    assert elapsed < RESPONSE_TIMEOUT_MAX
+    # Nothing left over from the unanswered attempts confuses the next command
+    assert console_time is not None
+
+def test_session_backs_off_and_reconnects_when_the_console_stops_answering(console):
+    simulator, port = console
+
+    async def lose_and_regain_console():
+        session = StationSession(port)
+        try:
+            assert await session.run(get_console_time) is not None
+            first = session.connection_id
+
+            # The console stops answering wake-ups: the link is dropped
+            simulator.faults.update("wake=1")
+            session.last_activity = 0.0
+            with pytest.raises(serial.SerialException):
+                await session.ensure_ready()
+            dropped = (session.is_open, session.backoff, session.next_attempt - time.monotonic())
+
+            # Until the backoff has passed the port is not even reopened
+            simulator.faults.update("reset")
+            with pytest.raises(serial.SerialException, match="backing off"):
+                await session.run(get_console_time)
+            backing_off = session.is_open
+
+            session.next_attempt = time.monotonic()
+            console_time = await session.run(get_console_time)
+            return first, dropped, backing_off, session.connection_id, session.backoff, console_time
+        finally:
+            session.close()
+
+    first, dropped, backing_off, connection_id, backoff, console_time = asyncio.run(lose_and_regain_console())
+    is_open, doubled, retry_in = dropped
+    assert not is_open and not backing_off
+    assert doubled == 2 * RECONNECT_BACKOFF_MIN
+    assert 0 < retry_in <= RECONNECT_BACKOFF_MIN
+    # The port was reopened as a new connection and commands work again
+    assert connection_id == first + 1
+    assert console_time is not None
+    assert backoff == RECONNECT_BACKOFF_MIN
+
+def test_wake_up_ignores_a_loop_packet_still_in_flight():
+    # A LOOP packet's \n\r comes before its CRC, so its tail looks like a wake-up reply
+    loop_tail = bytes(60) + b'\n\r' + b'\x12\x34'
+
+    async def wake_during_cancelled_stream():
+        ser = DavisProtocol(timeout=1)
+        ser.connection_made(ReplyingTransport(ser, [
+            [(0.0, loop_tail), (0.02, b'\n\r')],
+            [(0.01, b'\n\r')],
+        ]))
+        retries = WAKE_RETRIES.labels().value
+        awake = await wake_up(ser)
+        return awake, WAKE_RETRIES.labels().value - retries, bytes(ser.buffer)
+
+    awake, retries, left = asyncio.run(wake_during_cancelled_stream())
+    assert awake
+    # The packet's tail was not taken for the reply
+    assert retries == 1
+    assert left == b''
+
+def test_replies_to_a_retried_write_are_not_timed():
+    async def wake_after_one_unanswered_attempt():
+        ser = DavisProtocol(timeout=1)
+        ser.connection_made(ReplyingTransport(ser, [[], [(0.01, b'\n\r')], [(0.01, b'\x06')]]))
+        awake = await wake_up(ser)
+        retried = ser.response_times.smoothed
+        # A write answered at the first try is timed again
+        ser.write(b'TEST\n')
+        await ser.read(1, timeout=1)
+        return awake, retried, ser.response_times.smoothed
+
+    awake, retried, timed = asyncio.run(wake_after_one_unanswered_attempt())
+    assert awake
+    # Which of the two wake-ups the reply answered is unknown (Karn's rule)
+    assert retried is None
+    assert timed is not None and timed < 0.5
+
+def test_read_frame_checks_chunks_as_they_arrive():
+    frame = with_crc(b'LOO' + bytes(94))
+    corrupt = frame[:-1] + bytes([frame[-1] ^ 0xFF])
+    stream = b'\x00\x01' + corrupt[:40] + frame + corrupt + frame
+
+    async def read_frames():
+        ser = DavisProtocol(timeout=1)
+        ser.connection_made(ReplyingTransport(ser, []))
+        for start in range(0, len(stream), 7):
+            asyncio.get_running_loop().call_later(0.001 * start, ser.data_received, stream[start:start + 7])
+        dropped = []
+        frames = [await ser.read_frame(99, b'LOO', on_corrupt=dropped.append) for _ in range(2)]
+        return frames, dropped, bytes(ser.buffer)
+
+    frames, dropped, left = asyncio.run(read_frames())
+    assert frames == [frame, frame]
+    # The truncated copy runs into the next frame, so it fails its CRC too
+    assert corrupt in dropped and len(dropped) >= 2
+    assert left == b''
+
+def test_stopping_a_loop_stream_leaves_the_reply_time_alone():
+    loop_packet = with_crc(b'LOO' + bytes(94))
+
+    async def start_stop_start():
+        session = StationSession("/dev/null")
+        session.ser = ser = DavisProtocol(timeout=1)
+        # LPS is acknowledged after 50 ms; the cancel is followed at once by a packet still in flight
+        ack = [(0.05, b'\x06')]
+        ser.connection_made(ReplyingTransport(ser, [ack, [(0.005, loop_packet)], ack]))
+        session.connection_id = 1
+        session.last_activity = time.monotonic()
+        stream = LoopStream(session)
+        assert await stream.start()
+        started = (ser.response_times.smoothed, ser.response_times.deviation)
+        await stream.stop()
+        stopped = (ser.response_times.smoothed, ser.response_times.deviation)
+        assert await stream.start()
+        return started, stopped, ser.response_times.smoothed
+
+    started, stopped, restarted = asyncio.run(start_stop_start())
+    assert stopped == started
+    assert restarted > 0.04
@@ -0,0 +1,219 @@
+import asyncio
+import serial
+from crc import Crc16
+from metrics import BYTES_READ, RESYNC_BYTES
+
+# --- Configuration ---
+# Bounds of the adaptive reply timeout (seconds); a sleeping console answers
+# a wake-up within 1.2 s, an awake one within a few milliseconds
+RESPONSE_TIMEOUT_MIN = 0.1
+RESPONSE_TIMEOUT_MAX = 1.2
+# Gains of the smoothed reply time and of its mean deviation (RFC 6298)
+RESPONSE_GAIN = 1 / 8
+DEVIATION_GAIN = 1 / 4
+
+class ResponseTimer:
+    """
+    Smoothed time between a command being written and the first byte of
+    the reply, and its mean deviation. timeout() is the time after which a
+    reply is overdue on this link, like TCP's retransmission timeout.
+    """
+
+    def __init__(self):
+        self.smoothed = None
+        self.deviation = 0.0
+
+    def observe(self, seconds):
+        seconds = min(seconds, RESPONSE_TIMEOUT_MAX)
+        if self.smoothed is None:
+            self.smoothed = seconds
+            self.deviation = seconds / 2
+        else:
+            self.deviation += DEVIATION_GAIN * (abs(seconds - self.smoothed) - self.deviation)
+            self.smoothed += RESPONSE_GAIN * (seconds - self.smoothed)
+
+    def timeout(self):
+        if self.smoothed is None:
+            return RESPONSE_TIMEOUT_MAX
+        return min(max(self.smoothed + 4 * self.deviation, RESPONSE_TIMEOUT_MIN), RESPONSE_TIMEOUT_MAX)
+
+class DavisProtocol(asyncio.Protocol):
+    """
+    asyncio protocol for the console's serial link.
+
+    Incoming bytes are buffered as they arrive and handed out by awaitable
+    reads that mirror pyserial: read(size) and read_until(expected) return
+    what arrived before the timeout, which may be short. read_frame()
+    finds whole packets in the byte stream by their header and CRC. Nothing
+    blocks the event loop; a closed link raises serial.SerialException.
+
+    The time from each write to the first byte that answers it is fed to a
+    ResponseTimer, so commands can size their retries to the link. Replies
+    to a write sent again before the first was answered are not timed, and
+    neither is anything after a write(data, timed=False).
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.transport = None
+        self.buffer = bytearray()
+        self.waiter = None
+        self.error = None
+        self.response_times = ResponseTimer()
+        self.sent_at = None
+        self.retransmitted = False
+        # Frames dropped by read_frame() for failing their CRC
+        self.corrupt_frames = 0
+
+    # --- asyncio.Protocol ---
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        BYTES_READ.inc(len(data))
+        if self.sent_at is not None:
+            if not self.retransmitted:
+                self.response_times.observe(asyncio.get_running_loop().time() - self.sent_at)
+            self.sent_at = None
+        self.buffer += data
+        self._wake()
+
+    def connection_lost(self, exc):
+        self.error = exc or serial.SerialException("Serial port closed.")
+        self.transport = None
+        self._wake()
+
+    # --- pyserial-style interface ---
+
+    @property
+    def is_open(self):
+        return self.transport is not None and not self.transport.is_closing()
+
+    def write(self, data, timed=True):
+        if not self.is_open:
+            raise serial.SerialException("Serial port is not open.")
+        self.transport.write(data)
+        if not timed:
+            # Whatever arrives next, such as the rest of a cancelled LOOP
+            # stream, is not a reply to this write
+            return
+        if self.sent_at is None:
+            self.sent_at = asyncio.get_running_loop().time()
+            self.retransmitted = False
+        else:
+            # A reply may now answer either write, so it is not timed
+            # (Karn's rule); a retried wake-up leaves the estimate alone
+            self.retransmitted = True
+
+    def reset_input_buffer(self):
+        # An unanswered write stays outstanding, so a retry after this
+        # still counts as one
+        self.buffer.clear()
+
+    def response_timeout(self):
+        """Seconds after which a reply on this link is overdue."""
+        return self.response_times.timeout()
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+    async def read(self, size=1, timeout=None):
+        deadline = self._deadline(timeout)
+        while len(self.buffer) < size:
+            if not await self._wait(deadline):
+                break
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    async def read_until(self, expected=b'\n', timeout=None):
+        deadline = self._deadline(timeout)
+        start = 0
+        while True:
+            end = self.buffer.find(expected, start)
+            if end >= 0:
+                end += len(expected)
+                break
+            # A terminator split across chunks starts in the last few bytes
+            start = max(0, len(self.buffer) - len(expected) + 1)
+            if not await self._wait(deadline):
+                end = len(self.buffer)
+                break
+        data = bytes(self.buffer[:end])
+        del self.buffer[:end]
+        return data
+
+    async def read_frame(self, size, header, timeout=None, on_corrupt=None):
+        """
+        Returns the next size-byte frame that starts with header and ends in
+        a matching CRC, or None if none arrived before the timeout. Bytes
+        before a header are skipped, and a frame failing its CRC is passed
+        to on_corrupt and dropped past its header only, so a packet that
+        starts inside it (after lost bytes) is still found.
+
+        The CRC of the frame being assembled is updated with each chunk as
+        it arrives, so no byte is run through it twice unless the frame has
+        to be searched again after a resync.
+        """
+        deadline = self._deadline(timeout)
+        crc = Crc16()
+        checked = 0
+        while True:
+            start = self.buffer.find(header)
+            # Without a header, only a partial one at the very end is kept
+            skip = start if start >= 0 else max(0, len(self.buffer) - len(header) + 1)
+            if skip:
+                RESYNC_BYTES.inc(skip)
+                del self.buffer[:skip]
+                crc.reset()
+                checked = 0
+            if start >= 0:
+                end = min(len(self.buffer), size)
+                if end > checked:
+                    with memoryview(self.buffer) as view, view[checked:end] as chunk:
+                        crc.update(chunk)
+                    checked = end
+                if checked == size:
+                    frame = bytes(self.buffer[:size])
+                    if crc.valid:
+                        del self.buffer[:size]
+                        return frame
+                    self.corrupt_frames += 1
+                    if on_corrupt is not None:
+                        on_corrupt(frame)
+                    RESYNC_BYTES.inc(1)
+                    del self.buffer[:1]
+                    crc.reset()
+                    checked = 0
+                    continue
+            if not await self._wait(deadline):
+                return None
+
+    # --- Waiting ---
+
+    def _deadline(self, timeout):
+        return asyncio.get_running_loop().time() + (self.timeout if timeout is None else timeout)
+
+    def _wake(self):
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    async def _wait(self, deadline):
+        """Waits for more data until deadline; False once it has passed."""
+        if self.error is not None:
+            raise serial.SerialException(str(self.error))
+        loop = asyncio.get_running_loop()
+        if loop.time() >= deadline:
+            return False
+        self.waiter = loop.create_future()
+        timer = loop.call_at(deadline, self._wake)
+        try:
+            await self.waiter
+        finally:
+            timer.cancel()
+            self.waiter = None
+        if self.error is not None:
+            raise serial.SerialException(str(self.error))
+        return True
@@ -1,8 +1,22 @@
+import asyncio
+import logging
 import serial
+import serial_asyncio
 import time
 import struct
 import sys
 from datetime import datetime
+# CRC_TABLE and the unit helpers imported from packets used to be defined
+# here; they are re-exported so existing imports from weather_station keep working
+from crc import CRC_TABLE, crc16, check_packet
+from transport import DavisProtocol, RESPONSE_TIMEOUT_MAX
+from metrics import (
+    COMMAND_SECONDS, COMMAND_FAILURES, CRC_ERRORS, PARSE_SECONDS, WAKE_RETRIES, RECONNECTS, LINK_DROPS
+)
+from packets import (
+    LOOP_LAYOUT, LOOP2_LAYOUT, HILOWS_LAYOUT,
+    f_to_c, mph_to_ms, inhg_to_hpa, parse_time, wind_deg_to_text, round_safe
+)
 
 # --- Configuration ---
 # Update this to your station's serial port
@@ -10,408 +24,492 @@ SERIAL_PORT = 'COM3'
 BAUD_RATE = 19200
 SERIAL_TIMEOUT = 5.0
 
-# --- CRC-CCITT (0x1021) Table ---
-CRC_TABLE = [
-    0x0, 0x1021, 0x2042, 0x3063, 0x4084, 0x50a5, 0x60c6, 0x70e7,
-    0x8108, 0x9129, 0xa14a, 0xb16b, 0xc18c, 0xd1ad, 0xe1ce, 0xf1ef,
-    0x1231, 0x210, 0x3273, 0x2252, 0x52b5, 0x4294, 0x72f7, 0x62d6,
-    0x9339, 0x8318, 0xb37b, 0xa35a, 0xd3bd, 0xc39c, 0xf3ff, 0xe3de,
-    0x2462, 0x3443, 0x420, 0x1401, 0x64e6, 0x74c7, 0x44a4, 0x5485,
-    0xa56a, 0xb54b, 0x8528, 0x9509, 0xe5ee, 0xf5cf, 0xc5ac, 0xd58d,
-    0x3653, 0x2672, 0x1611, 0x630, 0x76d7, 0x66f6, 0x5695, 0x46b4,
-    0xb75b, 0xa77a, 0x9719, 0x8738, 0xf7df, 0xe7fe, 0xd79d, 0xc7bc,
-    0x48c4, 0x58e5, 0x6886, 0x78a7, 0x840, 0x1861, 0x2802, 0x3823,
-    0xc9cc, 0xd9ed, 0xe98e, 0xf9af, 0x8948, 0x9969, 0xa90a, 0xb92b,
-    0x5af5, 0x4ad4, 0x7ab7, 0x6a96, 0x1a71, 0xa50, 0x3a33, 0x2a12,
-    0xdbfd, 0xcbdc, 0xfbbf, 0xeb9e, 0x9b79, 0x8b58, 0xbb3b, 0xab1a,
-    0x6ca6, 0x7c87, 0x4ce4, 0x5cc5, 0x2c22, 0x3c03, 0xc60, 0x1c41,
-    0xedae, 0xfd8f, 0xcdec, 0xddcd, 0xad2a, 0xbd0b, 0x8d68, 0x9d49,
-    0x7e97, 0x6eb6, 0x5ed5, 0x4ef4, 0x3e13, 0x2e32, 0x1e51, 0xe70,
-    0xff9f, 0xefbe, 0xdfdd, 0xcffc, 0xbf1b, 0xaf3a, 0x9f59, 0x8f78,
-    0x9188, 0x81a9, 0xb1ca, 0xa1eb, 0xd10c, 0xc12d, 0xf14e, 0xe16f,
-    0x1080, 0xa1, 0x30c2, 0x20e3, 0x5004, 0x4025, 0x7046, 0x6067,
-    0x83b9, 0x9398, 0xa3fb, 0xb3da, 0xc33d, 0xd31c, 0xe37f, 0xf35e,
-    0x2b1, 0x1290, 0x22f3, 0x32d2, 0x4235, 0x5214, 0x6277, 0x7256,
-    0xb5ea, 0xa5cb, 0x95a8, 0x8589, 0xf56e, 0xe54f, 0xd52c, 0xc50d,
-    0x34e2, 0x24c3, 0x14a0, 0x481, 0x7466, 0x6447, 0x5424, 0x4405,
-    0xa7db, 0xb7fa, 0x8799, 0x97b8, 0xe75f, 0xf77e, 0xc71d, 0xd73c,
-    0x26d3, 0x36f2, 0x691, 0x16b0, 0x6657, 0x7676, 0x4615, 0x5634,
-    0xd94c, 0xc96d, 0xf90e, 0xe92f, 0x99c8, 0x89e9, 0xb98a, 0xa9ab,
-    0x5844, 0x4865, 0x7806, 0x6827, 0x18c0, 0x8e1, 0x3882, 0x28a3,
-    0xcb7d, 0xdb5c, 0xeb3f, 0xfb1e, 0x8bf9, 0x9bd8, 0xabbb, 0xbb9a,
-    0x4a75, 0x5a54, 0x6a37, 0x7a16, 0xaf1, 0x1ad0, 0x2ab3, 0x3a92,
-    0xfd2e, 0xed0f, 0xdd6c, 0xcd4d, 0xbdaa, 0xad8b, 0x9de8, 0x8dc9,
-    0x7c26, 0x6c07, 0x5c64, 0x4c45, 0x3ca2, 0x2c83, 0x1ce0, 0xcc1,
-    0xef1f, 0xff3e, 0xcf5d, 0xdf7c, 0xaf9b, 0xbfba, 0x8fd9, 0x9ff8,
-    0x6e17, 0x7e36, 0x4e55, 0x5e74, 0x2e93, 0x3eb2, 0xed1, 0x1ef0
-]
-
-# --- Unit Conversion & Helpers ---
-
-def f_to_c(f_temp):
-    if f_temp is None: return None
-    return (f_temp - 32.0) * 5.0 / 9.0
-
-def mph_to_ms(mph_speed):
-    if mph_speed is None: return None
-    return mph_speed * 0.44704
-
-def inhg_to_hpa(inhg_press):
-    if inhg_press is None: return None
-    return inhg_press * 33.8639
-
-def parse_time(time_val):
-    if time_val == 65535: # 0xFFFF
-        return None
-    try:
-        hour = time_val // 100
-        minute = time_val % 100
-        return f"{hour:02d}:{minute:02d}"
-    except Exception:
-        return None
-
-def wind_deg_to_text(deg):
-    if deg is None:
-        return None
-    directions = [
-        "N", "NNE", "NE", "ENE", "E", "ESE", "SE", "SSE",
-        "S", "SSW", "SW", "WSW", "W", "WNW", "NW", "NNW"
-    ]
-    index = round(deg / (360. / 16)) % 16
-    return directions[index]
-
-def round_safe(value, precision=3):
-    if isinstance(value, (int, float)):
-        return round(value, precision)
-    return value
+# Time allowed for a whole command (seconds), on top of SERIAL_TIMEOUT per
+# read; commands not listed here (such as an archive download) only have
+# the per-read limit
+COMMAND_TIMEOUTS = {
+    "wake_up": 8.0,
+    "get_firmware_ver": 3.0,
+    "get_firmware_nver": 3.0,
+    "get_console_time": 2.0,
+    "get_data_packets": 8.0,
+    "start_loop_stream": 2.0,
+    "read_loop_packet": 5.0,
+    "get_hilows_packet": 3.0,
+}
+
+# --- Session Settings ---
+# The console is only woken again after this many seconds without traffic
+WAKE_IDLE_SECONDS = 30.0
+# Wake-up attempts; each waits twice as long as the one before, starting
+# from the link's usual reply time (see ResponseTimer in transport.py)
+WAKE_ATTEMPTS = 5
+# Consecutive failed commands before the port is closed and reopened
+MAX_COMMAND_FAILURES = 3
+# Reconnect backoff (seconds), doubled after every failed attempt
+RECONNECT_BACKOFF_MIN = 1.0
+RECONNECT_BACKOFF_MAX = 60.0
+
+# --- Streaming Settings ---
+# Packets requested per LPS command (LOOP1 and LOOP2 alternate, ~2s each)
+LPS_STREAM_COUNT = 200
+# The LPS command is re-issued when this many packets are left
+LPS_REISSUE_MARGIN = 2
+# Time allowed for an in-flight packet to arrive after cancelling a stream
+LPS_CANCEL_SETTLE = 0.2
+
+log = logging.getLogger(__name__)
 
 def calc_crc(data):
-    crc = 0
-    for byte in data:
-        if isinstance(byte, str):
-            byte = ord(byte)
-        table_index = (crc >> 8) ^ byte
-        crc = (CRC_TABLE[table_index] ^ (crc << 8)) & 0xFFFF
-    return crc
+    if isinstance(data, str):
+        data = data.encode('latin-1')
+    return crc16(data, 0)
 
 # --- Serial Command Functions ---
 
-def wake_up(ser):
-    print("Attempting to wake up console...")
-    for _ in range(3):
+async def wake_up(ser):
+    log.debug("Attempting to wake up console.")
+    timeout = ser.response_timeout()
+    for attempt in range(WAKE_ATTEMPTS):
         try:
+            # A LOOP packet still in flight from a cancelled stream ends in \n\r too, so
+            # whatever is queued is dropped and only a bare \n\r counts as the reply
+            ser.reset_input_buffer()
             ser.write(b'\n')
-            response = ser.read(2)
+            response = await ser.read_until(b'\n\r', timeout=timeout)
             if response == b'\n\r':
-                print("Console is awake.")
+                if attempt:
+                    # The console may still answer the earlier attempts
+                    await asyncio.sleep(ser.response_timeout())
+                    ser.reset_input_buffer()
+                log.info("Console is awake.")
                 return True
-            else:
-                print(f"Wake up failed. Got: {response!r}. Retrying...")
-                time.sleep(1.2)
+            WAKE_RETRIES.inc()
+            log.warning("Wake up failed, retrying.", extra={"response": response, "timeout": round(timeout, 3)})
+            timeout = min(timeout * 2, RESPONSE_TIMEOUT_MAX)
         except serial.SerialException as e:
-            print(f"Serial error during wake up: {e}")
+            log.error("Serial error during wake up.", extra={"error": str(e)})
             return False
-    print("Failed to wake up console after 3 attempts.")
+    log.error("Failed to wake up console.", extra={"attempts": WAKE_ATTEMPTS})
     return False
 
-def get_firmware_ver(ser):
+async def get_firmware_ver(ser):
     try:
         ser.write(b'VER\n')
-        ok_response = ser.read_until(b'OK\n\r')
+        ok_response = await ser.read_until(b'OK\n\r')
         if b'OK' not in ok_response:
             return None
-        data = ser.read_until(b'\n\r')
+        data = await ser.read_until(b'\n\r')
         return data.decode('ascii').strip()
     except Exception as e:
-        print(f"Error getting 'VER': {e}")
+        log.error("Error getting VER.", extra={"error": str(e)})
         return None
 
-def get_firmware_nver(ser):
+async def get_firmware_nver(ser):
     try:
         ser.write(b'NVER\n')
-        ok_response = ser.read_until(b'OK\n\r')
+        ok_response = await ser.read_until(b'OK\n\r')
         if b'OK' not in ok_response:
             return None
-        data = ser.read_until(b'\n\r')
+        data = await ser.read_until(b'\n\r')
         return data.decode('ascii').strip()
     except Exception as e:
-        print(f"Error getting 'NVER': {e}")
+        log.error("Error getting NVER.", extra={"error": str(e)})
         return None
 
-def get_console_time(ser):
+async def get_console_time(ser):
     try:
         ser.write(b'GETTIME\n')
-        packet = ser.read(9)
+        packet = await ser.read(9)
         if len(packet) != 9 or packet[0:1] != b'\x06':
             return None
         
-        data_to_check = packet[1:7]
-        received_crc = struct.unpack('>H', packet[7:9])[0]
-        calculated_crc = calc_crc(data_to_check)
-
-        if received_crc != calculated_crc:
+        if crc16(memoryview(packet)[1:9], 0) != 0:
+            CRC_ERRORS.labels("gettime").inc()
             return None
 
-        sec, min, hour, day, month, year_offset = struct.unpack_from('BBBBBB', data_to_check, 0)
+        sec, min, hour, day, month, year_offset = struct.unpack_from('BBBBBB', packet, 1)
         year = year_offset + 1900
         return f"{year}-{month:02d}-{day:02d} {hour:02d}:{min:02d}:{sec:02d}"
     except Exception as e:
-        print(f"Serial error while getting GETTIME: {e}")
+        log.error("Serial error while getting GETTIME.", extra={"error": str(e)})
         return None
 
-def get_data_packets(ser):
+def count_loop_crc_error(packet):
+    CRC_ERRORS.labels("loop2" if packet[4] == 1 else "loop").inc()
+
+async def get_data_packets(ser):
     try:
         ser.write(b'LPS 3 2\n')
-        ack = ser.read(1)
+        ack = await ser.read(1)
         if ack != b'\x06':
-            print(f"Command not acknowledged. Expected 0x06, got: {ack!r}")
+            log.warning("LPS not acknowledged.", extra={"ack": ack})
             return None
         
-        packet1 = ser.read(99)
-        if len(packet1) != 99:
+        packet1 = await ser.read_frame(99, b'LOO', on_corrupt=count_loop_crc_error)
+        if packet1 is None or packet1[4] != 0:
             return None
         
-        packet2 = ser.read(99)
-        if len(packet2) != 99:
+        packet2 = await ser.read_frame(99, b'LOO', on_corrupt=count_loop_crc_error)
+        if packet2 is None or packet2[4] != 1:
             return None
             
         return [packet1, packet2]
     except Exception as e:
-        print(f"Serial error while getting packets: {e}")
+        log.error("Serial error while getting packets.", extra={"error": str(e)})
         return None
 
-def get_hilows_packet(ser):
+async def start_loop_stream(ser, count):
+    try:
+        ser.write(f'LPS 3 {count}\n'.encode('ascii'))
+        ack = await ser.read(1)
+        if ack != b'\x06':
+            log.warning("LPS not acknowledged.", extra={"ack": ack})
+            return None
+        return True
+    except Exception as e:
+        log.error("Serial error while starting LOOP stream.", extra={"error": str(e)})
+        return None
+
+async def read_loop_packet(ser):
+    """
+    The next LOOP or LOOP2 packet of a stream that passes its CRC. Stray
+    bytes and corrupt packets are skipped without losing the packets after
+    them.
+    """
+    try:
+        return await ser.read_frame(99, b'LOO', on_corrupt=count_loop_crc_error)
+    except Exception as e:
+        log.error("Serial error while reading LOOP packet.", extra={"error": str(e)})
+        return None
+
+async def get_hilows_packet(ser):
     try:
         ser.write(b'HILOWS\n')
-        ack = ser.read(1)
+        ack = await ser.read(1)
         if ack != b'\x06':
-            print(f"HILOWS not acknowledged. Expected 0x06, got: {ack!r}")
+            log.warning("HILOWS not acknowledged.", extra={"ack": ack})
             return None
         
-        packet = ser.read(438)
+        packet = await ser.read(438)
         if len(packet) != 438:
             return None
             
         return packet
     except Exception as e:
-        print(f"Serial error while getting HILOWS packet: {e}")
+        log.error("Serial error while getting HILOWS packet.", extra={"error": str(e)})
         return None
 
 # --- Parsing Functions ---
 
 def validate_packet(packet, expected_type, expected_len=99):
-    if packet[0:3] != b'LOO':
+    """
+    Checks the header, type and CRC of a LOOP packet. On success the payload
+    is returned as a memoryview into the packet rather than a copy.
+    """
+    if len(packet) < expected_len or packet[0:3] != b'LOO':
         return None, False
         
-    packet_type = struct.unpack_from('B', packet, 4)[0]
-    if packet_type != expected_type:
+    if packet[4] != expected_type:
         return None, False
 
-    data_to_check = packet[0:expected_len-2]
-    received_crc = struct.unpack('>H', packet[expected_len-2:expected_len])[0]
-    calculated_crc = calc_crc(data_to_check)
-    
-    if received_crc != calculated_crc:
+    if not check_packet(packet, expected_len):
+        CRC_ERRORS.labels("loop2" if expected_type else "loop").inc()
         return None, False
         
-    return data_to_check, True
+    return memoryview(packet)[:expected_len-2], True
 
 def parse_loop_packet(packet):
-    data_to_check, is_valid = validate_packet(packet, expected_type=0, expected_len=99)
-    if not is_valid:
-        return None
-        
-    data = {}
-    try:
-        raw_barometer = struct.unpack_from('<H', data_to_check, 7)[0]
-        data['barometerHpa'] = round_safe(inhg_to_hpa(raw_barometer / 1000.0 if raw_barometer != 0 else None))
-        
-        raw_inside_temp = struct.unpack_from('<h', data_to_check, 9)[0]
-        data['insideTempC'] = round_safe(f_to_c(raw_inside_temp / 10.0 if raw_inside_temp != 32767 else None))
-        
-        raw_inside_hum = struct.unpack_from('B', data_to_check, 11)[0]
-        data['insideHumidityPercent'] = raw_inside_hum if raw_inside_hum != 255 else None
-        
-        raw_outside_temp = struct.unpack_from('<h', data_to_check, 12)[0]
-        data['outsideTempC'] = round_safe(f_to_c(raw_outside_temp / 10.0 if raw_outside_temp != 32767 else None))
-        
-        data['windSpeedMs'] = round_safe(mph_to_ms(struct.unpack_from('B', data_to_check, 14)[0]))
-        data['avgWind10minMs'] = round_safe(mph_to_ms(struct.unpack_from('B', data_to_check, 15)[0]))
-        
-        wind_dir_deg = struct.unpack_from('<H', data_to_check, 16)[0]
-        data['windDirectionDeg'] = wind_dir_deg
-        data['windDirectionText'] = wind_deg_to_text(wind_dir_deg)
+    with PARSE_SECONDS.labels("loop").time():
+        data_to_check, is_valid = validate_packet(packet, expected_type=0, expected_len=99)
+        if not is_valid:
+            return None
 
-        raw_outside_hum = struct.unpack_from('B', data_to_check, 33)[0]
-        data['outsideHumidityPercent'] = raw_outside_hum if raw_outside_hum != 255 else None
-        
-        RAIN_CLICK_TO_IN = 0.01
-        IN_TO_MM = 25.4
+        try:
+            return LOOP_LAYOUT.decode(data_to_check)
+        except Exception as e:
+            log.error("Error parsing LOOP1.", extra={"error": str(e)})
+            return None
 
-        rain_rate_clicks_hr = struct.unpack_from('<H', data_to_check, 41)[0]
-        data['rainRateMmHr'] = round_safe((rain_rate_clicks_hr * RAIN_CLICK_TO_IN) * IN_TO_MM)
-        
-        daily_rain_clicks = struct.unpack_from('<H', data_to_check, 50)[0]
-        data['dailyRainMm'] = round_safe((daily_rain_clicks * RAIN_CLICK_TO_IN) * IN_TO_MM)
-        
-        storm_rain_clicks = struct.unpack_from('<H', data_to_check, 46)[0]
-        data['stormRainMm'] = round_safe((storm_rain_clicks * RAIN_CLICK_TO_IN) * IN_TO_MM)
+def parse_loop2_packet(packet):
+    with PARSE_SECONDS.labels("loop2").time():
+        data_to_check, is_valid = validate_packet(packet, expected_type=1, expected_len=99)
+        if not is_valid:
+            return None
 
-        monthly_rain_clicks = struct.unpack_from('<H', data_to_check, 52)[0]
-        data['monthlyRainMm'] = round_safe((monthly_rain_clicks * RAIN_CLICK_TO_IN) * IN_TO_MM)
-        
-        yearly_rain_clicks = struct.unpack_from('<H', data_to_check, 54)[0]
-        data['yearlyRainMm'] = round_safe((yearly_rain_clicks * RAIN_CLICK_TO_IN) * IN_TO_MM)
-        
-        raw_battery_volt = struct.unpack_from('<H', data_to_check, 87)[0]
-        data['consoleBatteryV'] = round_safe(((raw_battery_volt * 300) / 512) / 100.0)
-        
-        sunrise = struct.unpack_from('<H', data_to_check, 91)[0]
-        sunset = struct.unpack_from('<H', data_to_check, 93)[0]
-        data['sunrise'] = f"{sunrise // 100:02d}:{sunrise % 100:02d}"
-        data['sunset'] = f"{sunset // 100:02d}:{sunset % 100:02d}"
+        try:
+            return LOOP2_LAYOUT.decode(data_to_check)
+        except Exception as e:
+            log.error("Error parsing LOOP2.", extra={"error": str(e)})
+            return None
 
-        return data
-    except Exception as e:
-        print(f"Error parsing LOOP1: {e}")
-        return None
+def parse_hilows_packet(packet, lazy=False):
+    """
+    Validates and decodes a HILOWS packet. With lazy, the validated packet
+    is returned as a LazyRecord whose fields are decoded only when read.
+    """
+    with PARSE_SECONDS.labels("hilows").time():
+        if len(packet) < 438 or not check_packet(packet, 438):
+            CRC_ERRORS.labels("hilows").inc()
+            log.warning("HILOWS CRC error.", extra={"length": len(packet)})
+            return None
 
-def parse_loop2_packet(packet):
-    data_to_check, is_valid = validate_packet(packet, expected_type=1, expected_len=99)
-    if not is_valid:
-        return None
+        if lazy:
+            return HILOWS_LAYOUT.lazy(memoryview(packet)[:438])
+        try:
+            return HILOWS_LAYOUT.decode(packet)
+        except Exception as e:
+            log.error("Error parsing HILOWS.", extra={"error": str(e)})
+            return None
 
-    data = {}
-    try:
-        raw_10m_avg_wind = struct.unpack_from('<H', data_to_check, 18)[0]
-        data['avgWind10minMsHires'] = round_safe(mph_to_ms(raw_10m_avg_wind / 10.0 if raw_10m_avg_wind != 32767 else None))
-        
-        raw_2m_avg_wind = struct.unpack_from('<H', data_to_check, 20)[0]
-        data['avgWind2minMs'] = round_safe(mph_to_ms(raw_2m_avg_wind / 10.0 if raw_2m_avg_wind != 32767 else None))
+# --- Session Management ---
 
-        raw_10m_gust = struct.unpack_from('<H', data_to_check, 22)[0]
-        data['windGust10minMs'] = round_safe(mph_to_ms(raw_10m_gust / 10.0 if raw_10m_gust != 32767 else None))
-        
-        data['windGust10minDirDeg'] = struct.unpack_from('<H', data_to_check, 24)[0]
+class StationSession:
+    """
+    Owns a long-lived serial connection to the console.
 
-        raw_dewpoint = struct.unpack_from('<h', data_to_check, 30)[0]
-        data['dewpointC'] = round_safe(f_to_c(raw_dewpoint if raw_dewpoint != 32767 else None))
-        
-        raw_heat_index = struct.unpack_from('<h', data_to_check, 35)[0]
-        data['heatIndexC'] = round_safe(f_to_c(raw_heat_index if raw_heat_index != 32767 else None))
+    The port stays open between polls and the console is only woken up when
+    the link has been idle or a command failed. A dropped link is closed and
+    reopened with exponential backoff. The port is driven by a DavisProtocol
+    on the running event loop, and every command has its own time limit
+    (COMMAND_TIMEOUTS).
+    """
 
-        raw_wind_chill = struct.unpack_from('<h', data_to_check, 37)[0]
-        data['windChillC'] = round_safe(f_to_c(raw_wind_chill if raw_wind_chill != 32767 else None))
+    def __init__(self, port=None, baudrate=BAUD_RATE, timeout=SERIAL_TIMEOUT):
+        self.port = port or SERIAL_PORT
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.ser = None
+        self.connection_id = 0
+        self.last_activity = 0.0
+        self.failures = 0
+        self.backoff = RECONNECT_BACKOFF_MIN
+        self.next_attempt = 0.0
+
+    @property
+    def is_open(self):
+        return self.ser is not None and self.ser.is_open
+
+    async def open(self):
+        log.info("Opening serial port.", extra={"port": self.port})
+        _, self.ser = await serial_asyncio.create_serial_connection(
+            asyncio.get_running_loop(),
+            lambda: DavisProtocol(self.timeout),
+            self.port,
+            baudrate=self.baudrate,
+            bytesize=serial.EIGHTBITS,
+            parity=serial.PARITY_NONE,
+            stopbits=serial.STOPBITS_ONE
+        )
+        if self.connection_id:
+            RECONNECTS.inc()
+        self.connection_id += 1
+        self.last_activity = 0.0
+        self.failures = 0
+
+    def close(self):
+        if self.is_open:
+            self.ser.close()
+            log.info("Serial port closed.", extra={"port": self.port})
+        self.ser = None
+
+    def drop(self, reason):
+        """Closes the link and schedules the next reconnect attempt."""
+        LINK_DROPS.inc()
+        log.warning("Dropping serial link.", extra={"reason": reason, "retry_in": round(self.backoff, 1)})
+        try:
+            self.close()
+        except serial.SerialException:
+            self.ser = None
+        self.next_attempt = time.monotonic() + self.backoff
+        self.backoff = min(self.backoff * 2, RECONNECT_BACKOFF_MAX)
+
+    async def ensure_ready(self):
+        """
+        Returns an open, awake serial port. Raises serial.SerialException
+        if the port cannot be opened or the console does not wake up.
+        """
+        if not self.is_open:
+            wait = self.next_attempt - time.monotonic()
+            if wait > 0:
+                raise serial.SerialException(f"Reconnect to {self.port} backing off for {wait:.1f}s.")
+            try:
+                await self.open()
+            except serial.SerialException as e:
+                self.drop(str(e))
+                raise
+
+        if time.monotonic() - self.last_activity > WAKE_IDLE_SECONDS:
+            if not await self.call(wake_up):
+                self.drop("Failed to wake up console.")
+                raise serial.SerialException("Failed to wake up console.")
+            self.last_activity = time.monotonic()
+        return self.ser
+
+    async def call(self, command, *args):
+        """Awaits command(ser, *args) within its time limit; None if that passes."""
+        name = command.__name__
+        start = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(command(self.ser, *args), COMMAND_TIMEOUTS.get(name))
+        except asyncio.TimeoutError:
+            log.warning("Command timed out.", extra={"command": name})
+            result = None
+        COMMAND_SECONDS.labels(name).observe(time.perf_counter() - start)
+        if result is None:
+            COMMAND_FAILURES.labels(name).inc()
+        return result
+
+    async def run(self, command, *args):
+        """
+        Runs a command coroutine such as get_data_packets over the session.
+        A None result counts as a failure; the console is woken up again
+        before the next command and the link is dropped after repeated failures.
+        """
+        ser = await self.ensure_ready()
+        result = await self.call(command, *args)
+        if result is None:
+            self.failures += 1
+            self.last_activity = 0.0
+            # Discard any partial reply so it cannot corrupt the next command
+            try:
+                ser.reset_input_buffer()
+            except serial.SerialException:
+                pass
+            if self.failures >= MAX_COMMAND_FAILURES:
+                self.drop(f"{self.failures} consecutive commands failed.")
+        else:
+            self.failures = 0
+            self.backoff = RECONNECT_BACKOFF_MIN
+            self.last_activity = time.monotonic()
+        return result
 
-        raw_thsw = struct.unpack_from('<h', data_to_check, 39)[0]
-        data['thswIndexC'] = round_safe(f_to_c(raw_thsw if raw_thsw != 32767 else None))
+# --- LOOP Streaming ---
 
-        RAIN_CLICK_TO_IN = 0.01
-        IN_TO_MM = 25.4
-        
-        last_15min_rain_clicks = struct.unpack_from('<H', data_to_check, 52)[0]
-        data['last15minRainMm'] = round_safe((last_15min_rain_clicks * RAIN_CLICK_TO_IN) * IN_TO_MM)
-        
-        last_hour_rain_clicks = struct.unpack_from('<H', data_to_check, 54)[0]
-        data['lastHourRainMm'] = round_safe((last_hour_rain_clicks * RAIN_CLICK_TO_IN) * IN_TO_MM)
-        
-        last_24hr_rain_clicks = struct.unpack_from('<H', data_to_check, 58)[0]
-        data['last24hrRainMm'] = round_safe((last_24hr_rain_clicks * RAIN_CLICK_TO_IN) * IN_TO_MM)
-        
-        return data
-    except Exception as e:
-        print(f"Error parsing LOOP2: {e}")
-        return None
+class LoopStream:
+    """
+    Streams LOOP1/LOOP2 pairs from a single long LPS command.
+
+    read() returns a merged live data dict for every pair as the console
+    sends it, or None when the stream stopped. A corrupt packet only costs
+    its own pair: the stream resynchronizes on the next packet header and
+    carries on. The LPS command is re-issued before its count runs out.
+    Call stop() before running any other command on the session; the next
+    iteration starts the stream again. Every raw packet read is also passed
+    to each packet listener, before it is parsed.
+    """
 
-def parse_hilows_packet(packet):
-    data_to_check = packet[0:436]
-    received_crc = struct.unpack('>H', packet[436:438])[0]
-    calculated_crc = calc_crc(data_to_check)
-    
-    if received_crc != calculated_crc:
-        print("HILOWS CRC ERROR!")
-        return None
-    
-    data = {}
-    try:
-        raw_bar_day_low = struct.unpack_from('<H', data_to_check, 0)[0]
-        data['baroDayLowHpa'] = round_safe(inhg_to_hpa(raw_bar_day_low / 1000.0))
-        
-        raw_bar_day_high = struct.unpack_from('<H', data_to_check, 2)[0]
-        data['baroDayHighHpa'] = round_safe(inhg_to_hpa(raw_bar_day_high / 1000.0))
-        
-        data['baroDayLowTime'] = parse_time(struct.unpack_from('<H', data_to_check, 12)[0])
-        data['baroDayHighTime'] = parse_time(struct.unpack_from('<H', data_to_check, 14)[0])
-        
-        raw_wind_day_high = struct.unpack_from('B', data_to_check, 16)[0]
-        data['windDayHighMs'] = round_safe(mph_to_ms(raw_wind_day_high))
-        data['windDayHighTime'] = parse_time(struct.unpack_from('<H', data_to_check, 17)[0])
-        
-        raw_wind_month_high = struct.unpack_from('B', data_to_check, 19)[0]
-        data['windMonthHighMs'] = round_safe(mph_to_ms(raw_wind_month_high))
-        
-        raw_wind_year_high = struct.unpack_from('B', data_to_check, 20)[0]
-        data['windYearHighMs'] = round_safe(mph_to_ms(raw_wind_year_high))
-        
-        raw_in_temp_day_high = struct.unpack_from('<h', data_to_check, 21)[0]
-        data['inTempDayHighC'] = round_safe(f_to_c(raw_in_temp_day_high / 10.0))
-        
-        raw_in_temp_day_low = struct.unpack_from('<h', data_to_check, 23)[0]
-        data['inTempDayLowC'] = round_safe(f_to_c(raw_in_temp_day_low / 10.0))
-        
-        data['inTempDayHighTime'] = parse_time(struct.unpack_from('<H', data_to_check, 25)[0])
-        data['inTempDayLowTime'] = parse_time(struct.unpack_from('<H', data_to_check, 27)[0])
+    def __init__(self, session, count=LPS_STREAM_COUNT, reissue_margin=LPS_REISSUE_MARGIN):
+        # Keep both even so a re-issue never splits a LOOP1/LOOP2 pair
+        self.session = session
+        self.count = count + count % 2
+        self.reissue_margin = reissue_margin + reissue_margin % 2
+        self.remaining = 0
+        self.connection_id = None
+        self.packet_listeners = []
+
+    @property
+    def active(self):
+        return (self.remaining > 0
+                and self.session.is_open
+                and self.session.connection_id == self.connection_id)
+
+    async def start(self):
+        self.remaining = 0
+        if await self.session.run(start_loop_stream, self.count):
+            self.remaining = self.count
+            self.connection_id = self.session.connection_id
+            return True
+        return False
+
+    async def stop(self):
+        """Cancels the running LPS command so the bus is free for other commands."""
+        if self.active:
+            ser = self.session.ser
+            try:
+                ser.write(b'\n', timed=False)
+                await asyncio.sleep(LPS_CANCEL_SETTLE)
+                ser.reset_input_buffer()
+                self.session.last_activity = time.monotonic()
+            except serial.SerialException as e:
+                self.session.drop(f"Serial error while stopping LOOP stream: {e}")
+        self.remaining = 0
+
+    async def read(self):
+        loop1_data = None
+        while True:
+            if not self.active or self.remaining <= self.reissue_margin:
+                await self.stop()
+                if not await self.start():
+                    return None
+
+            ser = self.session.ser
+            corrupt = ser.corrupt_frames
+            packet = await self.session.run(read_loop_packet)
+            # Packets dropped for a bad CRC were sent too and count against the LPS total
+            self.remaining -= 1 + ser.corrupt_frames - corrupt
+            if packet is None:
+                await self.stop()
+                return None
+            for listener in self.packet_listeners:
+                listener(packet)
+
+            if packet[4] == 0:
+                # A LOOP1 whose LOOP2 was lost is replaced by the next one
+                loop1_data = parse_loop_packet(packet)
+            elif loop1_data is not None:
+                loop2_data = parse_loop2_packet(packet)
+                if loop2_data is not None:
+                    return build_live_data(loop1_data, loop2_data)
+                loop1_data = None
 
-        raw_out_temp_day_low = struct.unpack_from('<h', data_to_check, 47)[0]
-        data['outTempDayLowC'] = round_safe(f_to_c(raw_out_temp_day_low / 10.0))
-        
-        raw_out_temp_day_high = struct.unpack_from('<h', data_to_check, 49)[0]
-        data['outTempDayHighC'] = round_safe(f_to_c(raw_out_temp_day_high / 10.0))
-        
-        data['outTempDayLowTime'] = parse_time(struct.unpack_from('<H', data_to_check, 51)[0])
-        data['outTempDayHighTime'] = parse_time(struct.unpack_from('<H', data_to_check, 53)[0])
-        
-        raw_chill_day_low = struct.unpack_from('<h', data_to_check, 79)[0]
-        data['windChillDayLowC'] = round_safe(f_to_c(raw_chill_day_low))
-        data['windChillDayLowTime'] = parse_time(struct.unpack_from('<H', data_to_check, 81)[0])
-        
-        raw_chill_month_low = struct.unpack_from('<h', data_to_check, 83)[0]
-        data['windChillMonthLowC'] = round_safe(f_to_c(raw_chill_month_low))
-        
-        raw_chill_year_low = struct.unpack_from('<h', data_to_check, 85)[0]
-        data['windChillYearLowC'] = round_safe(f_to_c(raw_chill_year_low))
+# --- Main Data Fetching Function ---
 
-        raw_heat_day_high = struct.unpack_from('<h', data_to_check, 87)[0]
-        data['heatIndexDayHighC'] = round_safe(f_to_c(raw_heat_day_high))
-        data['heatIndexDayHighTime'] = parse_time(struct.unpack_from('<H', data_to_check, 89)[0])
-        
-        raw_heat_month_high = struct.unpack_from('<h', data_to_check, 91)[0]
-        data['heatIndexMonthHighC'] = round_safe(f_to_c(raw_heat_month_high))
-        
-        raw_heat_year_high = struct.unpack_from('<h', data_to_check, 93)[0]
-        data['heatIndexYearHighC'] = round_safe(f_to_c(raw_heat_year_high))
-
-        RAIN_CLICK_TO_IN = 0.01
-        IN_TO_MM = 25.4
-        raw_rain_rate_day_high = struct.unpack_from('<H', data_to_check, 116)[0]
-        data['rainRateDayHighMmHr'] = round_safe((raw_rain_rate_day_high * RAIN_CLICK_TO_IN) * IN_TO_MM)
-        data['rainRateDayHighTime'] = parse_time(struct.unpack_from('<H', data_to_check, 118)[0])
-        
-        raw_rain_rate_hour_high = struct.unpack_from('<H', data_to_check, 120)[0]
-        data['rainRateHourHighMmHr'] = round_safe((raw_rain_rate_hour_high * RAIN_CLICK_TO_IN) * IN_TO_MM)
+def build_live_data(loop1_data, loop2_data):
+    live_data = {**loop1_data, **loop2_data}
+    live_data["liveDataTimestamp"] = datetime.now().isoformat()
+    return live_data
 
-        return data
-    except Exception as e:
-        print(f"Error parsing HILOWS: {e}")
+async def fetch_live_data(session):
+    log.debug("Fetching LOOP packets.")
+    packets = await session.run(get_data_packets)
+    if not packets:
+        log.warning("Failed to retrieve LOOP packets.")
         return None
+    loop1_data = parse_loop_packet(packets[0])
+    loop2_data = parse_loop2_packet(packets[1])
+    if not (loop1_data and loop2_data):
+        log.warning("Failed to parse LOOP packets.")
+        return None
+    return build_live_data(loop1_data, loop2_data)
 
-# --- Main Data Fetching Function ---
+async def fetch_hilows_data(session, lazy=False):
+    log.debug("Fetching HILOWS packet.")
+    hilows_packet = await session.run(get_hilows_packet)
+    if not hilows_packet:
+        log.warning("Failed to retrieve HILOWS packet.")
+        return None
+    hilows_data = parse_hilows_packet(hilows_packet, lazy)
+    if not hilows_data:
+        log.warning("Failed to parse HILOWS packet.")
+    return hilows_data
+
+async def fetch_console_info(session):
+    log.debug("Fetching console info.")
+    return {
+        "consoleTime": await session.run(get_console_time),
+        "firmwareDate": await session.run(get_firmware_ver),
+        "firmwareVersion": await session.run(get_firmware_nver)
+    }
 
-def fetch_all_data():
+async def fetch_all_data(session=None):
     """
-    Connects to the station, fetches all data, and returns a structured dict.
+    Fetches all data over the given session and returns a structured dict.
+    Without a session, a temporary one is opened and closed again.
     """
-    ser = None
+    owns_session = session is None
+    if owns_session:
+        session = StationSession()
     all_data = {
         "liveData": None,
         "hiLowData": None,
@@ -420,72 +518,29 @@ def fetch_all_data():
     }
 
     try:
-        print(f"Opening serial port {SERIAL_PORT}...")
-        ser = serial.Serial(
-            port=SERIAL_PORT,
-            baudrate=BAUD_RATE,
-            bytesize=serial.EIGHTBITS,
-            parity=serial.PARITY_NONE,
-            stopbits=serial.STOPBITS_ONE,
-            timeout=SERIAL_TIMEOUT
-        )
-        
-        if not wake_up(ser):
-            raise Exception("Failed to wake up console.")
-            
-        # --- 1. Fetch Live Data ---
-        print("Fetching LOOP packets...")
-        packets = get_data_packets(ser)
-        if packets:
-            loop1_data = parse_loop_packet(packets[0])
-            loop2_data = parse_loop2_packet(packets[1])
-            if loop1_data and loop2_data:
-                live_data = {**loop1_data, **loop2_data}
-                live_data["liveDataTimestamp"] = datetime.now().isoformat()
-                all_data["liveData"] = live_data
-            else:
-                print("Failed to parse LOOP packets.")
-        else:
-            print("Failed to retrieve LOOP packets.")
-
-        # --- 2. Fetch HILOWS Data ---
-        print("Fetching HILOWS packet...")
-        hilows_packet = get_hilows_packet(ser)
-        if hilows_packet:
-            hilows_data = parse_hilows_packet(hilows_packet)
-            if hilows_data:
-                all_data["hiLowData"] = hilows_data
-            else:
-                print("Failed to parse HILOWS packet.")
-        else:
-            print("Failed to retrieve HILOWS packet.")
-
-        # --- 3. Fetch Console Info ---
-        print("Fetching console info...")
-        all_data["consoleInfo"] = {
-            "consoleTime": get_console_time(ser),
-            "firmwareDate": get_firmware_ver(ser),
-            "firmwareVersion": get_firmware_nver(ser)
-        }
+        all_data["liveData"] = await fetch_live_data(session)
+        all_data["hiLowData"] = await fetch_hilows_data(session)
+        all_data["consoleInfo"] = await fetch_console_info(session)
         
-        print("Data fetch complete.")
+        log.info("Data fetch complete.")
 
     except serial.SerialException as e:
-        print(f"SERIAL ERROR: {e}")
+        log.error("Serial error.", extra={"error": str(e)})
         all_data["error"] = str(e)
     except Exception as e:
-        print(f"An unexpected error occurred: {e}")
+        log.exception("An unexpected error occurred.")
         all_data["error"] = str(e)
     finally:
-        if ser and ser.is_open:
-            ser.close()
-            print(f"Serial port {SERIAL_PORT} closed.")
+        if owns_session:
+            session.close()
     
     return all_data
 
 if __name__ == "__main__":
     # This allows you to run this file directly to test the data fetch
-    print("Running standalone test...")
-    data = fetch_all_data()
+    from logs import setup_logging
+    setup_logging()
+    log.info("Running standalone test.")
+    data = asyncio.run(fetch_all_data())
     import json
     print(json.dumps(data, indent=2))
\ No newline at end of file